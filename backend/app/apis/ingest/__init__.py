@@ -1,57 +1,234 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional, Union, Literal, Annotated
-from pydantic import BaseModel, Field, validator, Discriminator, Tag
-from fastapi import APIRouter, HTTPException, Header, Depends, Request
+from pathlib import Path
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, Optional, Union, Literal, Annotated
+from pydantic import BaseModel, BeforeValidator, Field, Discriminator, Tag
+from fastapi import APIRouter, FastAPI, HTTPException, Header, Depends, Query, Request, Response
 from fastapi.exceptions import RequestValidationError
+import asyncio
 import hashlib
 import json
+import multiprocessing
+import os
+import tempfile
+import uuid
 import asyncpg
+import ijson
 import databutton as db
-from app.env import mode, Mode
+from app.auth import AuthorizedUser
+from app.libs.compression import DecompressedTooLarge, DecompressionError, UnsupportedEncoding, content_encodings, decompress_stream
+from app.libs.database import DbPool, get_database_url
+from app.libs.idempotency import IdempotencyStore, StoredResponse
+from app.libs.metric_catalog import metric_catalog
+from app.libs.partitions import ensure_partitions, is_creating_partition, wait_for_partition_creation
+from app.libs.rollups import SLEEP_EFFICIENCY, SLEEP_HOURS, rollup_upsert
+from app.libs.spool import Spool, SpoolRecordRejected
+from app.libs.structured_log import bind_user, excerpt, get_logger
+from app.libs.swift_datetime import coerce_swift_datetime, parse_swift_datetime, parse_swift_datetimes
+from app.libs.uploads import COMPLETED, FAILED, UploadLimitExceeded, UploadSession, UploadStore
+from app.libs.watermarks import WatermarkStore
+from app.libs.write_batcher import WriteBatcher
 
-router = APIRouter()
+log = get_logger("ingest")
+
+# "sync" validates and writes each delivery before responding; "spool" appends
+# the raw body to the on-disk spool, answers 202 and writes it in the background;
+# "stream" is sync with incremental parsing of large bodies (see below)
+HAE_INGEST_MODE = os.environ.get("HAE_INGEST_MODE", "sync")
+HAE_SPOOL_DIR = os.environ.get("HAE_SPOOL_DIR", "spool/hae")
+HAE_SPOOL_PARTITIONS = int(os.environ.get("HAE_SPOOL_PARTITIONS", "4"))
+HAE_SPOOL_SEGMENT_BYTES = int(os.environ.get("HAE_SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+HAE_SPOOL_FSYNC = os.environ.get("HAE_SPOOL_FSYNC", "true").lower() == "true"
+
+# "stream" parses bodies of HAE_STREAM_MIN_BYTES or more straight from the socket
+# and writes them HAE_STREAM_CHUNK_POINTS points at a time; smaller ones are
+# buffered as in sync mode so body-hash retries are still answered up front
+HAE_STREAM_MIN_BYTES = int(os.environ.get("HAE_STREAM_MIN_BYTES", str(1024 * 1024)))
+HAE_STREAM_CHUNK_POINTS = int(os.environ.get("HAE_STREAM_CHUNK_POINTS", "5000"))
+# Points seen before their metric's name and units are set aside in a temporary
+# file, kept in memory up to this size
+HAE_STREAM_SPILL_MEMORY_BYTES = int(os.environ.get("HAE_STREAM_SPILL_MEMORY_BYTES", str(8 * 1024 * 1024)))
+
+# Bodies may be sent with Content-Encoding gzip or zstd; they are decompressed as
+# a stream and rejected past these limits (decompression bomb protection)
+HAE_MAX_DECOMPRESSED_BYTES = int(os.environ.get("HAE_MAX_DECOMPRESSED_BYTES", str(256 * 1024 * 1024)))
+HAE_MAX_COMPRESSION_RATIO = float(os.environ.get("HAE_MAX_COMPRESSION_RATIO", "1000"))
+
+# "pydantic" validates the full HealthAutoExportPayload model tree; "columnar"
+# decodes common metrics straight into column lists (see decode_columnar)
+HAE_DECODER = os.environ.get("HAE_DECODER", "pydantic")
+
+# Buffered bodies of HAE_DECODE_OFFLOAD_BYTES or more are parsed and validated in
+# a pool of HAE_DECODE_PROCESSES worker processes (0 disables it), so validating a
+# large export does not stall every other request on the event loop
+HAE_DECODE_PROCESSES = int(os.environ.get("HAE_DECODE_PROCESSES", "2"))
+HAE_DECODE_OFFLOAD_BYTES = int(os.environ.get("HAE_DECODE_OFFLOAD_BYTES", str(256 * 1024)))
+hae_decode_executor: Optional[ProcessPoolExecutor] = None
+
+# Deliveries are remembered by body hash (and request_id) so retries are answered
+# with the original response instead of being parsed and written again
+HAE_IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("HAE_IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+HAE_IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("HAE_IDEMPOTENCY_CACHE_SIZE", "10000"))
+HAE_IDEMPOTENCY_PURGE_SECONDS = 3600
+# How often health_metrics partitions for the coming months are checked
+HAE_PARTITION_CHECK_SECONDS = 6 * 3600
+
+hae_idempotency = IdempotencyStore(HAE_IDEMPOTENCY_TTL_SECONDS, HAE_IDEMPOTENCY_CACHE_SIZE)
+
+# Resumable chunked uploads (/hae/uploads) for multi-year backfills. Committed
+# uploads are ingested in the background, committing every
+# HAE_UPLOAD_TX_CHUNK_POINTS points; a processing upload without progress for
+# HAE_UPLOAD_STALE_SECONDS (e.g. after a restart) can be committed again.
+# Chunks are stored in the database until then, so each upload is limited to
+# HAE_UPLOAD_MAX_CHUNKS chunks and HAE_UPLOAD_MAX_STORED_BYTES bytes as sent;
+# HAE_UPLOAD_MAX_BYTES bounds the decompressed document
+HAE_UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get("HAE_UPLOAD_MAX_CHUNK_BYTES", str(16 * 1024 * 1024)))
+HAE_UPLOAD_MAX_CHUNKS = int(os.environ.get("HAE_UPLOAD_MAX_CHUNKS", "1024"))
+HAE_UPLOAD_MAX_STORED_BYTES = int(os.environ.get("HAE_UPLOAD_MAX_STORED_BYTES", str(1024 * 1024 * 1024)))
+HAE_UPLOAD_MAX_BYTES = int(os.environ.get("HAE_UPLOAD_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+HAE_UPLOAD_TX_CHUNK_POINTS = int(os.environ.get("HAE_UPLOAD_TX_CHUNK_POINTS", "50000"))
+hae_uploads = UploadStore(
+    ttl_seconds=float(os.environ.get("HAE_UPLOAD_TTL_SECONDS", str(7 * 24 * 3600))),
+    stale_seconds=float(os.environ.get("HAE_UPLOAD_STALE_SECONDS", "300")),
+    max_chunks=HAE_UPLOAD_MAX_CHUNKS,
+    max_bytes=HAE_UPLOAD_MAX_STORED_BYTES
+)
+hae_upload_tasks: Dict[str, asyncio.Task] = {}
+
+# Latest stored timestamp per user and metric; points at or before it are dropped
+# from a delivery before validation unless the request is flagged as a backfill
+hae_watermarks = WatermarkStore(max_users=int(os.environ.get("HAE_WATERMARK_CACHE_USERS", "10000")))
+
+# With HAE_WRITE_COALESCE, deliveries of up to HAE_WRITE_COALESCE_MAX_POINTS points
+# write their metrics through a shared batcher that merges concurrent deliveries
+# into one INSERT every HAE_WRITE_COALESCE_MS (or HAE_WRITE_COALESCE_ROWS rows);
+# larger deliveries are already bulk writes and use their own connection.
+# Batches commit on the batcher's own connection, so coalescing also requires
+# HAE_TX_CHUNK_POINTS (deliveries committed in chunks rather than atomically)
+HAE_WRITE_COALESCE = os.environ.get("HAE_WRITE_COALESCE", "false").lower() == "true"
+HAE_WRITE_COALESCE_MAX_POINTS = int(os.environ.get("HAE_WRITE_COALESCE_MAX_POINTS", "5000"))
+hae_write_batcher = WriteBatcher(
+    max_delay_seconds=float(os.environ.get("HAE_WRITE_COALESCE_MS", "5")) / 1000,
+    max_rows=int(os.environ.get("HAE_WRITE_COALESCE_ROWS", "20000"))
+)
+
+async def purge_expired_state(pool: asyncpg.Pool) -> None:
+    """Periodically delete expired idempotency keys and upload sessions"""
+    while True:
+        await asyncio.sleep(HAE_IDEMPOTENCY_PURGE_SECONDS)
+        try:
+            purged = await hae_idempotency.purge(pool)
+            log.info("idempotency.purged", purged=purged)
+            purged = await hae_uploads.purge(pool)
+            log.info("uploads.purged", purged=purged)
+        except Exception as e:
+            log.error("purge.failed", error=str(e))
+
+async def maintain_partitions(pool: asyncpg.Pool) -> None:
+    """Keep the health_metrics partitions of the coming months created"""
+    while True:
+        try:
+            created = await ensure_partitions(pool)
+            if created:
+                log.info("partitions.created", partitions=created)
+        except Exception as e:
+            log.error("partitions.failed", error=str(e))
+        await asyncio.sleep(HAE_PARTITION_CHECK_SECONDS)
+
+def start_decode_executor() -> None:
+    global hae_decode_executor
+    if HAE_DECODE_PROCESSES > 0:
+        # Workers are spawned on first use; "spawn" because forking a process
+        # with running threads (logging, asyncpg) is unsafe
+        hae_decode_executor = ProcessPoolExecutor(
+            max_workers=HAE_DECODE_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+def stop_decode_executor() -> None:
+    global hae_decode_executor
+    if hae_decode_executor is not None:
+        hae_decode_executor.shutdown(wait=False, cancel_futures=True)
+        hae_decode_executor = None
+
+@asynccontextmanager
+async def ingest_lifespan(app: FastAPI):
+    """Start the maintenance tasks, and the spool drain workers in spool mode"""
+    pool = app.state.db_pool
+    start_decode_executor()
+    purge_task = None
+    partition_task = None
+    if pool is not None:
+        database_url = get_database_url()
+        metric_catalog.start(lambda: asyncpg.connect(database_url))
+        await metric_catalog.load(pool)
+        purge_task = asyncio.create_task(purge_expired_state(pool))
+        partition_task = asyncio.create_task(maintain_partitions(pool))
+        if HAE_WRITE_COALESCE and HAE_TX_CHUNK_POINTS:
+            hae_write_batcher.start(lambda: asyncpg.connect(database_url))
+        elif HAE_WRITE_COALESCE:
+            log.warning("write_batcher.disabled", reason="deliveries are written in one transaction (HAE_TX_CHUNK_POINTS=0)")
+    
+    spool = None
+    if HAE_INGEST_MODE == "spool":
+        spool = Spool(
+            Path(HAE_SPOOL_DIR),
+            partitions=HAE_SPOOL_PARTITIONS,
+            segment_bytes=HAE_SPOOL_SEGMENT_BYTES,
+            fsync=HAE_SPOOL_FSYNC
+        )
+        
+        async def handle_spooled_delivery(user_id: str, raw_body: bytes, enqueued_at: float) -> None:
+            await drain_spooled_delivery(app.state.db_pool, user_id, raw_body, enqueued_at)
+        
+        spool.start(handle_spooled_delivery)
+        log.info("spool.started", pending=sum(s.depth for s in spool.stats()), path=HAE_SPOOL_DIR)
+    
+    app.state.hae_spool = spool
+    try:
+        yield
+    finally:
+        if spool is not None:
+            await spool.stop()
+        if purge_task is not None:
+            purge_task.cancel()
+        if partition_task is not None:
+            partition_task.cancel()
+        # Interrupted uploads stay "processing" and can be committed again once stale
+        for task in list(hae_upload_tasks.values()):
+            task.cancel()
+        await hae_write_batcher.stop()
+        await metric_catalog.stop()
+        stop_decode_executor()
+        app.state.hae_spool = None
+
+router = APIRouter(lifespan=ingest_lifespan)
 
 # Pydantic models for request validation
 
+# Datetime accepting Swift/ObjC format ('2025-06-25 00:00:00 +0200') or ISO 8601
+SwiftDateTime = Annotated[datetime, BeforeValidator(coerce_swift_datetime)]
+
 # Common metric data point (for HRV, steps, etc.)
 class CommonPoint(BaseModel):
-    date: datetime = Field(..., description="Timestamp of the metric measurement")
+    date: SwiftDateTime = Field(..., description="Timestamp of the metric measurement")
     qty: float = Field(..., description="Metric value/quantity")
-    
-    @validator('date', pre=True)
-    def parse_swift_datetime(cls, v):
-        """Parse Swift/ObjC datetime format: '2025-06-25 00:00:00 +0200'"""
-        if isinstance(v, str):
-            try:
-                return datetime.strptime(v, "%Y-%m-%d %H:%M:%S %z")
-            except ValueError:
-                # Fallback to ISO format
-                return datetime.fromisoformat(v.replace('Z', '+00:00'))
-        return v
 
 # Sleep-specific data point
 class SleepEntry(BaseModel):
-    date: datetime = Field(..., description="Sleep session date")
+    date: SwiftDateTime = Field(..., description="Sleep session date")
     asleep: float = Field(..., description="Time asleep in hours")
     awake: float = Field(..., description="Time awake in hours")
     core: float = Field(..., description="Core sleep time in hours")
     deep: float = Field(..., description="Deep sleep time in hours")
     rem: float = Field(..., description="REM sleep time in hours")
-    sleepStart: datetime = Field(..., description="Sleep start time")
-    sleepEnd: datetime = Field(..., description="Sleep end time")
+    sleepStart: SwiftDateTime = Field(..., description="Sleep start time")
+    sleepEnd: SwiftDateTime = Field(..., description="Sleep end time")
     source: str = Field(..., description="Data source")
     totalSleep: float = Field(..., description="Total sleep time in hours")
-    
-    @validator('date', 'sleepStart', 'sleepEnd', pre=True)
-    def parse_swift_datetime(cls, v):
-        """Parse Swift/ObjC datetime format: '2025-06-25 00:00:00 +0200'"""
-        if isinstance(v, str):
-            try:
-                return datetime.strptime(v, "%Y-%m-%d %H:%M:%S %z")
-            except ValueError:
-                # Fallback to ISO format
-                return datetime.fromisoformat(v.replace('Z', '+00:00'))
-        return v
 
 # Common metric model (HRV, steps, etc.)
 class CommonMetric(BaseModel):
@@ -67,20 +244,10 @@ class SleepMetric(BaseModel):
 
 # Energy data point for workout timeseries
 class EnergyPoint(BaseModel):
-    date: datetime = Field(..., description="Timestamp of energy measurement")
+    date: SwiftDateTime = Field(..., description="Timestamp of energy measurement")
     qty: float = Field(..., description="Energy quantity")
     source: Optional[str] = Field(None, description="Data source")
     units: str = Field(..., description="Energy units (e.g., 'cal')")
-    
-    @validator('date', pre=True)
-    def parse_swift_datetime(cls, v):
-        """Parse Swift/ObjC datetime format: '2025-07-01 06:05:54 +0200'"""
-        if isinstance(v, str):
-            try:
-                return datetime.strptime(v, "%Y-%m-%d %H:%M:%S %z")
-            except ValueError:
-                return datetime.fromisoformat(v.replace('Z', '+00:00'))
-        return v
 
 # Heart rate data structure with Avg/Min/Max
 class HeartRateValues(BaseModel):
@@ -90,26 +257,16 @@ class HeartRateValues(BaseModel):
 
 # Heart rate data point for workout timeseries
 class HeartRatePoint(BaseModel):
-    date: datetime = Field(..., description="Timestamp of heart rate measurement")
+    date: SwiftDateTime = Field(..., description="Timestamp of heart rate measurement")
     qty: HeartRateValues = Field(..., description="Heart rate values (Avg/Min/Max)")
     source: Optional[str] = Field(None, description="Data source")
     units: str = Field(..., description="Heart rate units (e.g., 'count/min')")
-    
-    @validator('date', pre=True)
-    def parse_swift_datetime(cls, v):
-        """Parse Swift/ObjC datetime format: '2025-07-01 06:05:54 +0200'"""
-        if isinstance(v, str):
-            try:
-                return datetime.strptime(v, "%Y-%m-%d %H:%M:%S %z")
-            except ValueError:
-                return datetime.fromisoformat(v.replace('Z', '+00:00'))
-        return v
 
 # HAE Workout structure - no units/data wrapper, direct fields
 class HAEWorkout(BaseModel):
     # Core workout metadata
-    start: Optional[datetime] = Field(None, description="Workout start time")
-    end: Optional[datetime] = Field(None, description="Workout end time")
+    start: Optional[SwiftDateTime] = Field(None, description="Workout start time")
+    end: Optional[SwiftDateTime] = Field(None, description="Workout end time")
     duration: Optional[float] = Field(None, description="Workout duration")
     workoutType: Optional[str] = Field(None, description="Type of workout")
     location: Optional[str] = Field(None, description="Workout location")
@@ -128,16 +285,6 @@ class HAEWorkout(BaseModel):
     # Metadata
     metadata: Optional[Dict[str, Any]] = Field(None, description="Additional workout metadata")
     source: Optional[str] = Field(None, description="Data source")
-    
-    @validator('start', 'end', pre=True)
-    def parse_swift_datetime(cls, v):
-        """Parse Swift/ObjC datetime format: '2025-07-01 06:05:54 +0200'"""
-        if isinstance(v, str):
-            try:
-                return datetime.strptime(v, "%Y-%m-%d %H:%M:%S %z")
-            except ValueError:
-                return datetime.fromisoformat(v.replace('Z', '+00:00'))
-        return v
 
 # Discriminator function to choose between CommonMetric and SleepMetric
 def metric_discriminator(v: Any) -> str:
@@ -162,11 +309,123 @@ class HealthAutoExportPayload(BaseModel):
     data: DataNode = Field(..., description="Health Auto Export data wrapper")
     request_id: Optional[str] = Field(None, description="Request ID for idempotency tracking")
 
+# Columnar form of a validated delivery, written by write_payload. Common metrics
+# hold one list per field instead of one model instance per data point; sleep
+# sessions and workouts are few per delivery and keep their models.
+
+@dataclass(slots=True)
+class MetricColumns:
+    name: str
+    units: str
+    dates: List[datetime]
+    qty: List[float]
+
+@dataclass(slots=True)
+class ColumnarPayload:
+    metrics: List[Union[MetricColumns, SleepMetric]]
+    workouts: List[HAEWorkout]
+    request_id: Optional[str] = None
+    
+    @classmethod
+    def from_model(cls, payload: HealthAutoExportPayload) -> "ColumnarPayload":
+        metrics = [
+            metric if isinstance(metric, SleepMetric) else MetricColumns(
+                metric.name,
+                metric.units,
+                [data_point.date for data_point in metric.data],
+                [data_point.qty for data_point in metric.data]
+            )
+            for metric in payload.data.metrics
+        ]
+        return cls(metrics, payload.data.workouts, payload.request_id)
+
+class MetricCounts(BaseModel):
+    inserted: int = Field(0, description="Rows newly stored")
+    duplicate: int = Field(0, description="Rows skipped because they were already stored")
+
+class IngestCounts(BaseModel):
+    processed: Dict[str, int] = Field(default_factory=lambda: {"metrics": 0, "sleep": 0, "workouts": 0})
+    duplicates: Dict[str, int] = Field(default_factory=lambda: {"metrics": 0, "sleep": 0, "workouts": 0})
+    per_metric: Dict[str, MetricCounts] = Field(default_factory=dict)
+    watermarks: Dict[str, datetime] = Field(default_factory=dict, exclude=True)
+    
+    def add(self, category: str, metric_name: str, attempted: int, inserted: int, latest: Optional[datetime] = None) -> None:
+        """Tally one bulk write; rows not inserted hit ON CONFLICT DO NOTHING"""
+        if latest is not None:
+            self.watermarks[metric_name] = max(latest, self.watermarks.get(metric_name, latest))
+        counts = self.per_metric.setdefault(metric_name, MetricCounts())
+        counts.inserted += inserted
+        counts.duplicate += attempted - inserted
+        self.processed[category] += inserted
+        self.duplicates[category] += attempted - inserted
+
 class WebhookResponse(BaseModel):
     success: bool
     message: str
-    processed: Dict[str, int]  # Now includes metrics, sleep, workouts counts
-    request_hash: str
+    processed: Dict[str, int]  # Rows actually inserted for metrics, sleep, workouts
+    duplicates: Dict[str, int] = Field(default_factory=dict, description="Rows already stored, per category")
+    per_metric: Dict[str, MetricCounts] = Field(default_factory=dict, description="Inserted/duplicate counts per metric name")
+    skipped: int = Field(0, description="Points dropped as already covered by the stored watermark")
+    request_hash: str  # SHA-256 of the raw request body
+
+class WatermarkResponse(BaseModel):
+    user_id: str
+    watermarks: Dict[str, datetime] = Field(..., description="Latest stored timestamp per metric name")
+
+class UploadStartRequest(BaseModel):
+    total_chunks: Optional[int] = Field(None, ge=1, le=HAE_UPLOAD_MAX_CHUNKS, description="Number of chunks, if known up front")
+    content_encoding: Optional[str] = Field(None, description="Encoding of the reassembled document (gzip, zstd)")
+    backfill: bool = Field(True, description="Write every point, ignoring the stored watermarks")
+
+class UploadCommitRequest(BaseModel):
+    total_chunks: Optional[int] = Field(None, ge=1, le=HAE_UPLOAD_MAX_CHUNKS, description="Number of chunks, if not given at start")
+
+class UploadChunkResponse(BaseModel):
+    upload_id: str
+    chunk: int
+    bytes: int
+    sha256: str = Field(..., description="SHA-256 of the stored chunk, for client-side verification")
+
+class UploadStatusResponse(BaseModel):
+    upload_id: str
+    status: str = Field(..., description="open, processing, completed or failed")
+    total_chunks: Optional[int] = None
+    received_chunks: List[int] = Field(default_factory=list)
+    missing_chunks: List[int] = Field(default_factory=list, description="Chunks to (re)send before committing")
+    bytes_received: int = 0
+    points_written: int = Field(0, description="Points written so far while processing")
+    result: Optional[WebhookResponse] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    
+    @classmethod
+    def from_session(cls, session: UploadSession) -> "UploadStatusResponse":
+        return cls(
+            upload_id=session.upload_id,
+            status=session.status,
+            total_chunks=session.total_chunks,
+            received_chunks=session.received_chunks,
+            missing_chunks=session.missing_chunks,
+            bytes_received=session.bytes_received,
+            points_written=session.points_written,
+            result=WebhookResponse(**session.result) if session.result else None,
+            error=session.error,
+            created_at=session.created_at,
+            updated_at=session.updated_at
+        )
+
+class SpoolPartitionStats(BaseModel):
+    partition: int
+    depth: int = Field(..., description="Deliveries waiting in this partition")
+    lag_seconds: float = Field(..., description="Age of the oldest waiting delivery")
+    segments: int = Field(..., description="Segment files on disk")
+
+class SpoolStatsResponse(BaseModel):
+    mode: str = Field(..., description="Ingest mode (sync or spool)")
+    depth: int = Field(..., description="Deliveries waiting across all partitions")
+    lag_seconds: float = Field(..., description="Age of the oldest waiting delivery")
+    partitions: List[SpoolPartitionStats] = Field(default_factory=list)
 
 # Optional authentication function
 def validate_api_key(x_api_key: str = None) -> bool:
@@ -181,146 +440,843 @@ def validate_api_key(x_api_key: str = None) -> bool:
     return x_api_key == expected_key
 
 # Database helper functions
-async def get_db_connection():
-    """Get database connection based on environment"""
-    if mode == Mode.PROD:
-        database_url = db.secrets.get("DATABASE_URL_PROD")
-    else:
-        database_url = db.secrets.get("DATABASE_URL_DEV")
-    
-    if not database_url:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    
-    return await asyncpg.connect(database_url)
 
-async def insert_health_metrics(conn: asyncpg.Connection, user_id: str, metrics: List[CommonMetric]) -> int:
-    """Insert health metrics data with duplicate prevention"""
+# Upper bound on rows sent in one set-based statement, so a multi-year export
+# is written in a handful of round trips without building unbounded arrays
+INSERT_BATCH_SIZE = 5000
+
+# Raw inserts carry the rollup upsert of the rows they actually inserted, so
+# both commit (or roll back) together; both statements return the insert count
+INSERT_METRIC_POINTS_SQL = f"""
+    WITH inserted AS (
+        INSERT INTO health_metrics (user_id, metric_id, timestamp, value)
+        SELECT $1, $3, p.timestamp, p.value
+        FROM unnest($4::timestamptz[], $5::double precision[]) AS p(timestamp, value)
+        ON CONFLICT (user_id, metric_id, timestamp) DO NOTHING
+        RETURNING user_id, $2::text AS metric_name, timestamp, value
+    ), rolled_up AS ({rollup_upsert("inserted")})
+    SELECT count(*) FROM inserted
+"""
+
+INSERT_SLEEP_SQL = f"""
+    WITH inserted AS (
+        INSERT INTO sleep_metrics (
+            user_id, start_time, end_time, duration_total_minutes,
+            duration_in_bed_minutes, duration_awake_minutes, 
+            duration_light_minutes, duration_deep_minutes, 
+            duration_rem_minutes, efficiency
+        )
+        SELECT $1, s.*
+        FROM unnest(
+            $2::timestamptz[], $3::timestamptz[], $4::int[], $5::int[],
+            $6::int[], $7::int[], $8::int[], $9::int[], $10::double precision[]
+        ) AS s
+        ON CONFLICT (user_id, start_time) DO NOTHING
+        RETURNING user_id, start_time, duration_total_minutes, efficiency
+    ), sleep_points AS (
+        SELECT user_id, '{SLEEP_HOURS}' AS metric_name, start_time AS timestamp,
+               duration_total_minutes / 60.0::double precision AS value
+        FROM inserted
+        UNION ALL
+        SELECT user_id, '{SLEEP_EFFICIENCY}', start_time, efficiency
+        FROM inserted
+    ), rolled_up AS ({rollup_upsert("sleep_points")})
+    SELECT count(*) FROM inserted
+"""
+
+def _batches(count: int):
+    """Yield (start, stop) slices of at most INSERT_BATCH_SIZE rows"""
+    for start in range(0, count, INSERT_BATCH_SIZE):
+        yield start, min(start + INSERT_BATCH_SIZE, count)
+
+async def insert_metric_points(
+    conn: asyncpg.Connection,
+    user_id: str,
+    metric_name: str,
+    metric_unit: str,
+    timestamps: List[datetime],
+    values: List[float]
+) -> int:
+    """Insert one metric's points with a single unnest() statement per batch.
+    
+    Returns the number of rows actually inserted (duplicates are skipped).
+    """
     inserted_count = 0
+    metric_id = await metric_catalog.id(metric_name, metric_unit)
     
-    for metric in metrics:
-        for data_point in metric.data:
-            try:
-                await conn.execute(
-                    """
-                    INSERT INTO health_metrics (user_id, metric_name, metric_unit, timestamp, value)
-                    VALUES ($1, $2, $3, $4, $5)
-                    ON CONFLICT (user_id, metric_name, timestamp) DO NOTHING
-                    """,
-                    user_id,
-                    metric.name,
-                    metric.units,
-                    data_point.date,
-                    data_point.qty
-                )
-                inserted_count += 1
-            except Exception as e:
-                print(f"Error inserting health metric {metric.name} for user {user_id}: {e}")
-                # Continue processing other metrics
-                continue
+    for start, stop in _batches(len(timestamps)):
+        inserted_count += await conn.fetchval(
+            INSERT_METRIC_POINTS_SQL,
+            user_id,
+            metric_name,
+            metric_id,
+            timestamps[start:stop],
+            values[start:stop]
+        )
     
     return inserted_count
 
 async def insert_sleep_metrics_from_analysis(conn: asyncpg.Connection, user_id: str, sleep_metric: SleepMetric) -> int:
     """Insert sleep metrics from sleep_analysis metric with rich sleep data"""
-    inserted_count = 0
+    columns: Dict[str, list] = {
+        "start_time": [], "end_time": [], "total": [], "in_bed": [],
+        "awake": [], "light": [], "deep": [], "rem": [], "efficiency": []
+    }
     
     for sleep_entry in sleep_metric.data:
-        try:
-            # Use the rich sleep data from Health Auto Export
-            total_sleep_minutes = int(sleep_entry.totalSleep * 60)
-            awake_minutes = int(sleep_entry.awake * 60)
-            core_minutes = int(sleep_entry.core * 60)
-            deep_minutes = int(sleep_entry.deep * 60)
-            rem_minutes = int(sleep_entry.rem * 60)
-            
-            # Calculate efficiency
-            total_time_in_bed = int((sleep_entry.sleepEnd - sleep_entry.sleepStart).total_seconds() / 60)
-            efficiency = (total_sleep_minutes / total_time_in_bed * 100) if total_time_in_bed > 0 else 0
-            
-            await conn.execute(
-                """
-                INSERT INTO sleep_metrics (
-                    user_id, start_time, end_time, duration_total_minutes,
-                    duration_in_bed_minutes, duration_awake_minutes, 
-                    duration_light_minutes, duration_deep_minutes, 
-                    duration_rem_minutes, efficiency
-                )
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                ON CONFLICT (user_id, start_time) DO NOTHING
-                """,
-                user_id,
-                sleep_entry.sleepStart,
-                sleep_entry.sleepEnd,
-                total_sleep_minutes,
-                total_time_in_bed,
-                awake_minutes,
-                core_minutes,  # Using core as light sleep
-                deep_minutes,
-                rem_minutes,
-                efficiency
-            )
-            inserted_count += 1
-        except Exception as e:
-            print(f"Error inserting sleep data for user {user_id} at {sleep_entry.date}: {e}")
-            continue
+        # Use the rich sleep data from Health Auto Export
+        total_sleep_minutes = int(sleep_entry.totalSleep * 60)
+        
+        # Calculate efficiency
+        total_time_in_bed = int((sleep_entry.sleepEnd - sleep_entry.sleepStart).total_seconds() / 60)
+        efficiency = (total_sleep_minutes / total_time_in_bed * 100) if total_time_in_bed > 0 else 0
+        
+        columns["start_time"].append(sleep_entry.sleepStart)
+        columns["end_time"].append(sleep_entry.sleepEnd)
+        columns["total"].append(total_sleep_minutes)
+        columns["in_bed"].append(total_time_in_bed)
+        columns["awake"].append(int(sleep_entry.awake * 60))
+        columns["light"].append(int(sleep_entry.core * 60))  # Using core as light sleep
+        columns["deep"].append(int(sleep_entry.deep * 60))
+        columns["rem"].append(int(sleep_entry.rem * 60))
+        columns["efficiency"].append(efficiency)
+    
+    inserted_count = 0
+    
+    for start, stop in _batches(len(columns["start_time"])):
+        inserted_count += await conn.fetchval(
+            INSERT_SLEEP_SQL,
+            user_id,
+            *(column[start:stop] for column in columns.values())
+        )
     
     return inserted_count
 
-async def insert_workout_metrics(conn: asyncpg.Connection, user_id: str, workouts: List[HAEWorkout]) -> int:
-    """Insert workout data from HAE with proper structure handling."""
-    inserted_count = 0
+def workout_calorie_points(workouts: List[HAEWorkout]) -> tuple[List[datetime], List[float], Optional[datetime]]:
+    """Extract (timestamps, calories, latest start) for the workouts that burned calories.
+    
+    Workouts without a start are stored at the current time; the latest start
+    only covers real ones, so such a workout never moves the watermark past
+    workouts that are still to be delivered.
+    """
+    timestamps: List[datetime] = []
+    calories: List[float] = []
+    latest_start: Optional[datetime] = None
     
     for workout in workouts:
-        try:
-            # Extract calories from activeEnergyBurned or activeEnergy
-            total_calories = 0
-            
-            if workout.activeEnergyBurned and isinstance(workout.activeEnergyBurned, dict):
-                # Single energy value
-                total_calories = workout.activeEnergyBurned.get('qty', 0)
-            elif workout.activeEnergy and isinstance(workout.activeEnergy, list):
-                # Sum timeseries values
-                for energy_point in workout.activeEnergy:
-                    if isinstance(energy_point, dict) and 'qty' in energy_point:
-                        total_calories += energy_point['qty']
-            
-            # Calculate workout duration in minutes
-            duration_minutes = 0
-            if workout.start and workout.end:
-                duration_minutes = (workout.end - workout.start).total_seconds() / 60
-            elif workout.duration:
-                duration_minutes = workout.duration
-            
+        # Extract calories from activeEnergyBurned or activeEnergy
+        total_calories = 0
+        
+        if workout.activeEnergyBurned and isinstance(workout.activeEnergyBurned, dict):
+            # Single energy value
+            total_calories = workout.activeEnergyBurned.get('qty', 0)
+        elif workout.activeEnergy and isinstance(workout.activeEnergy, list):
+            # Sum timeseries values
+            for energy_point in workout.activeEnergy:
+                if isinstance(energy_point, dict) and 'qty' in energy_point:
+                    total_calories += energy_point['qty']
+        
+        # Only workouts that burned calories are stored
+        if total_calories > 0:
             # Use workout start time or current time
-            workout_timestamp = workout.start or datetime.now(timezone.utc)
-            
-            # Insert workout calories
-            if total_calories > 0:
-                await conn.execute(
-                    """
-                    INSERT INTO health_metrics (user_id, metric_name, metric_unit, timestamp, value)
-                    VALUES ($1, $2, $3, $4, $5)
-                    ON CONFLICT (user_id, metric_name, timestamp) DO NOTHING
-                    """,
-                    user_id,
-                    'workout',
-                    'cal',
-                    workout_timestamp,
-                    total_calories
+            timestamps.append(workout.start or datetime.now(timezone.utc))
+            calories.append(total_calories)
+            if workout.start is not None:
+                latest_start = workout.start if latest_start is None else max(latest_start, workout.start)
+    
+    return timestamps, calories, latest_start
+
+# Commit every N points (at metric boundaries) instead of once per delivery;
+# 0 runs the whole delivery in a single transaction
+HAE_TX_CHUNK_POINTS = int(os.environ.get("HAE_TX_CHUNK_POINTS", "0"))
+
+class DeliveryTransaction:
+    """Explicit transaction around a delivery, optionally committed in chunks.
+    
+    Metrics are written inside savepoints nested in this transaction, so one bad
+    metric rolls back on its own while the rest of the delivery commits together.
+    """
+    
+    def __init__(self, conn: asyncpg.Connection, chunk_points: int = HAE_TX_CHUNK_POINTS):
+        self.conn = conn
+        self.chunk_points = chunk_points
+        self.pending_points = 0
+        self.transaction = None
+    
+    async def __aenter__(self) -> "DeliveryTransaction":
+        await self._begin()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.transaction.commit()
+        else:
+            await self.transaction.rollback()
+    
+    async def _begin(self) -> None:
+        self.transaction = self.conn.transaction()
+        await self.transaction.start()
+        self.pending_points = 0
+    
+    async def add_points(self, count: int) -> None:
+        """Record written points and commit the current chunk once it is full"""
+        self.pending_points += count
+        if self.chunk_points and self.pending_points >= self.chunk_points:
+            await self.transaction.commit()
+            await self._begin()
+
+async def store_metric_points(
+    conn: asyncpg.Connection,
+    user_id: str,
+    metric_name: str,
+    metric_unit: str,
+    timestamps: List[datetime],
+    values: List[float],
+    coalesce: bool = False
+) -> int:
+    """insert_metric_points, or a submission to the shared write batcher when coalescing"""
+    if coalesce:
+        return await hae_write_batcher.submit(user_id, metric_name, metric_unit, timestamps, values)
+    return await insert_metric_points(conn, user_id, metric_name, metric_unit, timestamps, values)
+
+def should_coalesce(payload: ColumnarPayload) -> bool:
+    """True if a delivery is small enough to go through the shared write batcher"""
+    # All or nothing per delivery: rows a delivery writes itself stay locked until
+    # it commits, so a batch touching the same keys would wait on the delivery
+    # that is waiting on the batch. Batched rows commit outside the delivery's
+    # transaction, so a delivery that must commit atomically writes inline
+    if not HAE_TX_CHUNK_POINTS or not hae_write_batcher.running:
+        return False
+    points = sum(len(m.data) if isinstance(m, SleepMetric) else len(m.dates) for m in payload.metrics)
+    return points + len(payload.workouts) <= HAE_WRITE_COALESCE_MAX_POINTS
+
+async def write_metric(
+    conn: asyncpg.Connection,
+    user_id: str,
+    metric: Union[MetricColumns, SleepMetric],
+    counts: IngestCounts,
+    coalesce: bool = False
+) -> int:
+    """Write one metric inside its own savepoint; returns the points written (0 on error).
+    
+    Points of a month whose partition is being created are written again once
+    it is attached; if they are still rejected, the error is raised so the
+    whole delivery fails and is retried instead of losing them.
+    """
+    waited = False
+    while True:
+        try:
+            async with conn.transaction():
+                if isinstance(metric, SleepMetric):
+                    # Handle sleep analysis as sleep data (should be SleepMetric)
+                    sleep_inserted = await insert_sleep_metrics_from_analysis(conn, user_id, metric)
+                    counts.add(
+                        "sleep", metric.name, len(metric.data), sleep_inserted,
+                        max((entry.sleepStart for entry in metric.data), default=None)
+                    )
+                    log.info("sleep.inserted", inserted=sleep_inserted, attempted=len(metric.data))
+                    return len(metric.data)
+                
+                # Handle as regular health metrics (MetricColumns)
+                metrics_inserted = await store_metric_points(
+                    conn, user_id, metric.name, metric.units, metric.dates, metric.qty, coalesce
                 )
-                inserted_count += 1
-                print(f"✅ Inserted workout: {total_calories} cal, {duration_minutes:.1f} min at {workout_timestamp}")
-            
-        except Exception as e:
-            print(f"❌ Error inserting workout data for user {user_id}: {e}")
+                counts.add(
+                    "metrics", metric.name, len(metric.dates), metrics_inserted,
+                    max(metric.dates, default=None)
+                )
+                log.info("metric.inserted", metric=metric.name, inserted=metrics_inserted, attempted=len(metric.dates))
+                return len(metric.dates)
+        
+        except Exception as metric_error:
+            if is_creating_partition(metric_error) and not waited:
+                log.info("metric.awaiting_partition", metric=metric.name, constraint=metric_error.constraint_name)
+                await wait_for_partition_creation(conn)
+                waited = True
+                continue
+            if is_creating_partition(metric_error):
+                raise
+            log.error("metric.failed", metric=metric.name, error=str(metric_error))
+            return 0
+
+async def write_workouts(
+    conn: asyncpg.Connection,
+    user_id: str,
+    workouts: List[HAEWorkout],
+    counts: IngestCounts,
+    coalesce: bool = False
+) -> None:
+    """Write workout calories inside their own savepoint (retried like write_metric's points)"""
+    timestamps, calories, latest_start = workout_calorie_points(workouts)
+    if not timestamps:
+        return
+    
+    waited = False
+    while True:
+        try:
+            async with conn.transaction():
+                workouts_inserted = await store_metric_points(conn, user_id, 'workout', 'cal', timestamps, calories, coalesce)
+            counts.add("workouts", "workout", len(timestamps), workouts_inserted, latest_start)
+            log.info("workouts.inserted", inserted=workouts_inserted, attempted=len(timestamps))
+            return
+        except Exception as workout_error:
+            if is_creating_partition(workout_error) and not waited:
+                log.info("workouts.awaiting_partition", constraint=workout_error.constraint_name)
+                await wait_for_partition_creation(conn)
+                waited = True
+                continue
+            if is_creating_partition(workout_error):
+                raise
+            log.error("workouts.failed", error=str(workout_error))
+            return
+
+async def write_payload(conn: asyncpg.Connection, user_id: str, payload: ColumnarPayload) -> IngestCounts:
+    """Write a validated delivery inside one explicit transaction (or chunks of it)"""
+    counts = IngestCounts()
+    coalesce = should_coalesce(payload)
+    
+    async with DeliveryTransaction(conn) as delivery:
+        # Process health metrics with proper type discrimination
+        log.debug("payload.metrics", metrics=len(payload.metrics), workouts=len(payload.workouts), coalesce=coalesce)
+        for i, metric in enumerate(payload.metrics):
+            log.debug("payload.metric", index=i, metric=metric.name, type=type(metric).__name__)
+            await delivery.add_points(await write_metric(conn, user_id, metric, counts, coalesce))
+        
+        # Process workout data
+        await write_workouts(conn, user_id, payload.workouts, counts, coalesce)
+        
+        await hae_watermarks.advance(conn, user_id, counts.watermarks)
+    
+    hae_watermarks.remember(user_id, counts.watermarks)
+    return counts
+
+def _raw_timestamp(value: Any) -> Optional[datetime]:
+    """Parse a raw point timestamp the way the model validators do, None if unparseable"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return parse_swift_datetime(value)
+    except ValueError:
+        return None
+
+def _keep_point(point: Any, field: str, watermark: Optional[datetime]) -> bool:
+    if watermark is None or not isinstance(point, dict):
+        return True
+    timestamp = _raw_timestamp(point.get(field))
+    # Unparseable or naive timestamps are left for validation to deal with
+    return timestamp is None or timestamp.tzinfo is None or timestamp > watermark
+
+def drop_stored_points(raw_payload: Any, watermarks: Dict[str, datetime]) -> int:
+    """Remove points at or before the stored watermark from a decoded body, in place.
+    
+    Returns the number of points dropped. Malformed structures are left untouched
+    so validation still reports them.
+    """
+    if not watermarks or not isinstance(raw_payload, dict) or not isinstance(raw_payload.get("data"), dict):
+        return 0
+    
+    data_node = raw_payload["data"]
+    dropped = 0
+    
+    for metric in data_node.get("metrics") or []:
+        if not isinstance(metric, dict) or not isinstance(metric.get("data"), list):
             continue
+        field = "sleepStart" if metric.get("name") == "sleep_analysis" else "date"
+        watermark = watermarks.get(metric.get("name"))
+        kept = [point for point in metric["data"] if _keep_point(point, field, watermark)]
+        dropped += len(metric["data"]) - len(kept)
+        metric["data"] = kept
     
-    return inserted_count
+    workouts = data_node.get("workouts")
+    if isinstance(workouts, list):
+        # Workouts without a start time are stored at ingest time, so always kept
+        kept = [workout for workout in workouts if _keep_point(workout, "start", watermarks.get("workout"))]
+        dropped += len(workouts) - len(kept)
+        data_node["workouts"] = kept
+    
+    return dropped
+
+async def load_watermarks(pool: asyncpg.Pool, user_id: str) -> Dict[str, datetime]:
+    """The user's stored watermarks; lookup failures never block ingest"""
+    try:
+        return await hae_watermarks.get(pool, user_id)
+    except Exception as e:
+        log.error("watermark.lookup_failed", user_id=user_id, error=str(e))
+        return {}
+
+async def drop_points_below_watermark(pool: asyncpg.Pool, user_id: str, raw_payload: Any) -> int:
+    """Apply the user's stored watermarks to a decoded body"""
+    skipped = drop_stored_points(raw_payload, await load_watermarks(pool, user_id))
+    if skipped:
+        log.info("watermark.skipped", skipped=skipped)
+    return skipped
+
+def decode_body(raw_body: bytes) -> Any:
+    """Parse a raw HAE request body as JSON"""
+    if log.debug_enabled():
+        log.debug("payload.body", bytes=len(raw_body), body=excerpt(raw_body))
+    return json.loads(raw_body)
+
+def validate_payload(raw_payload: Any) -> HealthAutoExportPayload:
+    """Validate a decoded HAE body"""
+    try:
+        payload = HealthAutoExportPayload(**raw_payload)
+    except Exception as validation_error:
+        log.warning("payload.invalid", error=excerpt(validation_error), error_type=type(validation_error).__name__)
+        
+        # Excerpts of the offending nodes, only for users with debug logging
+        if log.debug_enabled() and isinstance(raw_payload, dict) and isinstance(raw_payload.get("data"), dict):
+            data_node = raw_payload["data"]
+            log.debug("payload.invalid.data", data=excerpt(json.dumps(data_node, default=str)))
+            for i, workout in enumerate(data_node.get("workouts") or []):
+                log.debug("payload.invalid.workout", index=i, workout=excerpt(json.dumps(workout, default=str)))
+        
+        raise HTTPException(status_code=422, detail=f"Validation error: {validation_error}")
+    
+    if log.debug_enabled():
+        log.debug("payload.validated", payload=excerpt(payload.model_dump_json()))
+    
+    return payload
+
+class _ModelValidationRequired(Exception):
+    """Input outside the shape the columnar fast path handles"""
+
+def _decode_metric_columns(metric: Dict[str, Any]) -> MetricColumns:
+    name, units, data = metric["name"], metric["units"], metric["data"]
+    if type(name) is not str or type(units) is not str or type(data) is not list:
+        raise _ModelValidationRequired()
+    
+    dates = parse_swift_datetimes([data_point["date"] for data_point in data])
+    qty = []
+    append = qty.append
+    for data_point in data:
+        value = data_point["qty"]
+        if type(value) is float:
+            append(value)
+        elif type(value) is int:
+            append(float(value))
+        else:
+            # Numeric strings, bools, nulls: leave coercion or the error to Pydantic
+            raise _ModelValidationRequired()
+    
+    return MetricColumns(name, units, dates, qty)
+
+def _decode_columnar(raw_payload: Any) -> ColumnarPayload:
+    if type(raw_payload) is not dict or type(raw_payload.get("data")) is not dict:
+        raise _ModelValidationRequired()
+    
+    request_id = raw_payload.get("request_id")
+    if request_id is not None and type(request_id) is not str:
+        raise _ModelValidationRequired()
+    
+    data_node = raw_payload["data"]
+    raw_metrics, raw_workouts = data_node.get("metrics", []), data_node.get("workouts", [])
+    if type(raw_metrics) is not list or type(raw_workouts) is not list:
+        raise _ModelValidationRequired()
+    
+    metrics = []
+    for metric in raw_metrics:
+        if type(metric) is not dict:
+            raise _ModelValidationRequired()
+        if metric_discriminator(metric) == "sleep":
+            metrics.append(SleepMetric.model_validate(metric))
+        else:
+            metrics.append(_decode_metric_columns(metric))
+    
+    workouts = [HAEWorkout.model_validate(workout) for workout in raw_workouts]
+    return ColumnarPayload(metrics, workouts, request_id)
+
+def decode_columnar(raw_payload: Any) -> ColumnarPayload:
+    """Decode a JSON body into columns without one model instance per data point.
+    
+    Applies the HealthAutoExportPayload rules: anything the fast path does not
+    handle (coercible strings, bools, malformed nodes, invalid values) is
+    validated by the Pydantic models instead, so accepted input and validation
+    error messages are identical to the model path.
+    """
+    try:
+        return _decode_columnar(raw_payload)
+    except Exception:
+        return ColumnarPayload.from_model(validate_payload(raw_payload))
+
+def decode_payload(raw_payload: Any) -> ColumnarPayload:
+    """Validate a decoded HAE body with the configured decoder"""
+    if HAE_DECODER == "columnar":
+        return decode_columnar(raw_payload)
+    return ColumnarPayload.from_model(validate_payload(raw_payload))
+
+def parse_payload(raw_body: bytes) -> ColumnarPayload:
+    """Parse and validate a raw HAE request body"""
+    return decode_payload(decode_body(raw_body))
+
+def payload_request_id(raw_payload: Any) -> Optional[str]:
+    """The client-supplied request_id of a decoded body, if any"""
+    if isinstance(raw_payload, dict) and isinstance(raw_payload.get("request_id"), str):
+        return raw_payload["request_id"] or None
+    return None
+
+class OffloadedDecodeError(Exception):
+    """Picklable stand-in for a decode failure in a worker process (status_code, detail)"""
+
+def _decode_delivery(raw_body: bytes, watermarks: Dict[str, datetime]) -> tuple[Optional[str], int, ColumnarPayload]:
+    """Parse a body, drop stored points and validate it; returns (request_id, skipped, payload)"""
+    raw_payload = decode_body(raw_body)
+    skipped = drop_stored_points(raw_payload, watermarks)
+    return payload_request_id(raw_payload), skipped, decode_payload(raw_payload)
+
+def decode_body_in_worker(raw_body: bytes, watermarks: Dict[str, datetime]) -> tuple[Optional[str], int, ColumnarPayload]:
+    """Process pool entry point for _decode_delivery"""
+    try:
+        return _decode_delivery(raw_body, watermarks)
+    except HTTPException as e:
+        raise OffloadedDecodeError(e.status_code, e.detail) from None
+    except Exception as e:
+        # Parser and Pydantic errors carry unpicklable state
+        raise OffloadedDecodeError(None, str(e)) from None
+
+def should_offload_decode(raw_body: bytes) -> bool:
+    return hae_decode_executor is not None and len(raw_body) >= HAE_DECODE_OFFLOAD_BYTES
+
+async def decode_body_offloaded(raw_body: bytes, watermarks: Dict[str, datetime]) -> tuple[Optional[str], int, ColumnarPayload]:
+    """_decode_delivery on the process pool, raising what the inline path would"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            hae_decode_executor, decode_body_in_worker, raw_body, watermarks
+        )
+    except OffloadedDecodeError as e:
+        status_code, detail = e.args
+        if status_code is not None:
+            raise HTTPException(status_code=status_code, detail=detail)
+        raise ValueError(detail)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed): replace the pool, decode this body inline
+        log.error("decode_pool.broken", bytes=len(raw_body))
+        stop_decode_executor()
+        start_decode_executor()
+        return _decode_delivery(raw_body, watermarks)
+
+def delivery_key(kind: str, value: str, backfill: bool = False) -> str:
+    """Idempotency key of a delivery's body hash ("sha256") or request id ("request").
+    
+    Backfill deliveries are written differently (no watermark filtering), so
+    their responses are remembered apart from those of ordinary deliveries.
+    """
+    key = f"{kind}:{value}"
+    return f"backfill:{key}" if backfill else key
+
+async def find_delivery(pool: asyncpg.Pool, user_id: str, keys: List[str]) -> Optional[StoredResponse]:
+    """Look up a previously answered delivery; lookup failures never block ingest"""
+    try:
+        return await hae_idempotency.get(pool, user_id, keys)
+    except Exception as e:
+        log.error("idempotency.lookup_failed", user_id=user_id, error=str(e))
+        return None
+
+async def remember_delivery(pool: asyncpg.Pool, user_id: str, keys: List[str], status_code: int, result: WebhookResponse) -> None:
+    try:
+        await hae_idempotency.put(pool, user_id, keys, status_code, result.model_dump())
+    except Exception as e:
+        log.error("idempotency.store_failed", user_id=user_id, error=str(e))
+
+async def drain_spooled_delivery(pool: Optional[asyncpg.Pool], user_id: str, raw_body: bytes, enqueued_at: float) -> None:
+    """Spool handler: write one queued delivery, rejecting bodies that can never validate"""
+    if pool is None:
+        raise RuntimeError("Database not configured")
+    
+    try:
+        payload = None
+        if should_offload_decode(raw_body):
+            request_id, skipped, payload = await decode_body_offloaded(raw_body, await load_watermarks(pool, user_id))
+        else:
+            raw_payload = decode_body(raw_body)
+            request_id = payload_request_id(raw_payload)
+        if request_id and await find_delivery(pool, user_id, [delivery_key("request", request_id)]):
+            log.info("spool.known_request", user_id=user_id, request_id=request_id)
+            return
+        if payload is None:
+            skipped = await drop_points_below_watermark(pool, user_id, raw_payload)
+            payload = decode_payload(raw_payload)
+    except (ValueError, HTTPException) as e:
+        raise SpoolRecordRejected(str(e)) from e
+    
+    async with pool.acquire() as conn:
+        counts = await write_payload(conn, user_id, payload)
+    
+    if request_id:
+        await remember_delivery(pool, user_id, [delivery_key("request", request_id)], 200, WebhookResponse(
+            success=True,
+            message=f"Successfully processed health data for user {user_id}",
+            processed=counts.processed,
+            duplicates=counts.duplicates,
+            per_metric=counts.per_metric,
+            skipped=skipped,
+            request_hash=hashlib.sha256(raw_body).hexdigest()
+        ))
+    
+    lag = datetime.now(timezone.utc).timestamp() - enqueued_at
+    log.info("spool.drained", user_id=user_id, lag_seconds=round(lag, 1), processed=counts.processed)
+
+def request_body_stream(request: Request) -> AsyncIterator[bytes]:
+    """The request body as a stream of chunks, decompressed per Content-Encoding"""
+    encodings = content_encodings(request.headers.get("content-encoding"))
+    if not encodings:
+        return request.stream()
+    return decompress_stream(request.stream(), encodings, HAE_MAX_DECOMPRESSED_BYTES, HAE_MAX_COMPRESSION_RATIO)
+
+async def read_request_body(request: Request) -> bytes:
+    """The whole (decompressed) request body"""
+    if not request.headers.get("content-encoding"):
+        return await request.body()
+    return b"".join([chunk async for chunk in request_body_stream(request)])
+
+class StreamedBody:
+    """Async file-like view of the request stream for ijson, hashing the body as it is read"""
+    
+    def __init__(self, stream: AsyncIterator[bytes]):
+        self._chunks = stream.__aiter__()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+    
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            # ijson probes the return type with read(0)
+            return b""
+        # Chunks are handed over as received; ijson copes with any length
+        async for chunk in self._chunks:
+            if chunk:
+                self.sha256.update(chunk)
+                self.size += len(chunk)
+                return chunk
+        return b""
+
+@dataclass
+class StreamedDelivery:
+    request_id: Optional[str] = None
+    workouts: List[HAEWorkout] = field(default_factory=list)
+    skipped: int = 0
+
+_STREAM_METRIC = "data.metrics.item"
+_STREAM_POINT = "data.metrics.item.data.item"
+_STREAM_WORKOUTS = "data.workouts"
+_STREAM_VALUE_EVENTS = ("start_map", "start_array", "null", "boolean", "number", "string")
+_STREAM_HEADER_KEYS = ("name", "units")
+
+async def stream_payload(
+    body: StreamedBody,
+    watermarks: Dict[str, datetime],
+    on_metric: Callable[[Union[MetricColumns, SleepMetric]], Awaitable[None]]
+) -> StreamedDelivery:
+    """Parse an HAE body incrementally, handing bounded chunks of each metric to on_metric.
+    
+    At most HAE_STREAM_CHUNK_POINTS raw points are held at a time: each full chunk
+    is filtered against the watermarks, decoded with the configured decoder (same
+    422 errors as the buffered path) and passed on before more of the body is read.
+    Chunks need the metric's name and units, which JSON may place after its data
+    array; points read before both are known are set aside in a temporary file
+    and passed on once they are (or once the metric ends, so validation can
+    report missing ones). Workouts are small and decoded once the body is complete.
+    """
+    delivery = StreamedDelivery()
+    envelope: Dict[str, Any] = {}
+    metric = point = workouts = None
+    points: List[Any] = []
+    flushed = False
+    spilled: Optional[tempfile.SpooledTemporaryFile] = None
+    
+    def header_known() -> bool:
+        header = metric.value
+        return isinstance(header, dict) and all(key in header for key in _STREAM_HEADER_KEYS)
+    
+    def spill() -> None:
+        nonlocal points, spilled
+        if spilled is None:
+            spilled = tempfile.SpooledTemporaryFile(max_size=HAE_STREAM_SPILL_MEMORY_BYTES)
+        spilled.writelines(json.dumps(data_point).encode() + b"\n" for data_point in points)
+        points = []
+    
+    async def replay() -> None:
+        """Pass on the set-aside points, then those read since, in chunks"""
+        nonlocal points, spilled
+        held, points = points, []
+        spilled.seek(0)
+        for line in spilled:
+            points.append(json.loads(line))
+            if len(points) >= HAE_STREAM_CHUNK_POINTS:
+                await flush()
+        spilled.close()
+        spilled = None
+        points.extend(held)
+        if len(points) >= HAE_STREAM_CHUNK_POINTS:
+            await flush()
+    
+    async def flush() -> None:
+        nonlocal points, flushed
+        header = metric.value
+        name = header.get("name") if isinstance(header, dict) else None
+        if isinstance(header, dict) and isinstance(header.get("data"), list):
+            time_field = "sleepStart" if name == "sleep_analysis" else "date"
+            watermark = watermarks.get(name) if isinstance(name, str) else None
+            kept = [data_point for data_point in points if _keep_point(data_point, time_field, watermark)]
+            delivery.skipped += len(points) - len(kept)
+            header = {**header, "data": kept}
+        
+        points, flushed = [], True
+        decoded = decode_payload({"data": {"metrics": [header]}})
+        await on_metric(decoded.metrics[0])
+    
+    try:
+        async for prefix, event, value in ijson.parse_async(body, use_float=True):
+            if point is not None:
+                # Inside a data point: build it, then queue it once it is closed
+                point.event(event, value)
+                if prefix == _STREAM_POINT and event in ("end_map", "end_array"):
+                    points.append(point.value)
+                    point = None
+            elif prefix == _STREAM_POINT:
+                if event in ("start_map", "start_array"):
+                    point = ijson.ObjectBuilder()
+                    point.event(event, value)
+                else:
+                    points.append(value)
+            elif metric is not None:
+                # Metric header (name, units); its data array stays empty here
+                metric.event(event, value)
+                if prefix == _STREAM_METRIC and event in ("end_map", "end_array"):
+                    if spilled is not None:
+                        await replay()
+                    if points or not flushed:
+                        await flush()
+                    metric, flushed = None, False
+                elif spilled is not None and header_known():
+                    await replay()
+                continue
+            elif prefix == _STREAM_METRIC:
+                metric = ijson.ObjectBuilder()
+                metric.event(event, value)
+                if event not in ("start_map", "start_array"):
+                    # Scalar in the metrics array: let validation report it
+                    await flush()
+                    metric = None
+                continue
+            elif prefix == _STREAM_WORKOUTS or prefix.startswith(_STREAM_WORKOUTS + "."):
+                if workouts is None:
+                    workouts = ijson.ObjectBuilder()
+                workouts.event(event, value)
+                continue
+            elif prefix in ("data", "data.metrics", "request_id"):
+                # Envelope nodes; anything but the expected shape is kept for validation to report
+                if event in _STREAM_VALUE_EVENTS:
+                    node = {} if event == "start_map" else [] if event == "start_array" else value
+                    if prefix == "data.metrics":
+                        envelope["data"]["metrics"] = node
+                    else:
+                        envelope[prefix] = node
+                continue
+            else:
+                continue
+            
+            # A data point was queued; pass the chunk on once it is full
+            if len(points) >= HAE_STREAM_CHUNK_POINTS:
+                if header_known():
+                    await flush()
+                else:
+                    spill()
+    finally:
+        if spilled is not None:
+            spilled.close()
+    
+    if workouts is not None and isinstance(envelope.get("data"), dict):
+        raw_workouts = workouts.value
+        if isinstance(raw_workouts, list):
+            kept = [workout for workout in raw_workouts if _keep_point(workout, "start", watermarks.get("workout"))]
+            delivery.skipped += len(raw_workouts) - len(kept)
+            raw_workouts = kept
+        envelope["data"]["workouts"] = raw_workouts
+    
+    # Metrics were validated chunk by chunk; validate the rest of the envelope
+    if isinstance(envelope.get("data"), dict) and isinstance(envelope["data"].get("metrics", []), list):
+        envelope["data"]["metrics"] = []
+    decoded = decode_payload(envelope)
+    delivery.request_id = decoded.request_id
+    delivery.workouts = decoded.workouts
+    return delivery
+
+async def write_streamed_body(
+    pool: asyncpg.Pool,
+    user_id: str,
+    body: StreamedBody,
+    backfill: bool,
+    chunk_points: int = HAE_TX_CHUNK_POINTS,
+    on_progress: Optional[Callable[[int], Awaitable[None]]] = None
+) -> tuple[IngestCounts, StreamedDelivery]:
+    """Parse a streamed body and write it chunk by chunk on one pooled connection.
+    
+    The connection and transaction stay open while the body is read, so an
+    incomplete or invalid body rolls back like a buffered one (unless chunk_points
+    commits earlier). Each chunk of points is written in its own savepoint.
+    """
+    watermarks = {} if backfill else await load_watermarks(pool, user_id)
+    counts = IngestCounts()
+    points_written = 0
+    
+    async with pool.acquire() as conn:
+        async with DeliveryTransaction(conn, chunk_points) as delivery:
+            async def write_chunk(metric: Union[MetricColumns, SleepMetric]) -> None:
+                nonlocal points_written
+                points = len(metric.data if isinstance(metric, SleepMetric) else metric.dates)
+                log.debug("stream.chunk", metric=metric.name, points=points)
+                await delivery.add_points(await write_metric(conn, user_id, metric, counts))
+                points_written += points
+                if on_progress is not None:
+                    await on_progress(points_written)
+            
+            streamed = await stream_payload(body, watermarks, write_chunk)
+            await write_workouts(conn, user_id, streamed.workouts, counts)
+            await hae_watermarks.advance(conn, user_id, counts.watermarks)
+    
+    hae_watermarks.remember(user_id, counts.watermarks)
+    if streamed.skipped:
+        log.info("watermark.skipped", skipped=streamed.skipped)
+    return counts, streamed
+
+def streamed_response(user_id: str, body: StreamedBody, counts: IngestCounts, streamed: StreamedDelivery) -> WebhookResponse:
+    return WebhookResponse(
+        success=True,
+        message=f"Successfully processed health data for user {user_id}",
+        processed=counts.processed,
+        duplicates=counts.duplicates,
+        per_metric=counts.per_metric,
+        skipped=streamed.skipped,
+        request_hash=body.sha256.hexdigest()
+    )
+
+async def remember_streamed_delivery(
+    pool: asyncpg.Pool, user_id: str, streamed: StreamedDelivery, result: WebhookResponse, backfill: bool
+) -> None:
+    # The body hash is only known once the writes are done, so retries of a streamed
+    # delivery are not short-circuited; they are stored so buffered retries are
+    idempotency_keys = [delivery_key("sha256", result.request_hash, backfill)]
+    if streamed.request_id:
+        idempotency_keys.append(delivery_key("request", streamed.request_id, backfill))
+    await remember_delivery(pool, user_id, idempotency_keys, 200, result)
+
+async def ingest_streamed_delivery(user_id: str, request: Request, pool: asyncpg.Pool, backfill: bool) -> WebhookResponse:
+    """Parse and write a delivery while it is being received; the body is never held whole"""
+    body = StreamedBody(request_body_stream(request))
+    counts, streamed = await write_streamed_body(pool, user_id, body, backfill)
+    
+    log.info("webhook.streamed", bytes=body.size, processed=counts.processed, duplicates=counts.duplicates)
+    result = streamed_response(user_id, body, counts, streamed)
+    await remember_streamed_delivery(pool, user_id, streamed, result, backfill)
+    return result
 
 @router.post("/hae/webhook/{user_id}")
 async def health_auto_export_webhook(
     user_id: str,
-    request: Request
+    request: Request,
+    response: Response,
+    pool: DbPool,
+    backfill: bool = Query(False, description="Write every point, ignoring the stored watermarks")
 ) -> WebhookResponse:
     """
     Webhook endpoint to receive health data from Health Auto Export.
@@ -329,112 +1285,284 @@ async def health_auto_export_webhook(
     respective database tables with duplicate prevention using ON CONFLICT DO NOTHING.
     
     Handles Swift/ObjC datetime format parsing and rich sleep data structure.
+    
+    Points at or before the stored per-metric watermark are dropped before
+    validation; pass `backfill=true` to write every point.
+    
+    Exact retries (same body, or same request_id) are answered with the stored
+    original response without being parsed or written again.
+    
+    Bodies may be compressed with `Content-Encoding: gzip` or `zstd`; they are
+    decompressed as a stream, bounded by HAE_MAX_DECOMPRESSED_BYTES, and the
+    request hash is taken over the decompressed JSON.
+    
+    With HAE_INGEST_MODE=stream, bodies of HAE_STREAM_MIN_BYTES or more are parsed
+    incrementally and written in bounded chunks as they arrive.
+    
+    Buffered bodies of HAE_DECODE_OFFLOAD_BYTES or more are parsed and validated
+    in a worker process pool, keeping the event loop free for other requests.
+    
+    With HAE_INGEST_MODE=spool the raw body is appended to a durable on-disk spool
+    and 202 Accepted is returned at once; background workers write it later.
     """
     
-    print(f"🔥 WEBHOOK CALLED: user_id={user_id}")
+    bind_user(user_id)
+    log.info("webhook.received", content_length=request.headers.get("content-length"))
+    request_hash = "error"
     
     try:
+        # Large (or unsized) bodies are parsed from the socket instead of buffered
+        content_length = request.headers.get("content-length")
+        if HAE_INGEST_MODE == "stream" and (content_length is None or int(content_length) >= HAE_STREAM_MIN_BYTES):
+            return await ingest_streamed_delivery(user_id, request, pool, backfill)
+        
         # Get raw request body first
-        raw_body = await request.body()
-        print(f"📜 RAW REQUEST BODY: {raw_body.decode('utf-8')}")
+        raw_body = await read_request_body(request)
+        request_hash = hashlib.sha256(raw_body).hexdigest()
+        idempotency_keys = [delivery_key("sha256", request_hash, backfill)]
         
-        # Parse JSON manually to see structure
-        import json
-        raw_payload = json.loads(raw_body)
-        print(f"🗺 PARSED JSON STRUCTURE: {json.dumps(raw_payload, indent=2)}")
+        # Exact retries are answered with the original response
+        stored = await find_delivery(pool, user_id, idempotency_keys)
+        if stored is not None:
+            log.info("webhook.known_delivery", request_hash=request_hash)
+            response.status_code = stored.status_code
+            return WebhookResponse(**stored.body)
         
-        # Now try to validate with Pydantic
-        try:
-            payload = HealthAutoExportPayload(**raw_payload)
-            print(f"✅ Pydantic validation successful")
-        except Exception as validation_error:
-            print(f"❌ PYDANTIC VALIDATION ERROR: {validation_error}")
-            print(f"❌ VALIDATION ERROR TYPE: {type(validation_error)}")
-            
-            # Try to validate individual parts
-            if 'data' in raw_payload:
-                data_node = raw_payload['data']
-                print(f"🔍 DATA NODE: {json.dumps(data_node, indent=2)}")
-                
-                if 'workouts' in data_node and data_node['workouts']:
-                    print(f"💪 WORKOUT DATA: {json.dumps(data_node['workouts'], indent=2)}")
-                    
-                    # Try to validate workout structure
-                    for i, workout in enumerate(data_node['workouts']):
-                        print(f"🔍 Workout {i}: {json.dumps(workout, indent=2)}")
-                        if 'data' in workout:
-                            for j, workout_point in enumerate(workout['data']):
-                                print(f"🔍 Workout {i} Point {j}: {json.dumps(workout_point, indent=2)}")
-            
-            raise HTTPException(status_code=422, detail=f"Validation error: {validation_error}")
+        # Backfills skip the spool and are written inline without watermark filtering
+        if HAE_INGEST_MODE == "spool" and not backfill:
+            await request.app.state.hae_spool.append(user_id, raw_body)
+            response.status_code = 202
+            log.info("webhook.spooled", bytes=len(raw_body))
+            result = WebhookResponse(
+                success=True,
+                message=f"Queued health data for user {user_id}",
+                processed={"metrics": 0, "sleep": 0, "workouts": 0},
+                request_hash=request_hash
+            )
+            await remember_delivery(pool, user_id, idempotency_keys, 202, result)
+            return result
         
-        # Debug: Print raw payload first
-        print("❏ RAW HAE PAYLOAD:", payload.model_dump_json(indent=2))
+        # Large bodies are parsed and validated off the event loop
+        payload = None
+        if should_offload_decode(raw_body):
+            watermarks = {} if backfill else await load_watermarks(pool, user_id)
+            request_id, skipped, payload = await decode_body_offloaded(raw_body, watermarks)
+        else:
+            raw_payload = decode_body(raw_body)
+            request_id = payload_request_id(raw_payload)
+        if request_id:
+            idempotency_keys.append(delivery_key("request", request_id, backfill))
+            stored = await find_delivery(pool, user_id, idempotency_keys[1:])
+            if stored is not None:
+                log.info("webhook.known_request", request_id=request_id)
+                response.status_code = stored.status_code
+                return WebhookResponse(**stored.body)
         
-        processed_counts = {
-            "metrics": 0,
-            "sleep": 0,
-            "workouts": 0
-        }
+        if payload is None:
+            skipped = 0 if backfill else await drop_points_below_watermark(pool, user_id, raw_payload)
+            payload = decode_payload(raw_payload)
         
-        print("🔐 Connecting to database...")
-        # Get database connection
-        conn = await get_db_connection()
-        print("✅ Database connected successfully")
+        async with pool.acquire() as conn:
+            counts = await write_payload(conn, user_id, payload)
         
-        try:
-            # Process health metrics with proper type discrimination
-            print(f"📊 Processing {len(payload.data.metrics)} metrics...")
-            for i, metric in enumerate(payload.data.metrics):
-                print(f"🔍 Metric {i+1}: name={metric.name}, type={type(metric).__name__}")
-                
-                try:
-                    if metric.name == "sleep_analysis":
-                        # Handle sleep analysis as sleep data (should be SleepMetric)
-                        sleep_inserted = await insert_sleep_metrics_from_analysis(conn, user_id, metric)
-                        processed_counts["sleep"] += sleep_inserted
-                        print(f"✅ Inserted {sleep_inserted} sleep sessions from sleep_analysis metric")
-                    else:
-                        # Handle as regular health metrics (should be CommonMetric)
-                        metrics_inserted = await insert_health_metrics(conn, user_id, [metric])
-                        processed_counts["metrics"] += metrics_inserted
-                        print(f"✅ Inserted {metrics_inserted} data points for metric {metric.name}")
-                        
-                except Exception as metric_error:
-                    print(f"❌ Error processing metric {metric.name}: {metric_error}")
-                    continue
-            
-            # Process workout data
-            print(f"💪 Processing {len(payload.data.workouts)} workouts...")
-            if payload.data.workouts:
-                try:
-                    workouts_inserted = await insert_workout_metrics(conn, user_id, payload.data.workouts)
-                    processed_counts["workouts"] = workouts_inserted
-                    print(f"✅ Inserted {workouts_inserted} workout data points")
-                except Exception as workout_error:
-                    print(f"❌ Error processing workouts: {workout_error}")
-            
-            print(f"✅ Successfully processed all HAE data: {processed_counts}")
-            return WebhookResponse(
-                success=True,
-                message=f"Successfully processed health data for user {user_id}",
-                processed=processed_counts,
-                request_hash="success"
-            )
-            
-        finally:
-            await conn.close()
-            print("🔐 Database connection closed")
+        log.info("webhook.processed", bytes=len(raw_body), processed=counts.processed, duplicates=counts.duplicates, skipped=skipped)
+        result = WebhookResponse(
+            success=True,
+            message=f"Successfully processed health data for user {user_id}",
+            processed=counts.processed,
+            duplicates=counts.duplicates,
+            per_metric=counts.per_metric,
+            skipped=skipped,
+            request_hash=request_hash
+        )
+        await remember_delivery(pool, user_id, idempotency_keys, 200, result)
+        return result
             
+    except DecompressionError as decompression_error:
+        log.warning("webhook.bad_encoding", error=str(decompression_error),
+                    content_encoding=request.headers.get("content-encoding"))
+        if isinstance(decompression_error, UnsupportedEncoding):
+            response.status_code = 415
+        elif isinstance(decompression_error, DecompressedTooLarge):
+            response.status_code = 413
+        else:
+            response.status_code = 400
+        return WebhookResponse(
+            success=False,
+            message=f"Failed to decompress request body: {decompression_error}",
+            processed={"metrics": 0, "sleep": 0, "workouts": 0},
+            request_hash=request_hash
+        )
+    
     except Exception as global_error:
-        print(f"❌ GLOBAL WEBHOOK ERROR: {global_error}")
-        print(f"❌ GLOBAL ERROR TYPE: {type(global_error)}")
-        import traceback
-        print(f"❌ FULL GLOBAL TRACEBACK: {traceback.format_exc()}")
+        log.error("webhook.failed", error=str(global_error), error_type=type(global_error).__name__, exc_info=True)
         
         return WebhookResponse(
             success=False,
             message=f"Failed to process health data: {str(global_error)}",
             processed={"metrics": 0, "sleep": 0, "workouts": 0},
-            request_hash="error"
+            request_hash=request_hash
+        )
+
+
+@router.get("/hae/spool/stats")
+async def get_spool_stats(request: Request) -> SpoolStatsResponse:
+    """Queue depth and lag of the asynchronous ingest spool."""
+    spool: Optional[Spool] = request.app.state.hae_spool
+    if spool is None:
+        return SpoolStatsResponse(mode=HAE_INGEST_MODE, depth=0, lag_seconds=0.0)
+    
+    partitions = [SpoolPartitionStats(**asdict(stats)) for stats in spool.stats()]
+    return SpoolStatsResponse(
+        mode=HAE_INGEST_MODE,
+        depth=sum(p.depth for p in partitions),
+        lag_seconds=max(p.lag_seconds for p in partitions),
+        partitions=partitions
+    )
+
+@router.get("/hae/watermark/{user_id}")
+async def get_watermark(user_id: str, pool: DbPool, user: AuthorizedUser) -> WatermarkResponse:
+    """
+    Latest stored timestamp per metric for a user.
+    
+    Exporters can send only points newer than these watermarks.
+    
+    Unlike the webhook, this requires authentication (the ingest router has it
+    disabled): it is only answered for the signed-in user's own id.
+    """
+    if user.sub != user_id:
+        raise HTTPException(status_code=403, detail="Watermarks can only be read for your own user")
+    
+    watermarks = await hae_watermarks.get(pool, user_id, refresh=True)
+    return WatermarkResponse(user_id=user_id, watermarks=watermarks)
+
+async def ingest_upload(pool: asyncpg.Pool, session: UploadSession) -> None:
+    """Background ingest of a committed upload, streamed chunk by chunk from the database"""
+    bind_user(session.user_id)
+    chunks = hae_uploads.chunks(pool, session.upload_id)
+    if session.content_encoding:
+        chunks = decompress_stream(
+            chunks, content_encodings(session.content_encoding), HAE_UPLOAD_MAX_BYTES, HAE_MAX_COMPRESSION_RATIO
+        )
+    body = StreamedBody(chunks)
+    
+    async def on_progress(points_written: int) -> None:
+        await hae_uploads.progress(pool, session.upload_id, points_written)
+    
+    log.info("upload.started", upload_id=session.upload_id, chunks=session.total_chunks)
+    try:
+        counts, streamed = await write_streamed_body(
+            pool, session.user_id, body, session.backfill, HAE_UPLOAD_TX_CHUNK_POINTS, on_progress
         )
+        result = streamed_response(session.user_id, body, counts, streamed)
+        await remember_streamed_delivery(pool, session.user_id, streamed, result, session.backfill)
+        await hae_uploads.finish(pool, session.upload_id, COMPLETED, result=result.model_dump())
+        log.info("upload.completed", upload_id=session.upload_id, bytes=body.size, processed=counts.processed)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.error("upload.failed", upload_id=session.upload_id, error=str(e), exc_info=True)
+        await hae_uploads.finish(pool, session.upload_id, FAILED, error=str(e))
+
+async def get_upload_session(pool: asyncpg.Pool, user_id: str, upload_id: uuid.UUID) -> UploadSession:
+    session = await hae_uploads.get(pool, user_id, str(upload_id))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+@router.post("/hae/uploads/{user_id}", status_code=201)
+async def start_upload(user_id: str, body: UploadStartRequest, pool: DbPool) -> UploadStatusResponse:
+    """
+    Start a resumable chunked upload of one large HAE JSON document.
+    
+    Split the document (optionally gzip/zstd compressed as a whole) into numbered
+    chunks, PUT each to `/hae/uploads/{user_id}/{upload_id}/chunks/{n}` starting
+    at 0, then POST `/commit`. After a disconnect, GET the upload to see which
+    chunks are missing and send only those.
+    
+    An upload holds at most HAE_UPLOAD_MAX_CHUNKS chunks and
+    HAE_UPLOAD_MAX_STORED_BYTES bytes; chunks beyond either get 413.
+    """
+    try:
+        content_encodings(body.content_encoding)
+    except UnsupportedEncoding as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    session = await hae_uploads.create(pool, user_id, body.total_chunks, body.content_encoding, body.backfill)
+    log.info("upload.created", upload_id=session.upload_id, total_chunks=body.total_chunks)
+    return UploadStatusResponse.from_session(session)
+
+@router.put("/hae/uploads/{user_id}/{upload_id}/chunks/{index}")
+async def put_upload_chunk(
+    user_id: str,
+    upload_id: uuid.UUID,
+    index: int,
+    request: Request,
+    pool: DbPool
+) -> UploadChunkResponse:
+    """Store one chunk (raw bytes); sending a chunk again replaces it."""
+    if index < 0:
+        raise HTTPException(status_code=422, detail="Chunk index must be >= 0")
+    
+    content_length = request.headers.get("content-length")
+    if content_length is not None and int(content_length) > HAE_UPLOAD_MAX_CHUNK_BYTES:
+        raise HTTPException(status_code=413, detail=f"Chunks are limited to {HAE_UPLOAD_MAX_CHUNK_BYTES} bytes")
+    
+    parts, size = [], 0
+    async for part in request.stream():
+        size += len(part)
+        if size > HAE_UPLOAD_MAX_CHUNK_BYTES:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {HAE_UPLOAD_MAX_CHUNK_BYTES} bytes")
+        parts.append(part)
+    chunk = b"".join(parts)
+    
+    try:
+        digest = await hae_uploads.put_chunk(pool, user_id, str(upload_id), index, chunk)
+    except UploadLimitExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if digest is None:
+        session = await get_upload_session(pool, user_id, upload_id)
+        raise HTTPException(status_code=409, detail=f"Upload is {session.status}, chunks can no longer be added")
+    
+    return UploadChunkResponse(upload_id=str(upload_id), chunk=index, bytes=len(chunk), sha256=digest)
+
+@router.get("/hae/uploads/{user_id}/{upload_id}")
+async def get_upload(user_id: str, upload_id: uuid.UUID, pool: DbPool) -> UploadStatusResponse:
+    """Received/missing chunks and ingest progress of an upload."""
+    return UploadStatusResponse.from_session(await get_upload_session(pool, user_id, upload_id))
+
+@router.post("/hae/uploads/{user_id}/{upload_id}/commit", status_code=202)
+async def commit_upload(
+    user_id: str,
+    upload_id: uuid.UUID,
+    pool: DbPool,
+    body: Optional[UploadCommitRequest] = None
+) -> UploadStatusResponse:
+    """
+    Finish an upload and ingest it in the background.
+    
+    All chunks 0..total_chunks-1 must have been received. Failed uploads (and
+    ones whose processing stalled) can be committed again; writes are idempotent.
+    """
+    session = await get_upload_session(pool, user_id, upload_id)
+    if session.status == COMPLETED:
+        return UploadStatusResponse.from_session(session)
+    
+    total_chunks = (body.total_chunks if body else None) or session.total_chunks
+    if total_chunks is None:
+        raise HTTPException(status_code=409, detail="total_chunks is required to commit")
+    session.total_chunks = total_chunks
+    if session.missing_chunks or (session.received_chunks and session.received_chunks[-1] >= total_chunks):
+        raise HTTPException(status_code=409, detail={
+            "message": "Upload is incomplete",
+            "missing_chunks": session.missing_chunks
+        })
+    
+    if not await hae_uploads.claim(pool, user_id, session.upload_id, total_chunks):
+        raise HTTPException(status_code=409, detail="Upload is already being processed")
+    
+    session = await get_upload_session(pool, user_id, upload_id)
+    task = asyncio.create_task(ingest_upload(pool, session))
+    hae_upload_tasks[session.upload_id] = task
+    task.add_done_callback(lambda _: hae_upload_tasks.pop(session.upload_id, None))
+    return UploadStatusResponse.from_session(session)
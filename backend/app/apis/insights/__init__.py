@@ -5,8 +5,9 @@ from fastapi import APIRouter, HTTPException, Query
 import asyncpg
 import databutton as db
 import requests
-from app.env import mode, Mode
 from app.auth import AuthorizedUser
+from app.libs.database import DbPool
+from app.libs.rollups import SLEEP_EFFICIENCY, SLEEP_HOURS, range_stats
 
 router = APIRouter()
 
@@ -41,90 +42,43 @@ class InsightsResponse(BaseModel):
     changes: MetricChanges = Field(..., description="Changes between periods")
     insight: str = Field(..., description="AI-generated health insight")
 
-# Database helper
-async def get_db_connection():
-    """Get database connection based on environment"""
-    if mode == Mode.PROD:
-        database_url = db.secrets.get("DATABASE_URL_PROD")
-    else:
-        database_url = db.secrets.get("DATABASE_URL_DEV")
-    
-    if not database_url:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    
-    return await asyncpg.connect(database_url)
+# Period statistics come from the hourly/daily rollups plus raw rows at the
+# partial-hour edges of the period (see app.libs.rollups)
 
 async def get_hrv_stats(conn: asyncpg.Connection, user_id: str, start_time: datetime, end_time: datetime) -> MetricStats:
     """Get HRV statistics for a time period"""
-    query = """
-        SELECT 
-            AVG(value) as avg_val,
-            MIN(value) as min_val,
-            MAX(value) as max_val
-        FROM health_metrics 
-        WHERE user_id = $1 
-        AND metric_name = 'heart_rate_variability'
-        AND timestamp BETWEEN $2 AND $3
-    """
+    result = await range_stats(conn, user_id, "heart_rate_variability", start_time, end_time)
     
-    result = await conn.fetchrow(query, user_id, start_time, end_time)
-    
-    if not result or result['avg_val'] is None:
+    if not result.count:
         return MetricStats(avg=0.0, min=0.0, max=0.0)
     
     return MetricStats(
-        avg=float(result['avg_val']),
-        min=float(result['min_val']) if result['min_val'] else 0.0,
-        max=float(result['max_val']) if result['max_val'] else 0.0
+        avg=result.avg,
+        min=float(result.min) if result.min else 0.0,
+        max=float(result.max) if result.max else 0.0
     )
 
 async def get_sleep_stats(conn: asyncpg.Connection, user_id: str, start_time: datetime, end_time: datetime) -> SleepStats:
     """Get sleep statistics for a time period"""
-    query = """
-        SELECT 
-            AVG(duration_total_minutes) / 60.0 as avg_duration_hours,
-            AVG(efficiency) as avg_efficiency
-        FROM sleep_metrics 
-        WHERE user_id = $1 
-        AND start_time BETWEEN $2 AND $3
-    """
+    duration = await range_stats(conn, user_id, SLEEP_HOURS, start_time, end_time)
     
-    result = await conn.fetchrow(query, user_id, start_time, end_time)
-    
-    if not result or result['avg_duration_hours'] is None:
+    if not duration.count:
         return SleepStats(avg_duration_hours=0.0, avg_efficiency=0.0)
     
+    efficiency = await range_stats(conn, user_id, SLEEP_EFFICIENCY, start_time, end_time)
     return SleepStats(
-        avg_duration_hours=float(result['avg_duration_hours']),
-        avg_efficiency=float(result['avg_efficiency']) if result['avg_efficiency'] else 0.0
+        avg_duration_hours=duration.avg,
+        avg_efficiency=efficiency.avg or 0.0
     )
 
 async def get_workout_stats(conn: asyncpg.Connection, user_id: str, start_time: datetime, end_time: datetime) -> WorkoutStats:
     """Get workout statistics for a time period"""
-    # Get calories from health_metrics
-    calories_query = """
-        SELECT COALESCE(SUM(value), 0) as total_calories
-        FROM health_metrics 
-        WHERE user_id = $1 
-        AND metric_name = 'workout'
-        AND timestamp BETWEEN $2 AND $3
-    """
-    
-    # Get session count from workout entries
-    sessions_query = """
-        SELECT COUNT(*) as session_count
-        FROM health_metrics 
-        WHERE user_id = $1 
-        AND metric_name = 'workout'
-        AND timestamp BETWEEN $2 AND $3
-    """
-    
-    calories_result = await conn.fetchrow(calories_query, user_id, start_time, end_time)
-    sessions_result = await conn.fetchrow(sessions_query, user_id, start_time, end_time)
+    # Calories and session count of the workout entries in health_metrics
+    result = await range_stats(conn, user_id, "workout", start_time, end_time)
     
     return WorkoutStats(
-        total_calories=float(calories_result['total_calories']) if calories_result else 0.0,
-        session_count=int(sessions_result['session_count']) if sessions_result else 0
+        total_calories=result.sum,
+        session_count=result.count
     )
 
 async def generate_ai_insight(current: PeriodData, previous: PeriodData, period_hours: int) -> str:
@@ -194,6 +148,7 @@ Provide a single holistic health recommendation based on these trends."""
 @router.get("/insights")
 async def get_health_insights(
     user: AuthorizedUser,
+    pool: DbPool,
     range_hours: int = Query(24, ge=1, le=168, description="Analysis time window in hours (1-168)")
 ) -> InsightsResponse:
     """
@@ -235,9 +190,8 @@ async def get_health_insights(
     print(f"Previous period: {previous_start} to {previous_end}")
     
     try:
-        conn = await get_db_connection()
-        
-        try:
+        # Release the connection before the (slow) AI call
+        async with pool.acquire() as conn:
             # Get current period stats
             current_hrv = await get_hrv_stats(conn, user_id, current_start, current_end)
             current_sleep = await get_sleep_stats(conn, user_id, current_start, current_end)
@@ -247,47 +201,44 @@ async def get_health_insights(
             previous_hrv = await get_hrv_stats(conn, user_id, previous_start, previous_end)
             previous_sleep = await get_sleep_stats(conn, user_id, previous_start, previous_end)
             previous_workout = await get_workout_stats(conn, user_id, previous_start, previous_end)
-            
-            # Create period data objects
-            current_data = PeriodData(
-                hrv=current_hrv,
-                sleep=current_sleep,
-                workout=current_workout
-            )
-            
-            previous_data = PeriodData(
-                hrv=previous_hrv,
-                sleep=previous_sleep,
-                workout=previous_workout
-            )
-            
-            # Calculate changes
-            hrv_change = ((current_hrv.avg - previous_hrv.avg) / previous_hrv.avg * 100) if previous_hrv.avg > 0 else 0
-            sleep_change = current_sleep.avg_duration_hours - previous_sleep.avg_duration_hours
-            calorie_change = current_workout.total_calories - previous_workout.total_calories
-            
-            changes = MetricChanges(
-                hrv_change_percent=hrv_change,
-                sleep_duration_change=sleep_change,
-                workout_calorie_change=calorie_change
-            )
-            
-            # Generate AI insight
-            ai_insight = await generate_ai_insight(current_data, previous_data, range_hours)
-            
-            print(f"Generated insights with {len(ai_insight)} character AI response")
-            
-            return InsightsResponse(
-                period_hours=range_hours,
-                current=current_data,
-                previous=previous_data,
-                changes=changes,
-                insight=ai_insight
-            )
-            
-        finally:
-            await conn.close()
-            
+        
+        # Create period data objects
+        current_data = PeriodData(
+            hrv=current_hrv,
+            sleep=current_sleep,
+            workout=current_workout
+        )
+        
+        previous_data = PeriodData(
+            hrv=previous_hrv,
+            sleep=previous_sleep,
+            workout=previous_workout
+        )
+        
+        # Calculate changes
+        hrv_change = ((current_hrv.avg - previous_hrv.avg) / previous_hrv.avg * 100) if previous_hrv.avg > 0 else 0
+        sleep_change = current_sleep.avg_duration_hours - previous_sleep.avg_duration_hours
+        calorie_change = current_workout.total_calories - previous_workout.total_calories
+        
+        changes = MetricChanges(
+            hrv_change_percent=hrv_change,
+            sleep_duration_change=sleep_change,
+            workout_calorie_change=calorie_change
+        )
+        
+        # Generate AI insight
+        ai_insight = await generate_ai_insight(current_data, previous_data, range_hours)
+        
+        print(f"Generated insights with {len(ai_insight)} character AI response")
+        
+        return InsightsResponse(
+            period_hours=range_hours,
+            current=current_data,
+            previous=previous_data,
+            changes=changes,
+            insight=ai_insight
+        )
+
     except Exception as e:
         error_msg = f"Error generating health insights: {str(e)}"
         print(f"Health insights error for user {user_id}: {error_msg}")
@@ -1,14 +1,32 @@
-from datetime import datetime
-from typing import List, Optional, Literal
+import base64
+import binascii
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Literal, Tuple
 from pydantic import BaseModel, Field, validator
 from fastapi import APIRouter, HTTPException, Query
+import asyncio
 import asyncpg
-import databutton as db
-from app.env import mode, Mode
+import numpy as np
 from app.auth import AuthorizedUser
+from app.libs.database import DbConnection, DbPool
+from app.libs.downsampling import MIN_LTTB_POINTS, lttb, min_max
+from app.libs.metric_catalog import metric_catalog
+from app.libs.rollups import RANGE_MAX, RANGE_MIN, SLEEP_HOURS, range_stats_query
 
 router = APIRouter()
 
+# Longest range (in points) downsampled in Python; longer ones are reduced in Postgres first
+DOWNSAMPLE_MAX_FETCH_ROWS = int(os.environ.get("METRICS_DOWNSAMPLE_MAX_FETCH_ROWS", "200000"))
+
+# Queries per /metrics/batch request, and how many of them run at once (one pooled connection each)
+MAX_BATCH_QUERIES = 10
+BATCH_CONCURRENCY = int(os.environ.get("METRICS_BATCH_CONCURRENCY", "3"))
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 # Pydantic models
 class MetricDataPoint(BaseModel):
     timestamp: datetime = Field(..., description="Timestamp of the measurement")
@@ -16,218 +34,441 @@ class MetricDataPoint(BaseModel):
 
 class MetricsResponse(BaseModel):
     data: List[MetricDataPoint] = Field(..., description="Array of metric data points")
-    total_count: int = Field(..., description="Total number of records matching query")
+    total_count: Optional[int] = Field(None, description="Total number of records matching query (null with count=none)")
+    has_more: bool = Field(False, description="Whether more records follow the returned ones")
+    next_cursor: Optional[str] = Field(None, description="Pass as 'cursor' to fetch the next page (null on the last page)")
+
+class AggregateBucket(BaseModel):
+    timestamp: datetime = Field(..., description="Start of the bucket")
+    count: Optional[int] = Field(None, description="Number of points")
+    avg: Optional[float] = Field(None, description="Average value")
+    min: Optional[float] = Field(None, description="Minimum value")
+    max: Optional[float] = Field(None, description="Maximum value")
+    sum: Optional[float] = Field(None, description="Sum of values")
+    p50: Optional[float] = Field(None, description="Median (interpolated)")
+    p90: Optional[float] = Field(None, description="90th percentile (interpolated)")
+
+class AggregateResponse(BaseModel):
+    data: List[AggregateBucket] = Field(..., description="Non-empty buckets in time order, with the requested aggregates")
+    has_more: bool = Field(False, description="Whether more buckets follow the returned ones")
 
 # Type definitions for metric names
 MetricType = Literal["heart_rate_variability", "workout", "sleep"]
+CountMode = Literal["exact", "none"]
+DownsampleMethod = Literal["lttb", "min_max"]
+BucketSize = Literal["5m", "1h", "1d", "1w"]
 
-# Database helper
-async def get_db_connection():
-    """Get database connection based on environment"""
-    if mode == Mode.PROD:
-        database_url = db.secrets.get("DATABASE_URL_PROD")
-    else:
-        database_url = db.secrets.get("DATABASE_URL_DEV")
-    
-    if not database_url:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    
-    return await asyncpg.connect(database_url)
+class MetricQuery(BaseModel):
+    metric: MetricType = Field(..., description="Metric type to query")
+    from_date: Optional[datetime] = Field(None, alias="from", description="Start date for range query (ISO datetime)")
+    to_date: Optional[datetime] = Field(None, alias="to", description="End date for range query (ISO datetime)")
+    limit: int = Field(1000, ge=1, le=5000, description="Maximum records to return")
+    count: CountMode = Field("exact", description="'exact' total_count, or 'none' to skip it (use has_more)")
+    cursor: Optional[str] = Field(None, description="next_cursor of the previous page")
+    max_points: Optional[int] = Field(None, ge=MIN_LTTB_POINTS, le=5000, description="Downsample the whole range to at most this many points")
+    downsample: DownsampleMethod = Field("lttb", description="'lttb' or 'min_max'")
 
-async def query_sleep_metrics(
-    conn: asyncpg.Connection, 
-    user_id: str, 
-    from_date: Optional[datetime], 
-    to_date: Optional[datetime], 
-    limit: int
-) -> List[MetricDataPoint]:
-    """Query sleep metrics and return duration in hours"""
-    
-    query = """
-        SELECT start_time as timestamp, 
-               duration_total_minutes / 60.0 as value
-        FROM sleep_metrics 
-        WHERE user_id = $1
+class BatchMetricsRequest(BaseModel):
+    queries: List[MetricQuery] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES, description="Queries, each as the parameters of /metrics")
+
+class BatchMetricsResponse(BaseModel):
+    results: List[MetricsResponse] = Field(..., description="One response per query, in request order")
+
+BUCKET_WIDTHS = {"5m": timedelta(minutes=5), "1h": timedelta(hours=1), "1d": timedelta(days=1), "1w": timedelta(weeks=1)}
+# Rollup resolution whole buckets of each size are summed from (none for 5m)
+BUCKET_ROLLUPS = {"1h": "hour", "1d": "day", "1w": "day"}
+# A Monday 00:00 UTC: weeks start on Monday, other buckets on the UTC hour/day
+BUCKET_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+# SQL of each aggregate over points (value v), and over rollup rows
+AGGREGATES = {
+    "count": "count(v)",
+    "avg": "avg(v)",
+    "min": "min(v)",
+    "max": "max(v)",
+    "sum": "sum(v)",
+    "p50": "percentile_cont(0.5) WITHIN GROUP (ORDER BY v)",
+    "p90": "percentile_cont(0.9) WITHIN GROUP (ORDER BY v)",
+}
+ROLLUP_AGGREGATES = {
+    "count": "sum(count)",
+    "avg": "sum(sum) / sum(count)",
+    "min": "min(min)",
+    "max": "max(max)",
+    "sum": "sum(sum)",
+}
+
+@dataclass(frozen=True)
+class MetricSource:
+    table: str
+    time_column: str
+    value_expression: str
+    # Catalog name of health_metrics points (None for other tables)
+    metric_name: Optional[str]
+    # Rollup metric the total count is taken from
+    rollup_metric: str
+
+METRIC_SOURCES = {
+    "sleep": MetricSource("sleep_metrics", "start_time", "duration_total_minutes / 60.0", None, SLEEP_HOURS),
+    "heart_rate_variability": MetricSource(
+        "health_metrics", "timestamp", "value", "heart_rate_variability", "heart_rate_variability"
+    ),
+    # Workout calories (frontend expects calories, as does the insights endpoint)
+    "workout": MetricSource("health_metrics", "timestamp", "value", "workout", "workout"),
+}
+
+def encode_cursor(metric: MetricType, timestamp: datetime) -> str:
+    """Opaque token for the page after the point at `timestamp` (unique per user and metric)"""
+    payload = json.dumps({"m": metric, "t": timestamp.isoformat()}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(metric: MetricType, cursor: str) -> datetime:
+    """Timestamp of a token from encode_cursor; ValueError if it is not one for `metric`"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        timestamp = datetime.fromisoformat(payload["t"])
+        valid = payload["m"] == metric and timestamp.tzinfo is not None
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not valid:
+        raise ValueError("Invalid cursor")
+    return timestamp
+
+async def range_conditions(
+    conn: asyncpg.Connection,
+    source: MetricSource,
+    user_id: str,
+    from_date: Optional[datetime],
+    to_date: Optional[datetime]
+) -> Optional[Tuple[List[str], list]]:
+    """WHERE conditions selecting a user's points of `source` in from/to, with their arguments.
+    
+    None if the metric was never stored, so nothing can match.
     """
+    params: list = [user_id]
+    conditions = ["user_id = $1"]
     
-    params = [user_id]
-    param_count = 1
+    if source.metric_name is not None:
+        metric_id = await metric_catalog.lookup(conn, source.metric_name)
+        if metric_id is None:
+            return None
+        params.append(metric_id)
+        conditions.append(f"metric_id = ${len(params)}")
     
     if from_date:
-        param_count += 1
-        query += f" AND start_time >= ${param_count}"
         params.append(from_date)
+        conditions.append(f"{source.time_column} >= ${len(params)}")
     
     if to_date:
-        param_count += 1
-        query += f" AND start_time <= ${param_count}"
         params.append(to_date)
+        conditions.append(f"{source.time_column} <= ${len(params)}")
     
-    query += " ORDER BY start_time ASC"
+    return conditions, params
+
+async def query_metric_page(
+    conn: asyncpg.Connection,
+    user_id: str,
+    metric: MetricType,
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+    limit: int,
+    count: CountMode = "exact",
+    after: Optional[datetime] = None
+) -> MetricsResponse:
+    """One page of a metric's points, with the total count, in a single statement.
     
-    if limit:
-        param_count += 1
-        query += f" LIMIT ${param_count}"
-        params.append(limit)
+    The exact total comes from the rollups (O(buckets), see range_stats) as a
+    scalar subquery evaluated once; one extra row is fetched to tell whether
+    another page follows.
     
+    Pages are keyset-paginated: a cursor resumes the index scan at the last
+    returned timestamp instead of skipping earlier rows with OFFSET, so every
+    page costs the same however deep it is. `after` is a decoded cursor;
+    total_count stays the count of the whole from/to range.
+    """
+    source = METRIC_SOURCES[metric]
+    where = await range_conditions(conn, source, user_id, from_date, to_date)
+    if where is None:
+        return MetricsResponse(data=[], total_count=0 if count == "exact" else None)
+    conditions, params = where
+    
+    if after:
+        params.append(after)
+        conditions.append(f"{source.time_column} > ${len(params)}")
+    
+    total_column = "NULL::bigint"
+    if count == "exact":
+        stats_sql, stats_args = range_stats_query(
+            user_id, source.rollup_metric, from_date, to_date, first_param=len(params) + 1
+        )
+        total_column = f"(SELECT count FROM ({stats_sql}) stats)"
+        params.extend(stats_args)
+    
+    params.append(limit + 1)
+    query = f"""
+        SELECT {source.time_column} AS timestamp, {source.value_expression} AS value,
+               {total_column} AS total_count
+        FROM {source.table}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {source.time_column}
+        LIMIT ${len(params)}
+    """
     rows = await conn.fetch(query, *params)
     
-    return [
-        MetricDataPoint(timestamp=row['timestamp'], value=float(row['value']))
-        for row in rows
-    ]
+    total_count = None
+    if count == "exact":
+        if rows:
+            total_count = int(rows[0]["total_count"])
+        elif after:
+            # Nothing past the cursor (the points after it were deleted),
+            # so the subquery never ran
+            stats_sql, stats_args = range_stats_query(user_id, source.rollup_metric, from_date, to_date)
+            total_count = int(await conn.fetchval(f"SELECT count FROM ({stats_sql}) stats", *stats_args) or 0)
+        else:
+            # No rows means nothing in range (limit >= 1), so the subquery never ran
+            total_count = 0
+    
+    page = rows[:limit]
+    has_more = len(rows) > limit
+    next_cursor = encode_cursor(metric, page[-1]["timestamp"]) if has_more else None
+    
+    return MetricsResponse(
+        data=[
+            MetricDataPoint(timestamp=row['timestamp'], value=float(row['value']))
+            for row in page
+        ],
+        total_count=total_count,
+        has_more=has_more,
+        next_cursor=next_cursor
+    )
 
-async def query_health_metrics(
+async def query_metric_downsampled(
     conn: asyncpg.Connection,
     user_id: str,
-    metric_name: str,
+    metric: MetricType,
     from_date: Optional[datetime],
     to_date: Optional[datetime],
-    limit: int
-) -> List[MetricDataPoint]:
-    """Query health metrics for specific metric name"""
-    
-    query = """
-        SELECT timestamp, value
-        FROM health_metrics 
-        WHERE user_id = $1 AND metric_name = $2
+    max_points: int,
+    method: DownsampleMethod = "lttb",
+    count: CountMode = "exact"
+) -> MetricsResponse:
+    """The whole from/to range of a metric, downsampled to at most `max_points` points.
+    
+    Ranges of up to DOWNSAMPLE_MAX_FETCH_ROWS points are fetched as two arrays
+    and downsampled with NumPy. The fetch stops one row past that limit; a
+    longer range is instead reduced in Postgres to the lowest and highest
+    point per time bucket, so the rows shipped stay proportional to
+    max_points, and LTTB then runs on the reduced series. The raw rows decide,
+    not the rollup count, which may lag behind them.
     """
-    
-    params = [user_id, metric_name]
-    param_count = 2
-    
-    if from_date:
-        param_count += 1
-        query += f" AND timestamp >= ${param_count}"
-        params.append(from_date)
-    
-    if to_date:
-        param_count += 1
-        query += f" AND timestamp <= ${param_count}"
-        params.append(to_date)
-    
-    query += " ORDER BY timestamp ASC"
-    
-    if limit:
-        param_count += 1
-        query += f" LIMIT ${param_count}"
-        params.append(limit)
-    
-    rows = await conn.fetch(query, *params)
-    
-    return [
-        MetricDataPoint(timestamp=row['timestamp'], value=float(row['value']))
-        for row in rows
-    ]
+    source = METRIC_SOURCES[metric]
+    where = await range_conditions(conn, source, user_id, from_date, to_date)
+    if where is None:
+        return MetricsResponse(data=[], total_count=0 if count == "exact" else None)
+    conditions, params = where
+    conditions.append(f"{source.value_expression} IS NOT NULL")
+    
+    # Microseconds since the epoch keep timestamps exact through float64
+    points_sql = f"""
+        SELECT (extract(epoch FROM {source.time_column}) * 1000000)::bigint AS us,
+               ({source.value_expression})::double precision AS value
+        FROM {source.table}
+        WHERE {" AND ".join(conditions)}
+    """
+    row = await conn.fetchrow(
+        f"""
+        SELECT array_agg(us ORDER BY us) AS us, array_agg(value ORDER BY us) AS value
+        FROM ({points_sql} ORDER BY {source.time_column} LIMIT ${len(params) + 1}) points
+        """,
+        *params, DOWNSAMPLE_MAX_FETCH_ROWS + 1
+    )
+    us = np.array(row["us"] or [], dtype=np.int64)
+    values = np.array(row["value"] or [], dtype=np.float64)
+    if len(us) > DOWNSAMPLE_MAX_FETCH_ROWS:
+        us, values = await _min_max_in_database(
+            conn, points_sql, params, max_points // 2 if method == "min_max" else max_points * 2
+        )
+    
+    total_count = None
+    if count == "exact":
+        stats_sql, stats_args = range_stats_query(user_id, source.rollup_metric, from_date, to_date)
+        total_count = int(await conn.fetchval(f"SELECT count FROM ({stats_sql}) stats", *stats_args))
+    
+    keep = min_max(us, values, max_points // 2) if method == "min_max" else lttb(us, values, max_points)
+    return MetricsResponse(
+        data=[
+            MetricDataPoint(timestamp=EPOCH + timedelta(microseconds=int(us[i])), value=float(values[i]))
+            for i in keep
+        ],
+        total_count=total_count
+    )
 
-async def query_workout_metrics(
+async def _min_max_in_database(
+    conn: asyncpg.Connection,
+    points_sql: str,
+    params: list,
+    buckets: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(us, value) arrays of the lowest and highest point per equal-time bucket, in time order"""
+    bounds = await conn.fetchrow(f"SELECT min(us) AS first, max(us) AS last FROM ({points_sql}) points", *params)
+    first = bounds["first"]
+    if first is None:
+        # The range emptied since it was fetched
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    span = max(bounds["last"] - first, 1)
+    # min/max of ARRAY[value, us] pick a bucket's extreme point together with its time
+    rows = await conn.fetch(
+        f"""
+        SELECT min(ARRAY[value, us::double precision]) AS low, max(ARRAY[value, us::double precision]) AS high
+        FROM ({points_sql}) points
+        GROUP BY least(floor((us - ${len(params) + 1}) * ${len(params) + 2}::double precision / ${len(params) + 3}), ${len(params) + 2} - 1)
+        """,
+        *params, first, buckets, span
+    )
+    extremes = np.array([point for row in rows for point in (row["low"], row["high"])], dtype=np.float64)
+    us, order = np.unique(extremes[:, 1].astype(np.int64), return_index=True)
+    return us, extremes[order, 0]
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def bin_start(value: datetime, width: timedelta) -> datetime:
+    """Start of the bucket of `width` containing `value` (as date_bin with BUCKET_ORIGIN)"""
+    return BUCKET_ORIGIN + (value - BUCKET_ORIGIN) // width * width
+
+async def query_metric_buckets(
     conn: asyncpg.Connection,
     user_id: str,
+    metric: MetricType,
     from_date: Optional[datetime],
     to_date: Optional[datetime],
+    bucket: BucketSize,
+    aggregates: List[str],
     limit: int
-) -> List[MetricDataPoint]:
-    """Query workout metrics - returns calories burned for consistency with frontend display"""
-    
-    # Query workout_calories as primary metric (frontend expects calories)
-    # This aligns with insights endpoint and frontend unit display
-    query = """
-        SELECT timestamp, value
-        FROM health_metrics 
-        WHERE user_id = $1 AND metric_name = 'workout'
-    """
-    
-    params = [user_id]
-    param_count = 1
-    
-    if from_date:
-        param_count += 1
-        query += f" AND timestamp >= ${param_count}"
-        params.append(from_date)
-    
-    if to_date:
-        param_count += 1
-        query += f" AND timestamp <= ${param_count}"
-        params.append(to_date)
-    
-    query += " ORDER BY timestamp ASC"
-    
-    if limit:
-        param_count += 1
-        query += f" LIMIT ${param_count}"
-        params.append(limit)
+) -> AggregateResponse:
+    """A metric's points aggregated per time bucket, in one statement.
     
+    Hourly and longer buckets without percentiles are summed from the rollups
+    for whole buckets inside from/to, with raw rows only at the partial edge
+    buckets (as range_stats does), so a long range costs O(buckets). 5m buckets
+    and percentiles are computed from raw rows with date_bin.
+    """
+    source = METRIC_SOURCES[metric]
+    width = BUCKET_WIDTHS[bucket]
+    where = await range_conditions(conn, source, user_id, None, None)
+    if where is None:
+        return AggregateResponse(data=[])
+    conditions, params = where
+    conditions.append(f"{source.value_expression} IS NOT NULL")
+    
+    # Naive datetimes are UTC; an open start is bucket-aligned, so it has no partial edge
+    start = bin_start(RANGE_MIN + width, width) if from_date is None else _utc(from_date)
+    end = RANGE_MAX if to_date is None else _utc(to_date)
+    resolution = BUCKET_ROLLUPS.get(bucket)
+    from_rollups = resolution is not None and all(a in ROLLUP_AGGREGATES for a in aggregates)
+    
+    if from_rollups:
+        # Whole buckets [first_full, last_full) from rollups, the rest from raw rows
+        first_full = bin_start(start, width)
+        if first_full < start:
+            first_full += width
+        last_full = max(bin_start(end, width), first_full)
+        params.extend([width, BUCKET_ORIGIN, start, first_full, last_full, end, source.rollup_metric, resolution])
+        p = [f"${len(params) - 7 + i}" for i in range(8)]
+        raw_range = (
+            f"{source.time_column} >= {p[2]} AND {source.time_column} <= {p[5]} "
+            f"AND ({source.time_column} < {p[3]} OR {source.time_column} >= {p[4]})"
+        )
+        query = f"""
+            SELECT bucket, {", ".join(f"{ROLLUP_AGGREGATES[a]} AS {a}" for a in aggregates)}
+            FROM (
+                SELECT date_bin({p[0]}, bucket, {p[1]}) AS bucket, count, sum, min, max
+                FROM metric_rollups
+                WHERE user_id = $1 AND metric_name = {p[6]} AND resolution = {p[7]}
+                AND bucket >= {p[3]} AND bucket < {p[4]}
+                UNION ALL
+                SELECT date_bin({p[0]}, {source.time_column}, {p[1]}), count(v), sum(v), min(v), max(v)
+                FROM (
+                    SELECT {source.time_column}, ({source.value_expression})::double precision AS v
+                    FROM {source.table}
+                    WHERE {" AND ".join(conditions)} AND {raw_range}
+                ) edges
+                GROUP BY 1
+            ) parts
+            GROUP BY bucket
+            ORDER BY bucket
+            LIMIT ${len(params) + 1}
+        """
+    else:
+        params.extend([width, BUCKET_ORIGIN, start, end])
+        p = [f"${len(params) - 3 + i}" for i in range(4)]
+        query = f"""
+            SELECT date_bin({p[0]}, {source.time_column}, {p[1]}) AS bucket,
+                   {", ".join(f"{AGGREGATES[a]} AS {a}" for a in aggregates)}
+            FROM (
+                SELECT {source.time_column}, ({source.value_expression})::double precision AS v
+                FROM {source.table}
+                WHERE {" AND ".join(conditions)}
+                AND {source.time_column} >= {p[2]} AND {source.time_column} <= {p[3]}
+            ) points
+            GROUP BY 1
+            ORDER BY 1
+            LIMIT ${len(params) + 1}
+        """
+    params.append(limit + 1)
     rows = await conn.fetch(query, *params)
     
-    return [
-        MetricDataPoint(timestamp=row['timestamp'], value=float(row['value']))
-        for row in rows
-    ]
+    return AggregateResponse(
+        data=[
+            AggregateBucket(timestamp=row["bucket"], **{a: row[a] for a in aggregates})
+            for row in rows[:limit]
+        ],
+        has_more=len(rows) > limit
+    )
+
+def validate_metric_query(
+    metric: MetricType,
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+    cursor: Optional[str],
+    max_points: Optional[int]
+) -> Optional[datetime]:
+    """Check a /metrics query's options; returns the decoded cursor, ValueError if invalid"""
+    if from_date and to_date and from_date >= to_date:
+        raise ValueError("'from' date must be before 'to' date")
+    if cursor and max_points:
+        raise ValueError("'cursor' cannot be combined with 'max_points'")
+    return decode_cursor(metric, cursor) if cursor else None
 
-async def get_total_count(
+async def query_metrics(
     conn: asyncpg.Connection,
     user_id: str,
     metric: MetricType,
     from_date: Optional[datetime],
-    to_date: Optional[datetime]
-) -> int:
-    """Get total count of records for pagination"""
-    
-    if metric == "sleep":
-        query = "SELECT COUNT(*) FROM sleep_metrics WHERE user_id = $1"
-        params = [user_id]
-        param_count = 1
-        
-        if from_date:
-            param_count += 1
-            query += f" AND start_time >= ${param_count}"
-            params.append(from_date)
-        
-        if to_date:
-            param_count += 1
-            query += f" AND start_time <= ${param_count}"
-            params.append(to_date)
-    
-    elif metric == "heart_rate_variability":
-        query = "SELECT COUNT(*) FROM health_metrics WHERE user_id = $1 AND metric_name = 'heart_rate_variability'"
-        params = [user_id]
-        param_count = 1
-        
-        if from_date:
-            param_count += 1
-            query += f" AND timestamp >= ${param_count}"
-            params.append(from_date)
-        
-        if to_date:
-            param_count += 1
-            query += f" AND timestamp <= ${param_count}"
-            params.append(to_date)
-    
-    elif metric == "workout":
-        query = "SELECT COUNT(*) FROM health_metrics WHERE user_id = $1 AND metric_name = 'workout'"
-        params = [user_id]
-        param_count = 1
-        
-        if from_date:
-            param_count += 1
-            query += f" AND timestamp >= ${param_count}"
-            params.append(from_date)
-        
-        if to_date:
-            param_count += 1
-            query += f" AND timestamp <= ${param_count}"
-            params.append(to_date)
-    
-    result = await conn.fetchval(query, *params)
-    return int(result) if result else 0
+    to_date: Optional[datetime],
+    limit: int,
+    count: CountMode,
+    after: Optional[datetime],
+    max_points: Optional[int],
+    downsample: DownsampleMethod
+) -> MetricsResponse:
+    """A page of points, or the downsampled range with max_points"""
+    if max_points:
+        return await query_metric_downsampled(conn, user_id, metric, from_date, to_date, max_points, downsample, count)
+    return await query_metric_page(conn, user_id, metric, from_date, to_date, limit, count, after)
 
 @router.get("/metrics")
 async def get_metrics(
+    conn: DbConnection,
     metric: MetricType = Query(..., description="Metric type to query"),
     user: AuthorizedUser = None,
     from_date: Optional[datetime] = Query(None, alias="from", description="Start date for range query (ISO datetime)"),
     to_date: Optional[datetime] = Query(None, alias="to", description="End date for range query (ISO datetime)"),
-    limit: int = Query(1000, ge=1, le=5000, description="Maximum records to return")
+    limit: int = Query(1000, ge=1, le=5000, description="Maximum records to return"),
+    count: CountMode = Query("exact", description="'exact' total_count, or 'none' to skip it (use has_more)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    max_points: Optional[int] = Query(None, ge=MIN_LTTB_POINTS, le=5000, description="Downsample the whole range to at most this many points (limit and cursor do not apply)"),
+    downsample: DownsampleMethod = Query("lttb", description="'lttb' (line shape) or 'min_max' (lowest and highest point per time bucket)")
 ) -> MetricsResponse:
     """
     Query health metrics data with proper metric mapping and pagination.
@@ -244,6 +485,14 @@ async def get_metrics(
     **Pagination:**
     - Default limit: 1000, Maximum: 5000
     - Results ordered by timestamp ASC
+    - has_more tells whether records follow the returned ones; clients that only
+      page forward can pass count=none to skip the total
+    - Pass next_cursor back as cursor (with the same metric, from and to) for the
+      next page; every page costs the same however deep it is
+    
+    **Downsampling:**
+    - max_points returns the whole from/to range reduced to at most that many
+      real points (has_more is false), for charts that cannot show more
     """
     
     if not user:
@@ -251,40 +500,128 @@ async def get_metrics(
     
     user_id = user.sub
     
-    # Validate date range
-    if from_date and to_date and from_date >= to_date:
-        raise HTTPException(status_code=400, detail="'from' date must be before 'to' date")
+    try:
+        after = validate_metric_query(metric, from_date, to_date, cursor, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    print(f"Querying {metric} metrics for user {user_id}, from={from_date}, to={to_date}, limit={limit}")
+    print(f"Querying {metric} metrics for user {user_id}, from={from_date}, to={to_date}, limit={limit}, count={count}, cursor={cursor}, max_points={max_points}")
     
     try:
-        conn = await get_db_connection()
+        response = await query_metrics(
+            conn, user_id, metric, from_date, to_date, limit, count, after, max_points, downsample
+        )
         
-        try:
-            # Get total count for pagination info
-            total_count = await get_total_count(conn, user_id, metric, from_date, to_date)
-            
-            # Query data based on metric type
-            if metric == "sleep":
-                data_points = await query_sleep_metrics(conn, user_id, from_date, to_date, limit)
-            elif metric == "heart_rate_variability":
-                data_points = await query_health_metrics(conn, user_id, "heart_rate_variability", from_date, to_date, limit)
-            elif metric == "workout":
-                data_points = await query_workout_metrics(conn, user_id, from_date, to_date, limit)
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported metric type: {metric}")
-            
-            print(f"Retrieved {len(data_points)} data points out of {total_count} total")
+        print(f"Retrieved {len(response.data)} data points out of {response.total_count} total")
+        
+        return response
             
-            return MetricsResponse(
-                data=data_points,
-                total_count=total_count
+    except Exception as e:
+        error_msg = f"Error querying metrics: {str(e)}"
+        print(f"Metrics query error for user {user_id}: {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+@router.post("/metrics/batch")
+async def get_metrics_batch(
+    body: BatchMetricsRequest,
+    pool: DbPool,
+    user: AuthorizedUser = None
+) -> BatchMetricsResponse:
+    """
+    Run several /metrics queries in one request, e.g. every chart of a dashboard.
+    
+    Each query takes the /metrics parameters (its own metric, range, limit,
+    cursor and max_points) and gets the response /metrics would return, in
+    request order. Queries run concurrently, each on its own pooled
+    connection, at most METRICS_BATCH_CONCURRENCY (default 3) at a time.
+    """
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    
+    user_id = user.sub
+    
+    cursors = []
+    for index, query in enumerate(body.queries):
+        try:
+            cursors.append(validate_metric_query(
+                query.metric, query.from_date, query.to_date, query.cursor, query.max_points
+            ))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"queries[{index}]: {e}")
+    
+    print(f"Querying {len(body.queries)} metric batches for user {user_id}: {[q.metric for q in body.queries]}")
+    
+    # Bounded so one batch leaves pool connections to other requests
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def run(query: MetricQuery, after: Optional[datetime]) -> MetricsResponse:
+        async with semaphore, pool.acquire() as conn:
+            return await query_metrics(
+                conn, user_id, query.metric, query.from_date, query.to_date, query.limit,
+                query.count, after, query.max_points, query.downsample
             )
-            
-        finally:
-            await conn.close()
+    
+    try:
+        results = await asyncio.gather(*(run(query, after) for query, after in zip(body.queries, cursors)))
+        
+        print(f"Retrieved {sum(len(r.data) for r in results)} data points for {len(results)} queries")
+        
+        return BatchMetricsResponse(results=results)
             
     except Exception as e:
         error_msg = f"Error querying metrics: {str(e)}"
-        print(f"Metrics query error for user {user_id}: {error_msg}")
+        print(f"Metrics batch error for user {user_id}: {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+@router.get("/metrics/aggregate", response_model_exclude_none=True)
+async def get_metrics_aggregate(
+    conn: DbConnection,
+    metric: MetricType = Query(..., description="Metric type to aggregate"),
+    user: AuthorizedUser = None,
+    bucket: BucketSize = Query(..., description="Bucket size: 5m, 1h, 1d or 1w (weeks start on Monday, UTC)"),
+    agg: str = Query("avg", description="Comma-separated aggregates: avg, min, max, sum, count, p50, p90"),
+    from_date: Optional[datetime] = Query(None, alias="from", description="Start date for range query (ISO datetime)"),
+    to_date: Optional[datetime] = Query(None, alias="to", description="End date for range query (ISO datetime)"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum buckets to return")
+) -> AggregateResponse:
+    """
+    Aggregate health metrics per time bucket, e.g. daily average HRV or weekly
+    workout calories.
+    
+    Metrics map to values as in /metrics. Buckets are aligned to UTC and only
+    non-empty ones are returned, in time order; the first and last bucket only
+    cover the part inside from/to.
+    """
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    
+    user_id = user.sub
+    
+    if from_date and to_date and from_date >= to_date:
+        raise HTTPException(status_code=400, detail="'from' date must be before 'to' date")
+    
+    aggregates = list(dict.fromkeys(a.strip() for a in agg.split(",") if a.strip()))
+    unknown = [a for a in aggregates if a not in AGGREGATES]
+    if not aggregates or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'agg' must list aggregates from {', '.join(AGGREGATES)} (got {agg!r})"
+        )
+    
+    print(f"Aggregating {metric} metrics for user {user_id}, bucket={bucket}, agg={aggregates}, from={from_date}, to={to_date}")
+    
+    try:
+        response = await query_metric_buckets(
+            conn, user_id, metric, from_date, to_date, bucket, aggregates, limit
+        )
+        
+        print(f"Retrieved {len(response.data)} buckets")
+        
+        return response
+            
+    except Exception as e:
+        error_msg = f"Error aggregating metrics: {str(e)}"
+        print(f"Metrics aggregate error for user {user_id}: {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
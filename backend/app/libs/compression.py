@@ -0,0 +1,153 @@
+"""Streaming, size-bounded decompression of request bodies.
+
+Supports `Content-Encoding: gzip` and `zstd` (and chains such as
+"gzip, zstd"). Output is produced incrementally and checked against an
+absolute size limit and a maximum compression ratio, so a decompression bomb
+is rejected after a bounded amount of work instead of exhausting memory.
+
+Usage:
+
+    from app.libs.compression import content_encodings, decompress_stream
+
+    encodings = content_encodings(request.headers.get("content-encoding"))
+    async for chunk in decompress_stream(request.stream(), encodings, max_bytes=256 << 20):
+        ...
+"""
+
+import zlib
+from typing import AsyncIterator, Iterator, List, Optional
+
+import zstandard
+
+# Upper bound on output produced per decompressor call
+OUTPUT_CHUNK_BYTES = 256 * 1024
+
+# zstd has no output limit per call; feeding it small input slices bounds a
+# single call to roughly slice * 32 KiB of output even for run-length bombs
+ZSTD_INPUT_SLICE_BYTES = 256
+
+# Largest zstd window accepted (the decoder allocates this much)
+ZSTD_MAX_WINDOW_BYTES = 1 << 27
+
+
+class DecompressionError(ValueError):
+    """Body could not be decompressed"""
+
+
+class UnsupportedEncoding(DecompressionError):
+    pass
+
+
+class DecompressedTooLarge(DecompressionError):
+    pass
+
+
+class _GzipDecoder:
+    def __init__(self):
+        self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        while data:
+            if self._decoder.eof:
+                # Concatenated gzip members
+                self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                out = self._decoder.decompress(data, OUTPUT_CHUNK_BYTES)
+            except zlib.error as e:
+                raise DecompressionError(f"Invalid gzip body: {e}") from e
+            data = self._decoder.unused_data if self._decoder.eof else self._decoder.unconsumed_tail
+            if out:
+                yield out
+
+    def finish(self) -> None:
+        if not self._decoder.eof:
+            raise DecompressionError("Truncated gzip body")
+
+
+class _ZstdDecoder:
+    def __init__(self):
+        self._decoder = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_BYTES).decompressobj()
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        for start in range(0, len(data), ZSTD_INPUT_SLICE_BYTES):
+            piece = data[start:start + ZSTD_INPUT_SLICE_BYTES]
+            while piece:
+                if self._decoder.eof:
+                    # Concatenated frames
+                    self._decoder = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_BYTES).decompressobj()
+                try:
+                    out = self._decoder.decompress(piece)
+                except zstandard.ZstdError as e:
+                    raise DecompressionError(f"Invalid zstd body: {e}") from e
+                # A slice can hold the end of one frame and the start of the next
+                piece = self._decoder.unused_data if self._decoder.eof else b""
+                if out:
+                    yield out
+
+    def finish(self) -> None:
+        if not self._decoder.eof:
+            raise DecompressionError("Truncated zstd body")
+
+
+_DECODERS = {
+    "gzip": _GzipDecoder,
+    "x-gzip": _GzipDecoder,
+    "zstd": _ZstdDecoder,
+}
+
+
+def content_encodings(header: Optional[str]) -> List[str]:
+    """Encodings of a Content-Encoding header in the order they were applied"""
+    if not header:
+        return []
+    encodings = [e.strip().lower() for e in header.split(",") if e.strip()]
+    encodings = [e for e in encodings if e != "identity"]
+    for encoding in encodings:
+        if encoding not in _DECODERS:
+            raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+    return encodings
+
+
+async def decompress_stream(
+    chunks: AsyncIterator[bytes],
+    encodings: List[str],
+    max_bytes: int,
+    max_ratio: Optional[float] = None,
+) -> AsyncIterator[bytes]:
+    """Undo `encodings` on a byte stream, yielding bounded chunks of output.
+
+    Raises DecompressedTooLarge once the output exceeds max_bytes or
+    max_ratio times the compressed input read so far (plus one output chunk
+    of slack for small bodies).
+    """
+    decoders = [_DECODERS[encoding]() for encoding in reversed(encodings)]
+    compressed = produced = 0
+
+    def run(data: bytes, layer: int) -> Iterator[bytes]:
+        if layer == len(decoders):
+            yield data
+            return
+        for out in decoders[layer].decompress(data):
+            yield from run(out, layer + 1)
+
+    async for chunk in chunks:
+        compressed += len(chunk)
+        for out in run(chunk, 0):
+            produced += len(out)
+            if produced > max_bytes:
+                raise DecompressedTooLarge(f"Decompressed body exceeds {max_bytes} bytes")
+            if max_ratio is not None and produced > compressed * max_ratio + OUTPUT_CHUNK_BYTES:
+                raise DecompressedTooLarge(f"Compression ratio exceeds {max_ratio:g}")
+            yield out
+
+    for decoder in decoders:
+        decoder.finish()
+
+
+__all__ = [
+    "DecompressedTooLarge",
+    "DecompressionError",
+    "UnsupportedEncoding",
+    "content_encodings",
+    "decompress_stream",
+]
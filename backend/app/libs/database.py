@@ -0,0 +1,130 @@
+"""Process-wide asyncpg connection pool.
+
+The pool is opened by the app lifespan in `main.create_app()` and handed to
+the API routers as a dependency.
+
+Usage:
+
+    from app.libs.database import DbConnection, DbPool
+
+    @router.get("/example")
+    async def example(conn: DbConnection):
+        return await conn.fetchval("SELECT 1")
+
+    @router.post("/example")
+    async def example_batch(pool: DbPool):
+        async with pool.acquire() as conn:
+            ...
+
+Pool sizing is configured through environment variables:
+
+- DB_POOL_MIN_SIZE: connections opened and warmed up on startup (default 2)
+- DB_POOL_MAX_SIZE: upper bound on concurrent connections (default 10)
+- DB_POOL_MAX_IDLE_SECONDS: idle connections are closed after this (default 300)
+- DB_POOL_MAX_QUERIES: connections are recycled after this many queries (default 50000)
+- DB_POOL_CLOSE_TIMEOUT: seconds to wait for checked-out connections on shutdown (default 10)
+"""
+
+import asyncio
+import os
+from typing import Annotated, AsyncIterator
+
+import asyncpg
+import databutton as db
+from fastapi import Depends, HTTPException
+from fastapi.requests import HTTPConnection
+
+from app.env import mode, Mode
+from app.libs.structured_log import get_logger
+
+log = get_logger("database")
+
+
+def get_database_url() -> str | None:
+    """Get database url based on environment"""
+    if mode == Mode.PROD:
+        return db.secrets.get("DATABASE_URL_PROD")
+    return db.secrets.get("DATABASE_URL_DEV")
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+async def create_pool() -> asyncpg.Pool | None:
+    """Create the pool and warm up its minimum number of connections"""
+    database_url = get_database_url()
+    if not database_url:
+        log.warning("pool.disabled", reason="no database url configured")
+        return None
+
+    min_size = _env_int("DB_POOL_MIN_SIZE", 2)
+    max_size = max(_env_int("DB_POOL_MAX_SIZE", 10), min_size)
+
+    pool = await asyncpg.create_pool(
+        database_url,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=_env_float("DB_POOL_MAX_IDLE_SECONDS", 300.0),
+        max_queries=_env_int("DB_POOL_MAX_QUERIES", 50000),
+    )
+    await warm_up_pool(pool, min_size)
+    log.info("pool.ready", min_size=min_size, max_size=max_size)
+    return pool
+
+
+async def warm_up_pool(pool: asyncpg.Pool, count: int) -> None:
+    """Check out `count` connections at once and round-trip each of them"""
+
+    async def ping() -> None:
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+
+    await asyncio.gather(*(ping() for _ in range(count)))
+
+
+async def close_pool(pool: asyncpg.Pool | None) -> None:
+    """Drain the pool, terminating connections still busy after the timeout"""
+    if pool is None:
+        return
+
+    try:
+        await asyncio.wait_for(pool.close(), timeout=_env_float("DB_POOL_CLOSE_TIMEOUT", 10.0))
+        log.info("pool.closed")
+    except asyncio.TimeoutError:
+        log.warning("pool.terminated", reason="connections did not drain in time")
+        pool.terminate()
+
+
+def get_db_pool(request: HTTPConnection) -> asyncpg.Pool:
+    pool: asyncpg.Pool | None = getattr(request.app.state, "db_pool", None)
+
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    return pool
+
+
+async def get_db_connection(
+    pool: Annotated[asyncpg.Pool, Depends(get_db_pool)],
+) -> AsyncIterator[asyncpg.Connection]:
+    """Check out a pooled connection for the duration of the request"""
+    async with pool.acquire() as conn:
+        yield conn
+
+
+DbPool = Annotated[asyncpg.Pool, Depends(get_db_pool)]
+DbConnection = Annotated[asyncpg.Connection, Depends(get_db_connection)]
+
+__all__ = [
+    "DbConnection",
+    "DbPool",
+    "close_pool",
+    "create_pool",
+    "get_database_url",
+    "get_db_connection",
+    "get_db_pool",
+]
@@ -0,0 +1,87 @@
+"""Downsampling of time series to chart-sized point counts.
+
+Both methods pick a subset of the original points, so every returned point
+is a real measurement:
+
+- `lttb`: Largest-Triangle-Three-Buckets. Splits the series into equal-count
+  buckets and keeps, per bucket, the point forming the largest triangle with
+  the previously kept point and the next bucket's average. Keeps the visual
+  shape of a line chart with one point per bucket.
+- `min_max`: the lowest and highest point of each equal-time bucket. Keeps
+  every spike, at up to two points per bucket.
+
+Inputs are NumPy arrays sorted by time (any numeric time unit); both
+functions return indices into them, in time order. Series that already fit
+are returned whole.
+
+Usage:
+
+    from app.libs.downsampling import lttb, min_max
+
+    keep = lttb(timestamps, values, 500)
+    timestamps, values = timestamps[keep], values[keep]
+"""
+
+import numpy as np
+
+MIN_LTTB_POINTS = 3
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of at most `max_points` (>= 3) points chosen by Largest-Triangle-Three-Buckets"""
+    n = len(x)
+    if max_points >= n or max_points < MIN_LTTB_POINTS:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64) - x[0]
+    y = np.asarray(y, dtype=np.float64)
+
+    # The first and last points are always kept; the rest is split into
+    # max_points - 2 buckets, none empty since n > max_points
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.intp)
+    starts, ends = edges[:-1], edges[1:]
+    sizes = ends - starts
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    # Average of the following bucket (the last point after the last bucket)
+    next_x = np.append(((cum_x[ends] - cum_x[starts]) / sizes)[1:], x[-1])
+    next_y = np.append(((cum_y[ends] - cum_y[starts]) / sizes)[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    # Each choice depends on the previous one; the work inside a bucket is vectorized
+    for i in range(max_points - 2):
+        start, end = starts[i], ends[i]
+        areas = np.abs(
+            (x[a] - next_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y[i] - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def min_max(x: np.ndarray, y: np.ndarray, buckets: int) -> np.ndarray:
+    """Indices of the lowest and highest point of each of `buckets` equal-time buckets"""
+    n = len(x)
+    if n <= 2 * buckets or buckets < 1:
+        return np.arange(n)
+
+    offsets = np.asarray(x, dtype=np.float64) - x[0]
+    span = offsets[-1]
+    bucket = np.minimum((offsets * buckets / span).astype(np.intp), buckets - 1) if span else np.zeros(n, np.intp)
+
+    # Sorting by (bucket, value) puts each bucket's minimum first and maximum
+    # last; lexsort is stable, so ties keep the earliest minimum
+    order = np.lexsort((y, bucket))
+    sorted_buckets = bucket[order]
+    firsts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    lasts = np.r_[firsts[1:] - 1, n - 1]
+    return np.unique(np.concatenate((order[firsts], order[lasts])))
+
+
+__all__ = [
+    "MIN_LTTB_POINTS",
+    "lttb",
+    "min_max",
+]
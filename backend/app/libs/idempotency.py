@@ -0,0 +1,148 @@
+"""Idempotency store for webhook deliveries.
+
+Responses are remembered per (user_id, key) for a TTL so exact retries can be
+answered without parsing or writing the delivery again. A bounded in-process
+LRU sits in front of the `ingest_idempotency` table, which makes keys visible
+to every worker process sharing the database.
+
+Usage:
+
+    from app.libs.idempotency import IdempotencyStore
+
+    store = IdempotencyStore(ttl_seconds=86400, max_entries=10000)
+    cached = await store.get(pool, user_id, ["sha256:..."])
+    if cached is None:
+        ...
+        await store.put(pool, user_id, ["sha256:...", "request:abc"], 200, response.model_dump())
+"""
+
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: Dict[str, Any]
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache: OrderedDict[tuple[str, str], tuple[float, StoredResponse]] = OrderedDict()
+
+    # In-process LRU
+
+    def _cache_get(self, user_id: str, key: str) -> Optional[StoredResponse]:
+        entry = self._cache.get((user_id, key))
+        if entry is None:
+            return None
+
+        expires_at, stored = entry
+        if expires_at < time.monotonic():
+            del self._cache[(user_id, key)]
+            return None
+
+        self._cache.move_to_end((user_id, key))
+        return stored
+
+    def _cache_put(self, user_id: str, key: str, stored: StoredResponse, ttl: float) -> None:
+        self._cache[(user_id, key)] = (time.monotonic() + ttl, stored)
+        self._cache.move_to_end((user_id, key))
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _cache_row(self, user_id: str, row: asyncpg.Record) -> StoredResponse:
+        stored = StoredResponse(row["status_code"], json.loads(row["response"]))
+        remaining = self.ttl_seconds - (time.time() - row["created_at"].timestamp())
+        self._cache_put(user_id, row["key"], stored, remaining)
+        return stored
+
+    # Shared table
+
+    async def get(self, pool: asyncpg.Pool, user_id: str, keys: List[str]) -> Optional[StoredResponse]:
+        """Return the stored response for the first known key, if any"""
+        for key in keys:
+            stored = self._cache_get(user_id, key)
+            if stored is not None:
+                return stored
+
+        row = await pool.fetchrow(
+            """
+            SELECT key, status_code, response, created_at
+            FROM ingest_idempotency
+            WHERE user_id = $1 AND key = ANY($2::text[])
+            AND created_at > now() - make_interval(secs => $3)
+            LIMIT 1
+            """,
+            user_id,
+            keys,
+            self.ttl_seconds
+        )
+        if row is None:
+            return None
+
+        return self._cache_row(user_id, row)
+
+    async def put(
+        self,
+        pool: asyncpg.Pool,
+        user_id: str,
+        keys: List[str],
+        status_code: int,
+        body: Dict[str, Any],
+    ) -> None:
+        """Remember a response under every given key (first writer wins).
+
+        Only what the table kept is cached: a key already stored by a racing
+        delivery keeps (and caches) that delivery's response.
+        """
+        rows = await pool.fetch(
+            """
+            WITH written AS (
+                INSERT INTO ingest_idempotency (user_id, key, status_code, response)
+                SELECT $1, k, $3, $4::jsonb FROM unnest($2::text[]) AS k
+                ON CONFLICT (user_id, key) DO UPDATE
+                SET status_code = EXCLUDED.status_code,
+                    response = EXCLUDED.response,
+                    created_at = now()
+                WHERE ingest_idempotency.created_at <= now() - make_interval(secs => $5)
+                RETURNING key, status_code, response, created_at
+            )
+            SELECT key, status_code, response, created_at FROM written
+            UNION ALL
+            SELECT key, status_code, response, created_at
+            FROM ingest_idempotency
+            WHERE user_id = $1 AND key = ANY($2::text[])
+            AND key NOT IN (SELECT key FROM written)
+            """,
+            user_id,
+            keys,
+            status_code,
+            json.dumps(body),
+            self.ttl_seconds
+        )
+        # Keys whose winner committed after this statement started are not
+        # returned; they are read from the table on the next get
+        for row in rows:
+            self._cache_row(user_id, row)
+
+    async def purge(self, pool: asyncpg.Pool) -> int:
+        """Delete expired keys from the table"""
+        status = await pool.execute(
+            "DELETE FROM ingest_idempotency WHERE created_at <= now() - make_interval(secs => $1)",
+            self.ttl_seconds
+        )
+        return int(status.rsplit(" ", 1)[-1])
+
+
+__all__ = [
+    "IdempotencyStore",
+    "StoredResponse",
+]
@@ -0,0 +1,110 @@
+"""Dictionary encoding of health_metrics metric names.
+
+health_metrics rows store `metric_id`, the id of their metric name in
+`metric_catalog`, instead of repeating the string. Each name has exactly one
+id, so the unique key (user_id, metric_id, timestamp) dedups a point however
+it is sent. The unit a name was first registered with is kept on its catalog
+entry as an attribute; it is not part of the identity. The catalog is small
+and append-only, so each process keeps all of it in memory: it is loaded at
+startup and extended as ingest meets new names.
+
+New names are registered on a dedicated connection and committed at once,
+never inside a delivery's transaction: an id learned from a transaction that
+later rolled back would not exist. As with the write batcher, the connection
+is not taken from the request pool, which deliveries may have exhausted.
+
+Reads look names up through `lookup`, which falls back to the table for
+names this process has not seen, e.g. ones registered by another worker.
+
+Usage:
+
+    from app.libs.metric_catalog import metric_catalog
+
+    metric_catalog.start(lambda: asyncpg.connect(database_url))
+    await metric_catalog.load(pool)
+    metric_id = await metric_catalog.id("heart_rate", "count/min")   # registers new names
+
+    metric_id = await metric_catalog.lookup(conn, "heart_rate")      # None if never stored
+    await metric_catalog.stop()
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+import asyncpg
+
+REGISTER_SQL = """
+    WITH inserted AS (
+        INSERT INTO metric_catalog (name, unit) VALUES ($1, $2)
+        ON CONFLICT (name) DO NOTHING
+        RETURNING id
+    )
+    SELECT id FROM inserted
+    UNION ALL
+    SELECT id FROM metric_catalog WHERE name = $1
+    LIMIT 1
+"""
+
+
+class MetricCatalog:
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._connect: Optional[Callable[[], Awaitable[asyncpg.Connection]]] = None
+        self._conn: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+
+    def start(self, connect: Callable[[], Awaitable[asyncpg.Connection]]) -> None:
+        """Enable registration; `connect` opens the dedicated connection (again after it broke)"""
+        self._connect = connect
+
+    async def stop(self) -> None:
+        self._connect = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def load(self, conn: Union[asyncpg.Pool, asyncpg.Connection]) -> int:
+        """Cache the whole catalog; returns the number of names"""
+        rows = await conn.fetch("SELECT id, name FROM metric_catalog")
+        self._ids = {row["name"]: row["id"] for row in rows}
+        return len(rows)
+
+    async def id(self, name: str, unit: Optional[str]) -> int:
+        """Id of a metric name, registering it (with `unit`) if it is new"""
+        metric_id = self._ids.get(name)
+        if metric_id is not None:
+            return metric_id
+
+        async with self._lock:
+            metric_id = self._ids.get(name)
+            if metric_id is not None:
+                return metric_id
+            if self._connect is None:
+                raise RuntimeError("MetricCatalog is not started")
+            if self._conn is None or self._conn.is_closed():
+                self._conn = await self._connect()
+            # None only if a concurrent registration committed after this
+            # statement's snapshot; the retry sees it
+            while metric_id is None:
+                metric_id = await self._conn.fetchval(REGISTER_SQL, name, unit or "")
+            self._ids[name] = metric_id
+            return metric_id
+
+    async def lookup(self, conn: Union[asyncpg.Pool, asyncpg.Connection], name: str) -> Optional[int]:
+        """Id of a metric name (None if it was never stored)"""
+        metric_id = self._ids.get(name)
+        if metric_id is None:
+            metric_id = await conn.fetchval("SELECT id FROM metric_catalog WHERE name = $1", name)
+            if metric_id is not None:
+                self._ids[name] = metric_id
+        return metric_id
+
+
+# Shared by ingest (registration) and the read APIs (name lookups)
+metric_catalog = MetricCatalog()
+
+
+__all__ = [
+    "MetricCatalog",
+    "metric_catalog",
+]
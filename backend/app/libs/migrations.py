@@ -0,0 +1,284 @@
+"""Versioned schema migrations and the startup schema check.
+
+Migrations are SQL files in backend/migrations named `<version>_<name>.sql`
+(e.g. 0004_read_indexes.sql), applied in version order and recorded in
+`schema_migrations` with a checksum; editing an applied file is an error,
+except for its comment lines, which the checksum leaves out.
+Each file runs in one transaction, unless its first line is
+`-- migrate: no-transaction` (needed for CREATE INDEX CONCURRENTLY): its
+statements then run one by one and must each end a line with ';'.
+
+A failed concurrent build leaves an INVALID index behind, which a rerun's
+`CREATE INDEX CONCURRENTLY IF NOT EXISTS` would skip. The runner rebuilds
+invalid indexes from their own definition when it starts and after each
+no-transaction migration, before recording it.
+
+A session advisory lock serializes runners, so several app workers can start
+at once. Startup also verifies that the indexes reads depend on exist and are
+valid, and refuses to start otherwise.
+
+Settings:
+
+- DB_MIGRATE_ON_STARTUP: apply pending migrations when the app starts (default true)
+
+Usage:
+
+    from app.libs.migrations import apply_migrations, check_required_indexes, prepare_schema
+
+    await prepare_schema(pool)          # migrate (unless disabled), then check indexes
+
+or from the backend directory:
+
+    python -m cli.migrate [--status | --check]
+"""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import asyncpg
+
+from app.libs.structured_log import get_logger
+
+log = get_logger("migrations")
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "migrations"
+MIGRATE_ON_STARTUP = os.environ.get("DB_MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+# Whole-file checksums recorded before comment lines were left out, of files
+# whose comments were edited since; accepted, then replaced by the new checksum
+# (files left unchanged are recognized by their whole-file checksum)
+_COMMENT_EDITED_CHECKSUMS = {
+    3: "aaf5bdc405675dd931c619e29d7c4b0f52f7832ec6b10e4dac7bee56cc41ab8b",
+}
+
+# pg_advisory_lock key of the migration runner
+MIGRATION_LOCK_ID = 7_310_228_001
+
+# Indexes the read paths rely on, by table
+REQUIRED_INDEXES = {
+    "health_metrics_user_metric_ts_idx": "health_metrics",
+    "sleep_metrics_user_start_idx": "sleep_metrics",
+    "health_metrics_timestamp_brin": "health_metrics",
+    "sleep_metrics_start_time_brin": "sleep_metrics",
+    "metric_rollups_pkey": "metric_rollups",
+}
+
+_FILE_NAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+_CREATE_INDEX = re.compile(r"^CREATE (UNIQUE )?INDEX ")
+
+
+class SchemaError(RuntimeError):
+    """The database schema is not what this code requires"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+    @property
+    def checksum(self) -> str:
+        """sha256 of the file without its comment lines (the no-transaction marker is kept)"""
+        lines = [
+            line for line in self.sql.splitlines()
+            if not line.lstrip().startswith("--") or line.lstrip().startswith(NO_TRANSACTION_MARKER)
+        ]
+        return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+    @property
+    def file_checksum(self) -> str:
+        """sha256 of the whole file, as recorded before comment lines were left out"""
+        return hashlib.sha256(self.sql.encode()).hexdigest()
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self) -> List[str]:
+        """Statements of the file, split at lines ending with ';'"""
+        statements, current = [], []
+        for line in self.sql.splitlines():
+            if not current and (not line.strip() or line.lstrip().startswith("--")):
+                continue
+            current.append(line)
+            if line.rstrip().endswith(";"):
+                statements.append("\n".join(current))
+                current = []
+        if current:
+            statements.append("\n".join(current))
+        return statements
+
+
+@dataclass
+class MigrationStatus:
+    version: int
+    name: str
+    applied_at: Optional[datetime]
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for path in sorted(directory.glob("*.sql")):
+        match = _FILE_NAME.match(path.name)
+        if match is None:
+            raise SchemaError(f"Migration file name must be <version>_<name>.sql: {path.name}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path.read_text()))
+
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise SchemaError(f"Duplicate migration versions in {directory}")
+    return sorted(migrations, key=lambda m: m.version)
+
+
+async def _ensure_migrations_table(conn: asyncpg.Connection) -> None:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version int PRIMARY KEY,
+            name text NOT NULL,
+            checksum text NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+async def apply_migrations(pool: asyncpg.Pool, directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Apply pending migrations in order; returns the ones applied"""
+    migrations = load_migrations(directory)
+    applied_now = []
+
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            await _ensure_migrations_table(conn)
+            await rebuild_invalid_indexes(conn)
+            applied = {
+                row["version"]: row["checksum"]
+                for row in await conn.fetch("SELECT version, checksum FROM schema_migrations")
+            }
+
+            for migration in migrations:
+                if migration.version in applied:
+                    recorded = applied[migration.version]
+                    if recorded != migration.checksum:
+                        if recorded not in (migration.file_checksum, _COMMENT_EDITED_CHECKSUMS.get(migration.version)):
+                            raise SchemaError(
+                                f"Migration {migration.version:04d}_{migration.name} was changed after it was applied"
+                            )
+                        await conn.execute(
+                            "UPDATE schema_migrations SET checksum = $2 WHERE version = $1",
+                            migration.version, migration.checksum
+                        )
+                    continue
+
+                log.info("migration.applying", version=migration.version, migration=migration.name)
+                if migration.transactional:
+                    async with conn.transaction():
+                        await conn.execute(migration.sql)
+                        await _record(conn, migration)
+                else:
+                    for statement in migration.statements():
+                        await conn.execute(statement)
+                    await rebuild_invalid_indexes(conn)
+                    await _record(conn, migration)
+                applied_now.append(migration)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+    if applied_now:
+        log.info("migration.done", applied=[m.version for m in applied_now])
+    return applied_now
+
+
+async def rebuild_invalid_indexes(conn: asyncpg.Connection) -> List[str]:
+    """Drop and rebuild (concurrently) the invalid indexes of this schema's tables; returns their names"""
+    rows = await conn.fetch(
+        """
+        SELECT i.relname AS name, pg_get_indexdef(i.oid) AS definition
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE NOT x.indisvalid
+        AND i.relkind = 'i' AND t.relkind IN ('r', 'm')
+        AND i.relnamespace = current_schema()::regnamespace
+        AND NOT EXISTS (SELECT 1 FROM pg_inherits h WHERE h.inhrelid = i.oid)
+        """
+    )
+    for row in rows:
+        log.warning("migration.rebuilding_invalid_index", index=row["name"])
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{row["name"]}"')
+        await conn.execute(_CREATE_INDEX.sub(r"CREATE \1INDEX CONCURRENTLY ", row["definition"]))
+    return [row["name"] for row in rows]
+
+
+async def _record(conn: asyncpg.Connection, migration: Migration) -> None:
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+        migration.version, migration.name, migration.checksum
+    )
+
+
+async def migration_status(pool: asyncpg.Pool, directory: Path = MIGRATIONS_DIR) -> List[MigrationStatus]:
+    """Every known migration with the time it was applied (None: pending)"""
+    async with pool.acquire() as conn:
+        await _ensure_migrations_table(conn)
+        applied = {
+            row["version"]: row["applied_at"]
+            for row in await conn.fetch("SELECT version, applied_at FROM schema_migrations")
+        }
+    return [MigrationStatus(m.version, m.name, applied.get(m.version)) for m in load_migrations(directory)]
+
+
+async def check_required_indexes(pool: asyncpg.Pool) -> None:
+    """Raise SchemaError if a required index is missing or invalid (e.g. a failed concurrent build)"""
+    rows = await pool.fetch(
+        """
+        SELECT i.relname AS index_name, t.relname AS table_name, x.indisvalid AS valid
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE i.relname = ANY($1::text[]) AND pg_table_is_visible(i.oid)
+        """,
+        list(REQUIRED_INDEXES)
+    )
+    found = {row["index_name"]: row for row in rows}
+
+    problems = []
+    for index_name, table_name in REQUIRED_INDEXES.items():
+        row = found.get(index_name)
+        if row is None or row["table_name"] != table_name:
+            problems.append(f"{index_name} on {table_name} is missing")
+        elif not row["valid"]:
+            problems.append(f"{index_name} on {table_name} is invalid (migrating again rebuilds it)")
+    if problems:
+        raise SchemaError("Required indexes: " + "; ".join(problems))
+
+
+async def prepare_schema(pool: asyncpg.Pool) -> None:
+    """Startup hook: apply pending migrations (unless disabled) and check required indexes"""
+    if MIGRATE_ON_STARTUP:
+        await apply_migrations(pool)
+    await check_required_indexes(pool)
+
+
+__all__ = [
+    "Migration",
+    "MigrationStatus",
+    "REQUIRED_INDEXES",
+    "SchemaError",
+    "apply_migrations",
+    "check_required_indexes",
+    "load_migrations",
+    "migration_status",
+    "prepare_schema",
+    "rebuild_invalid_indexes",
+]
@@ -0,0 +1,308 @@
+"""Monthly range partitions of health_metrics.
+
+health_metrics is partitioned by UTC month of `timestamp` into
+health_metrics_YYYY_MM tables (migration 0005), so range queries only touch
+the months they cover and old months can be detached without rewriting or
+deleting rows. Rows of months without a partition (e.g. a historical
+backfill) land in health_metrics_default; creating a month's partition moves
+its rows out of the default partition (`ensure_partition`).
+
+Creating a partition takes several short transactions: a NOT VALID check on
+the default partition first keeps new rows of the month out of it, the rows
+are copied into the new table a day at a time, and the last transaction
+deletes them from the default partition, validates the check and attaches
+the table. The checks let ATTACH skip both of its validation scans, so the
+default partition is locked exclusively only for the catalog update, and
+reads see every row throughout. Writes of that month fail with a check
+violation until the partition is attached; writers recognize it
+(`is_creating_partition`), wait for the creator to finish
+(`wait_for_partition_creation`) and write again.
+
+Partitions for the coming months are created ahead of time, so live ingest
+never waits on partition creation. History left in the default partition by
+large imports is split off by `split_default_partition` rather than on the
+write path.
+
+Settings:
+
+- DB_PARTITION_MONTHS_AHEAD: months after the current one kept created (default 3)
+
+Usage:
+
+    from app.libs.partitions import detach_partitions, ensure_partitions, split_default_partition
+    from app.libs.partitions import is_creating_partition, wait_for_partition_creation
+
+    created = await ensure_partitions(pool)             # current month + months ahead
+    moved = await split_default_partition(pool)         # history left in the default partition
+    detached = await detach_partitions(pool, before=datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+    try:
+        await insert_rows(conn)
+    except asyncpg.CheckViolationError as e:
+        if not is_creating_partition(e):
+            raise
+        await wait_for_partition_creation(conn)
+        await insert_rows(conn)
+
+or from the backend directory:
+
+    python -m cli.partitions [--list | --detach-before 2024-01 [--archive-schema archive]]
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Union
+
+import asyncpg
+
+MONTHS_AHEAD = int(os.environ.get("DB_PARTITION_MONTHS_AHEAD", "3"))
+
+DEFAULT_PARTITION = "health_metrics_default"
+
+# ATTACH and DETACH need a brief exclusive lock; give up instead of queueing
+# every read and write behind a long-running query
+LOCK_TIMEOUT = "5s"
+
+# pg_advisory_lock key serializing partition creators
+PARTITION_LOCK_ID = 7_310_228_002
+
+# Rows copied into a new partition per transaction, as a time window
+COPY_WINDOW = timedelta(days=1)
+
+_PARTITION_NAME = re.compile(r"^health_metrics_(\d{4})_(\d{2})$")
+
+
+@dataclass
+class Partition:
+    name: str
+    start: Optional[datetime]
+    end: Optional[datetime]
+    rows: int
+    bytes: int
+
+    @property
+    def is_default(self) -> bool:
+        return self.start is None
+
+
+def month_start(value: datetime, months: int = 0) -> datetime:
+    """First instant (UTC) of the month containing `value`, shifted by `months`"""
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+async def list_partitions(pool: asyncpg.Pool) -> List[Partition]:
+    """Attached partitions in month order, the default partition last; rows are planner estimates"""
+    rows = await pool.fetch(
+        """
+        SELECT c.relname AS name, greatest(c.reltuples, 0)::bigint AS rows,
+               pg_total_relation_size(c.oid) AS bytes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'health_metrics'::regclass
+        """
+    )
+    partitions = []
+    for row in rows:
+        match = _PARTITION_NAME.match(row["name"])
+        start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc) if match else None
+        end = month_start(start, 1) if start else None
+        partitions.append(Partition(row["name"], start, end, row["rows"], row["bytes"]))
+    return sorted(partitions, key=lambda p: (p.is_default, p.start or datetime.max.replace(tzinfo=timezone.utc)))
+
+
+async def ensure_partition(pool: asyncpg.Pool, month: datetime) -> str:
+    """Create (if needed) the partition of the month containing `month`; returns its name"""
+    lower, upper = month_start(month), month_start(month, 1)
+    name = f"health_metrics_{lower:%Y_%m}"
+    if await _partition_exists(pool, name):
+        return name
+
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", PARTITION_LOCK_ID)
+        try:
+            if not await _partition_exists(conn, name):
+                await _create_partition(conn, name, lower, upper)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", PARTITION_LOCK_ID)
+    return name
+
+
+async def _partition_exists(conn: Union[asyncpg.Pool, asyncpg.Connection], name: str) -> bool:
+    """Whether `name` exists, other than as a table left half-built by an interrupted run"""
+    return await conn.fetchval(
+        """
+        SELECT to_regclass($1) IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass($1) AND conname = $2
+        )
+        """,
+        name, f"{name}_bounds"
+    )
+
+
+async def _create_partition(conn: asyncpg.Connection, name: str, lower: datetime, upper: datetime) -> None:
+    """Build `name` beside the default partition, then swap its rows over (see the module docstring)"""
+    exclusion = f"{DEFAULT_PARTITION}_not_{lower:%Y_%m}"
+    in_range = f"timestamp >= '{lower.isoformat()}' AND timestamp < '{upper.isoformat()}'"
+    columns = await conn.fetchval(
+        """
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+        FROM pg_attribute
+        WHERE attrelid = 'health_metrics'::regclass AND attnum > 0 AND NOT attisdropped
+        """
+    )
+
+    try:
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            # A table left by an interrupted run holds a partial copy
+            await conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            # The bounds check lets ATTACH skip scanning the new table (and
+            # marks it unfinished until then); the parent's indexes are
+            # created now, so ATTACH adopts them
+            await conn.execute(
+                f"""
+                CREATE TABLE "{name}" (
+                    LIKE health_metrics INCLUDING DEFAULTS INCLUDING INDEXES,
+                    CONSTRAINT "{name}_bounds" CHECK ({in_range})
+                )
+                """
+            )
+            # Rejects new rows of the month without scanning existing ones
+            await conn.execute(
+                f"""
+                ALTER TABLE {DEFAULT_PARTITION}
+                    DROP CONSTRAINT IF EXISTS "{exclusion}",
+                    ADD CONSTRAINT "{exclusion}" CHECK (NOT ({in_range})) NOT VALID
+                """
+            )
+
+        window = lower
+        while window < upper:
+            await conn.execute(
+                f"""
+                INSERT INTO "{name}" ({columns})
+                SELECT {columns} FROM {DEFAULT_PARTITION} WHERE timestamp >= $1 AND timestamp < $2
+                """,
+                window, min(window + COPY_WINDOW, upper)
+            )
+            window += COPY_WINDOW
+
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            await conn.execute(
+                f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= $1 AND timestamp < $2", lower, upper
+            )
+            # Scans the default partition under a lock that lets reads and
+            # writes through; ATTACH then relies on the check instead
+            await conn.execute(f'ALTER TABLE {DEFAULT_PARTITION} VALIDATE CONSTRAINT "{exclusion}"')
+            await conn.execute(
+                f"""
+                ALTER TABLE health_metrics ATTACH PARTITION "{name}"
+                FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')
+                """
+            )
+            await conn.execute(f'ALTER TABLE "{name}" DROP CONSTRAINT "{name}_bounds"')
+            await conn.execute(f'ALTER TABLE {DEFAULT_PARTITION} DROP CONSTRAINT "{exclusion}"')
+    except BaseException:
+        # Lets the month's rows into the default partition again; the next
+        # attempt starts over
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            await conn.execute(f'ALTER TABLE {DEFAULT_PARTITION} DROP CONSTRAINT IF EXISTS "{exclusion}"')
+            await conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+        raise
+
+
+def is_creating_partition(error: BaseException) -> bool:
+    """Whether `error` rejected rows of a month whose partition is being created"""
+    return (
+        isinstance(error, asyncpg.CheckViolationError)
+        and (error.constraint_name or "").startswith(f"{DEFAULT_PARTITION}_not_")
+    )
+
+
+async def wait_for_partition_creation(conn: asyncpg.Connection) -> None:
+    """Wait until no partition is being created; returns at once if none is.
+
+    Call it after rolling back the savepoint of the rejected write, which
+    releases the locks that write took on the default partition (ATTACH
+    waits for them).
+    """
+    await conn.execute("SELECT pg_advisory_lock_shared($1)", PARTITION_LOCK_ID)
+    await conn.execute("SELECT pg_advisory_unlock_shared($1)", PARTITION_LOCK_ID)
+
+
+async def ensure_partitions(pool: asyncpg.Pool, months_ahead: int = MONTHS_AHEAD) -> List[str]:
+    """Create the partitions of the current month and `months_ahead` months after it; returns the new ones"""
+    existing = {p.name for p in await list_partitions(pool)}
+    now = datetime.now(timezone.utc)
+    created = []
+    for ahead in range(months_ahead + 1):
+        name = await ensure_partition(pool, month_start(now, ahead))
+        if name not in existing:
+            created.append(name)
+    return created
+
+
+async def split_default_partition(pool: asyncpg.Pool) -> List[str]:
+    """Move every month found in the default partition into its own partition; returns their names"""
+    months = await pool.fetch(
+        f"""
+        SELECT DISTINCT date_trunc('month', timestamp, 'UTC') AS month
+        FROM {DEFAULT_PARTITION}
+        ORDER BY 1
+        """
+    )
+    # One month at a time, each with its own short exclusive lock
+    moved = [await ensure_partition(pool, row["month"]) for row in months]
+    if moved:
+        await pool.execute(f"ANALYZE {DEFAULT_PARTITION}")
+    return moved
+
+
+async def detach_partitions(
+    pool: asyncpg.Pool,
+    before: datetime,
+    archive_schema: Optional[str] = None,
+    drop: bool = False,
+) -> List[str]:
+    """Detach the monthly partitions ending on or before `before`; returns their names.
+
+    Detached tables keep their rows (moved to `archive_schema` if given, or
+    dropped with `drop`). Rollups of those months are kept, so long-range
+    statistics still include them.
+    """
+    detached = []
+    for partition in await list_partitions(pool):
+        if partition.is_default or partition.end > before:
+            continue
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                await conn.execute(f'ALTER TABLE health_metrics DETACH PARTITION "{partition.name}"')
+                if drop:
+                    await conn.execute(f'DROP TABLE "{partition.name}"')
+                elif archive_schema:
+                    await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"')
+                    await conn.execute(f'ALTER TABLE "{partition.name}" SET SCHEMA "{archive_schema}"')
+        detached.append(partition.name)
+    return detached
+
+
+__all__ = [
+    "DEFAULT_PARTITION",
+    "MONTHS_AHEAD",
+    "Partition",
+    "detach_partitions",
+    "ensure_partition",
+    "ensure_partitions",
+    "is_creating_partition",
+    "list_partitions",
+    "month_start",
+    "split_default_partition",
+    "wait_for_partition_creation",
+]
@@ -0,0 +1,223 @@
+"""Hourly and daily rollups of health_metrics and sleep_metrics.
+
+`metric_rollups` keeps count, sum, min, max and sum of squares per user,
+metric and UTC hour/day bucket. Ingest statements add exactly the rows they
+inserted (duplicates skipped by ON CONFLICT contribute nothing) through a
+data-modifying CTE, so raw rows and rollups commit together. Sleep sessions
+are rolled up by start time as two metrics: SLEEP_HOURS (total sleep) and
+SLEEP_EFFICIENCY.
+
+Range statistics combine whole days, then whole hours, then the raw rows at
+the partial-hour edges, so a long range costs O(buckets) instead of
+O(points) while returning the same numbers as aggregating raw rows.
+
+Rollups of data written before they existed are built by migration 0007;
+after raw rows were changed outside ingest, rebuild them with
+`python -m cli.rebuild_rollups`.
+
+Usage:
+
+    from app.libs.rollups import range_stats, rollup_upsert
+
+    # inside a statement whose CTE `inserted` returns (user_id, metric_name, timestamp, value)
+    sql = f"WITH inserted AS (...), rolled_up AS ({rollup_upsert('inserted')}) SELECT count(*) FROM inserted"
+
+    stats = await range_stats(conn, user_id, "heart_rate_variability", start, end)
+    stats.count, stats.avg, stats.min, stats.max, stats.stddev
+"""
+
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import asyncpg
+
+SLEEP_HOURS = "sleep_hours"
+SLEEP_EFFICIENCY = "sleep_efficiency"
+
+# Bounds used for open-ended ranges
+RANGE_MIN = datetime(1, 1, 2, tzinfo=timezone.utc)
+RANGE_MAX = datetime(9999, 12, 30, tzinfo=timezone.utc)
+
+# Raw rows of each rolled-up metric as (user_id, metric_name, timestamp, value)
+_RAW_SOURCES = {
+    SLEEP_HOURS: """
+        SELECT user_id, 'sleep_hours' AS metric_name, start_time AS timestamp,
+               duration_total_minutes / 60.0::double precision AS value
+        FROM sleep_metrics
+    """,
+    SLEEP_EFFICIENCY: """
+        SELECT user_id, 'sleep_efficiency' AS metric_name, start_time AS timestamp, efficiency AS value
+        FROM sleep_metrics
+    """,
+}
+_HEALTH_METRICS_SOURCE = """
+    SELECT h.user_id, c.name AS metric_name, h.timestamp, h.value
+    FROM health_metrics h
+    JOIN metric_catalog c ON c.id = h.metric_id
+"""
+
+
+def rollup_upsert(inserted: str) -> str:
+    """INSERT adding the rows of relation `inserted` (user_id, metric_name, timestamp, value) to the rollups.
+
+    Meant as a data-modifying CTE next to the raw INSERT ... RETURNING. Rows
+    are upserted in key order so concurrent deliveries cannot deadlock.
+    """
+    return f"""
+        INSERT INTO metric_rollups AS r (user_id, metric_name, resolution, bucket, count, sum, min, max, sumsq)
+        SELECT i.user_id, i.metric_name, res.resolution, date_trunc(res.resolution, i.timestamp, 'UTC'),
+               count(*), sum(i.value), min(i.value), max(i.value), sum(i.value * i.value)
+        FROM {inserted} i
+        CROSS JOIN (VALUES ('hour'), ('day')) AS res(resolution)
+        WHERE i.value IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, metric_name, resolution, bucket) DO UPDATE
+        SET count = r.count + EXCLUDED.count,
+            sum = r.sum + EXCLUDED.sum,
+            min = least(r.min, EXCLUDED.min),
+            max = greatest(r.max, EXCLUDED.max),
+            sumsq = r.sumsq + EXCLUDED.sumsq
+    """
+
+
+@dataclass
+class RangeStats:
+    count: int
+    sum: float
+    min: Optional[float]
+    max: Optional[float]
+    sumsq: float
+
+    @property
+    def avg(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    @property
+    def stddev(self) -> Optional[float]:
+        """Population standard deviation"""
+        if not self.count:
+            return None
+        mean = self.sum / self.count
+        return math.sqrt(max(self.sumsq / self.count - mean * mean, 0.0))
+
+
+def _utc(value: datetime) -> datetime:
+    # Naive datetimes are UTC, as asyncpg sends them for timestamptz
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _floor(value: datetime, unit: timedelta) -> datetime:
+    if unit == timedelta(days=1):
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil(value: datetime, unit: timedelta) -> datetime:
+    floor = _floor(value, unit)
+    return floor if floor == value else floor + unit
+
+
+def range_stats_query(
+    user_id: str,
+    metric_name: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    first_param: int = 1,
+) -> Tuple[str, list]:
+    """SELECT of one (count, sum, min, max, sumsq) row for range_stats, and its arguments.
+
+    Placeholders are numbered from `first_param`, so the query can be
+    embedded in a larger statement (e.g. as a scalar subquery).
+    """
+    start = RANGE_MIN if start is None else _utc(start)
+    end = RANGE_MAX if end is None else _utc(end)
+
+    # [start, first_hour) and [last_hour, end] come from raw rows, whole hours
+    # in between from hourly buckets except for whole days [first_day, last_day)
+    first_hour, last_hour = _ceil(start, timedelta(hours=1)), _floor(end, timedelta(hours=1))
+    if first_hour >= last_hour:
+        first_hour = last_hour = start
+    first_day, last_day = _ceil(first_hour, timedelta(days=1)), _floor(last_hour, timedelta(days=1))
+    if first_day >= last_day:
+        first_day = last_day = last_hour
+
+    p = [f"${first_param + i}" for i in range(8)]
+    sql = f"""
+        SELECT coalesce(sum(count), 0) AS count, coalesce(sum(sum), 0) AS sum,
+               min(min) AS min, max(max) AS max, coalesce(sum(sumsq), 0) AS sumsq
+        FROM (
+            SELECT count, sum, min, max, sumsq
+            FROM metric_rollups
+            WHERE user_id = {p[0]} AND metric_name = {p[1]} AND resolution = 'day'
+            AND bucket >= {p[4]} AND bucket < {p[5]}
+            UNION ALL
+            SELECT count, sum, min, max, sumsq
+            FROM metric_rollups
+            WHERE user_id = {p[0]} AND metric_name = {p[1]} AND resolution = 'hour'
+            AND ((bucket >= {p[3]} AND bucket < {p[4]}) OR (bucket >= {p[5]} AND bucket < {p[6]}))
+            UNION ALL
+            SELECT count(value), sum(value), min(value), max(value), sum(value * value)
+            FROM ({_RAW_SOURCES.get(metric_name, _HEALTH_METRICS_SOURCE)}) raw
+            WHERE user_id = {p[0]} AND metric_name = {p[1]}
+            AND ((timestamp >= {p[2]} AND timestamp < {p[3]}) OR (timestamp >= {p[6]} AND timestamp <= {p[7]}))
+        ) parts
+    """
+    return sql, [user_id, metric_name, start, first_hour, first_day, last_day, last_hour, end]
+
+
+async def range_stats(
+    conn: asyncpg.Connection,
+    user_id: str,
+    metric_name: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> RangeStats:
+    """Statistics of a metric's points with start <= timestamp <= end (None: unbounded)"""
+    sql, args = range_stats_query(user_id, metric_name, start, end)
+    row = await conn.fetchrow(sql, *args)
+    return RangeStats(
+        count=int(row["count"]),
+        sum=float(row["sum"]),
+        min=row["min"],
+        max=row["max"],
+        sumsq=float(row["sumsq"])
+    )
+
+
+async def rebuild_rollups(conn: asyncpg.Connection, user_id: str) -> int:
+    """Recompute a user's rollups from raw rows; returns the number of rollup rows.
+
+    Ingest writes of rollups wait while this runs (table lock), so deliveries
+    committed before are counted once and later ones are added afterwards.
+    """
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE metric_rollups IN SHARE ROW EXCLUSIVE MODE")
+        await conn.execute("DELETE FROM metric_rollups WHERE user_id = $1", user_id)
+        status = await conn.execute(
+            f"""
+            WITH points AS (
+                {_HEALTH_METRICS_SOURCE} WHERE user_id = $1
+                UNION ALL
+                {_RAW_SOURCES[SLEEP_HOURS]} WHERE user_id = $1
+                UNION ALL
+                {_RAW_SOURCES[SLEEP_EFFICIENCY]} WHERE user_id = $1
+            )
+            {rollup_upsert("points")}
+            """,
+            user_id
+        )
+    return int(status.rsplit(" ", 1)[-1])
+
+
+__all__ = [
+    "RangeStats",
+    "SLEEP_EFFICIENCY",
+    "SLEEP_HOURS",
+    "range_stats",
+    "range_stats_query",
+    "rebuild_rollups",
+    "rollup_upsert",
+]
@@ -0,0 +1,317 @@
+"""Durable on-disk spool for asynchronous ingest.
+
+Request bodies are appended to an append-only segment log and drained into the
+database by background workers. Keys (user ids) are hashed onto a fixed set of
+partitions with one sequential worker each, so records for the same key are
+always handled in the order they were appended. The read position of every
+partition is persisted in a cursor file, so unconsumed records survive a restart
+and are handled at least once.
+
+Usage:
+
+    from app.libs.spool import Spool, SpoolRecordRejected
+
+    spool = Spool(Path("spool/hae"), partitions=4)
+    spool.start(handle_record)  # async def handle_record(key, body, enqueued_at)
+    await spool.append(user_id, raw_body)
+    ...
+    await spool.stop()
+
+Handlers raise `SpoolRecordRejected` for records that can never succeed (they
+are moved to the partition's dead letter log); any other exception is retried
+with backoff without skipping ahead, which preserves per-key ordering.
+"""
+
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+from app.libs.structured_log import get_logger
+
+log = get_logger("spool")
+
+# body length, crc32 of key + body, enqueued_at (unix time), key length
+RECORD_HEADER = struct.Struct(">IIdH")
+
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor.json"
+DEAD_LETTER_FILE = "dead.log"
+
+SpoolHandler = Callable[[str, bytes, float], Awaitable[None]]
+
+
+class SpoolRecordRejected(Exception):
+    """Raised by a handler for a record that must not be retried"""
+
+
+@dataclass
+class SpoolRecord:
+    key: str
+    body: bytes
+    enqueued_at: float
+    segment: int
+    next_offset: int
+
+
+@dataclass
+class PartitionStats:
+    partition: int
+    depth: int
+    lag_seconds: float
+    segments: int
+
+
+def _encode_record(key: str, body: bytes, enqueued_at: float) -> bytes:
+    key_bytes = key.encode("utf-8")
+    crc = zlib.crc32(body, zlib.crc32(key_bytes))
+    return RECORD_HEADER.pack(len(body), crc, enqueued_at, len(key_bytes)) + key_bytes + body
+
+
+def _read_record(f, segment: int) -> SpoolRecord | None:
+    """Read the record at the current file position, None on a torn or missing tail"""
+    header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+
+    body_length, crc, enqueued_at, key_length = RECORD_HEADER.unpack(header)
+    key_bytes = f.read(key_length)
+    body = f.read(body_length)
+    if len(key_bytes) < key_length or len(body) < body_length:
+        return None
+    if zlib.crc32(body, zlib.crc32(key_bytes)) != crc:
+        return None
+
+    return SpoolRecord(key_bytes.decode("utf-8"), body, enqueued_at, segment, f.tell())
+
+
+class SpoolPartition:
+    """One ordered segment log with its own persisted read cursor"""
+
+    def __init__(self, index: int, path: Path, segment_bytes: int, fsync: bool):
+        self.index = index
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.wakeup = asyncio.Event()
+
+        # enqueued_at of every unconsumed record, oldest first
+        self.pending: deque[float] = deque()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.cursor_segment, self.cursor_offset = self._load_cursor()
+        self._recover()
+
+    # Segment files
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"{segment:020d}{SEGMENT_SUFFIX}"
+
+    def _segments(self) -> List[int]:
+        return sorted(int(p.stem) for p in self.path.glob(f"*{SEGMENT_SUFFIX}") if p.stem.isdigit())
+
+    def _load_cursor(self) -> tuple[int, int]:
+        try:
+            cursor = json.loads((self.path / CURSOR_FILE).read_text())
+            return int(cursor["segment"]), int(cursor["offset"])
+        except FileNotFoundError:
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _store_cursor(self) -> None:
+        """Atomically replace the cursor file"""
+        tmp_path = self.path / f"{CURSOR_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": self.cursor_segment, "offset": self.cursor_offset}, f)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path / CURSOR_FILE)
+
+    def _recover(self) -> None:
+        """Count unconsumed records and cut off a torn tail left by a crash"""
+        for segment in self._segments():
+            if segment < self.cursor_segment:
+                self._segment_path(segment).unlink()
+
+        segments = self._segments()
+        if not segments:
+            segments = [self.cursor_segment]
+            self._segment_path(self.cursor_segment).touch()
+
+        for segment in segments:
+            with open(self._segment_path(segment), "r+b") as f:
+                valid_end = self.cursor_offset if segment == self.cursor_segment else 0
+                f.seek(valid_end)
+                while (record := _read_record(f, segment)) is not None:
+                    self.pending.append(record.enqueued_at)
+                    valid_end = record.next_offset
+
+                if valid_end < os.fstat(f.fileno()).st_size:
+                    log.warning("spool.torn_record", partition=self.index, segment=str(segment), offset=valid_end)
+                    f.truncate(valid_end)
+
+        self.active_segment = segments[-1]
+        self.active_size = self._segment_path(self.active_segment).stat().st_size
+
+    # Writer side
+
+    def append(self, key: str, body: bytes) -> None:
+        """Append one record, rotating to a new segment when the active one is full"""
+        enqueued_at = time.time()
+        data = _encode_record(key, body, enqueued_at)
+
+        with self.lock:
+            if self.active_size and self.active_size + len(data) > self.segment_bytes:
+                self.active_segment += 1
+                self.active_size = 0
+
+            with open(self._segment_path(self.active_segment), "ab") as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+            self.active_size += len(data)
+            self.pending.append(enqueued_at)
+
+    # Reader side
+
+    def read_next(self) -> SpoolRecord | None:
+        """Read the record at the cursor, moving past fully consumed segments"""
+        with self.lock:
+            while True:
+                with open(self._segment_path(self.cursor_segment), "rb") as f:
+                    f.seek(self.cursor_offset)
+                    record = _read_record(f, self.cursor_segment)
+                if record is not None or self.cursor_segment >= self.active_segment:
+                    return record
+
+                # Segment exhausted and a newer one exists: advance and delete it
+                consumed = self.cursor_segment
+                self.cursor_segment += 1
+                self.cursor_offset = 0
+                self._store_cursor()
+                self._segment_path(consumed).unlink(missing_ok=True)
+
+    def ack(self, record: SpoolRecord) -> None:
+        """Persist the cursor past a handled record"""
+        with self.lock:
+            self.cursor_segment = record.segment
+            self.cursor_offset = record.next_offset
+            self._store_cursor()
+            self.pending.popleft()
+
+    def dead_letter(self, record: SpoolRecord) -> None:
+        """Keep a rejected record aside for inspection, then move past it"""
+        with open(self.path / DEAD_LETTER_FILE, "ab") as f:
+            f.write(_encode_record(record.key, record.body, record.enqueued_at))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.ack(record)
+
+    def stats(self) -> PartitionStats:
+        oldest = self.pending[0] if self.pending else None
+        return PartitionStats(
+            partition=self.index,
+            depth=len(self.pending),
+            lag_seconds=max(time.time() - oldest, 0.0) if oldest else 0.0,
+            segments=self.active_segment - self.cursor_segment + 1,
+        )
+
+
+class Spool:
+    """Partitioned spool with one background drain worker per partition"""
+
+    def __init__(
+        self,
+        path: Path,
+        partitions: int = 4,
+        segment_bytes: int = 64 * 1024 * 1024,
+        fsync: bool = True,
+        max_retry_delay: float = 30.0,
+    ):
+        self.path = path
+        self.max_retry_delay = max_retry_delay
+        self.partitions = [
+            SpoolPartition(i, path / f"p{i}", segment_bytes, fsync)
+            for i in range(partitions)
+        ]
+        self._workers: List[asyncio.Task] = []
+
+    def partition_for(self, key: str) -> SpoolPartition:
+        return self.partitions[zlib.crc32(key.encode("utf-8")) % len(self.partitions)]
+
+    async def append(self, key: str, body: bytes) -> None:
+        partition = self.partition_for(key)
+        await asyncio.to_thread(partition.append, key, body)
+        partition.wakeup.set()
+
+    def start(self, handler: SpoolHandler) -> None:
+        self._workers = [
+            asyncio.create_task(self._drain(partition, handler), name=f"spool-p{partition.index}")
+            for partition in self.partitions
+        ]
+
+    async def stop(self) -> None:
+        """Stop the workers; a record being handled is redelivered after restart"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> List[PartitionStats]:
+        return [partition.stats() for partition in self.partitions]
+
+    async def _next_record(self, partition: SpoolPartition) -> SpoolRecord:
+        while True:
+            record = await asyncio.to_thread(partition.read_next)
+            if record is not None:
+                return record
+
+            # Clear before re-checking so an append in between is not missed
+            partition.wakeup.clear()
+            record = await asyncio.to_thread(partition.read_next)
+            if record is not None:
+                return record
+            await partition.wakeup.wait()
+
+    async def _drain(self, partition: SpoolPartition, handler: SpoolHandler) -> None:
+        while True:
+            record = await self._next_record(partition)
+
+            attempt = 0
+            while True:
+                try:
+                    await handler(record.key, record.body, record.enqueued_at)
+                    await asyncio.to_thread(partition.ack, record)
+                    break
+                except SpoolRecordRejected as e:
+                    log.error("spool.rejected", partition=partition.index, key=record.key, error=str(e))
+                    await asyncio.to_thread(partition.dead_letter, record)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    attempt += 1
+                    delay = min(2 ** attempt, self.max_retry_delay)
+                    log.warning("spool.retry", partition=partition.index, error=str(e), delay_seconds=round(delay))
+                    await asyncio.sleep(delay)
+
+
+__all__ = [
+    "PartitionStats",
+    "Spool",
+    "SpoolHandler",
+    "SpoolRecord",
+    "SpoolRecordRejected",
+]
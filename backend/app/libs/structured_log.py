@@ -0,0 +1,282 @@
+"""Structured, sampled logging that never blocks the event loop on stdout.
+
+Records are put on a bounded in-memory queue and written as one JSON (or
+key=value text) line each by a background thread. A full queue drops records
+and counts them instead of blocking the caller.
+
+- Per-route sampling: LOG_SAMPLE_RATES="/routes/hae=0.1,/routes/metrics=0.01"
+  keeps that fraction of requests under each path prefix (longest prefix wins).
+  The decision is made once per request, so a kept request logs every info
+  line. Warnings and errors are always written.
+- Debug per user: LOG_DEBUG_USERS="u1,u2" (or "*") enables debug records,
+  and the expensive payload dumps guarded by `debug_enabled()`, for those
+  user ids only.
+- Size-capped excerpts: `excerpt()` truncates bodies to LOG_EXCERPT_BYTES.
+
+Usage:
+
+    from app.libs.structured_log import bind_user, excerpt, get_logger
+
+    log = get_logger("ingest")
+
+    bind_user(user_id)                    # attach the user id to later records
+    log.info("webhook.received", bytes=len(raw_body))
+    if log.debug_enabled():
+        log.debug("webhook.body", body=excerpt(raw_body))
+    log.error("webhook.failed", error=str(e), exc_info=True)
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+def _parse_level(value: str) -> str:
+    """A known level name; anything else falls back to INFO"""
+    if value in logging.getLevelNamesMapping():
+        return value
+    print(f"Unknown LOG_LEVEL {value!r}, using INFO", file=sys.stderr)
+    return "INFO"
+
+
+LOG_LEVEL = _parse_level(os.environ.get("LOG_LEVEL", "INFO").upper())
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # "json" or "text"
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_EXCERPT_BYTES = int(os.environ.get("LOG_EXCERPT_BYTES", "512"))
+
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        prefix, _, rate = item.strip().partition("=")
+        if prefix and rate:
+            rates[prefix] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+_sample_rates = _parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+_debug_users = {u.strip() for u in os.environ.get("LOG_DEBUG_USERS", "").split(",") if u.strip()}
+
+# Per-request context, set by LogContextMiddleware and bind_user
+_route: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_route", default=None)
+_user_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_user_id", default=None)
+_sampled: contextvars.ContextVar[bool] = contextvars.ContextVar("log_sampled", default=True)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional["_DroppingQueueHandler"] = None
+_configure_lock = threading.Lock()
+
+
+def sample_rate(path: str) -> float:
+    """Fraction of requests logged for a path, from the longest matching prefix"""
+    best, rate = -1, 1.0
+    for prefix, prefix_rate in _sample_rates.items():
+        if path.startswith(prefix) and len(prefix) > best:
+            best, rate = len(prefix), prefix_rate
+    return rate
+
+
+def set_debug_users(user_ids: set[str]) -> None:
+    """Replace the user ids that get debug logging ("*" for everyone)"""
+    global _debug_users
+    _debug_users = set(user_ids)
+
+
+def bind_user(user_id: Optional[str]) -> None:
+    """Attach a user id to every record logged in the current request/task"""
+    _user_id.set(user_id)
+
+
+def excerpt(value: Any, limit: Optional[int] = None) -> str:
+    """Size-capped text excerpt of a body or object for log records"""
+    limit = LOG_EXCERPT_BYTES if limit is None else limit
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value[:limit])
+        total = len(value)
+        text = raw.decode("utf-8", errors="replace")
+    else:
+        text = value if isinstance(value, str) else str(value)
+        total = len(text)
+        text = text[:limit]
+    if total > limit:
+        return f"{text}... (+{total - limit} more)"
+    return text
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops instead of blocking and defers formatting to the writer"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Tracebacks are rendered now, while the frames still exist; the
+        # message and fields are serialized by the writer thread
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _StructuredFormatter(logging.Formatter):
+    def __init__(self, handler_ref: "_DroppingQueueHandler"):
+        super().__init__()
+        self._queue_handler = handler_ref
+        self._reported_drops = 0
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", {}))
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+
+        dropped = self._queue_handler.dropped
+        if dropped != self._reported_drops:
+            entry["log_dropped"] = dropped - self._reported_drops
+            self._reported_drops = dropped
+
+        if LOG_FORMAT == "text":
+            head = f"{entry.pop('ts')} {entry.pop('level').upper()} {entry.pop('logger')} {entry.pop('event')}"
+            exc = entry.pop("exc", None)
+            line = " ".join([head] + [f"{k}={v}" for k, v in entry.items()])
+            return f"{line}\n{exc}" if exc else line
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging() -> None:
+    """Start the background writer (idempotent)"""
+    global _listener, _handler
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        _handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        writer = logging.StreamHandler(sys.stdout)
+        writer.setFormatter(_StructuredFormatter(_handler))
+        _listener = logging.handlers.QueueListener(_handler.queue, writer)
+        _listener.start()
+
+        root = logging.getLogger("app")
+        root.addHandler(_handler)
+        root.setLevel(logging.DEBUG)
+        root.propagate = False
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background writer"""
+    global _listener, _handler
+    with _configure_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger("app").removeHandler(_handler)
+        _listener = _handler = None
+
+
+atexit.register(shutdown_logging)
+
+
+class StructuredLogger:
+    """Logger taking an event name plus keyword fields"""
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(f"app.{name}")
+        self._min_level = logging.getLevelName(LOG_LEVEL)
+
+    def debug_enabled(self, user_id: Optional[str] = None) -> bool:
+        """True if debug output is on for this user (default: the bound user)"""
+        if not _debug_users:
+            return False
+        if "*" in _debug_users:
+            return True
+        return (user_id or _user_id.get()) in _debug_users
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: bool = False) -> None:
+        if _listener is None:
+            # Restarted after shutdown_logging (e.g. the app is started again)
+            configure_logging()
+        context = {}
+        route, user_id = _route.get(), _user_id.get()
+        if route is not None:
+            context["route"] = route
+        if user_id is not None:
+            context["user_id"] = user_id
+        self._logger.log(level, event, exc_info=exc_info, extra={"context": context, "fields": fields})
+
+    def debug(self, event: str, **fields: Any) -> None:
+        if self.debug_enabled(fields.get("user_id")):
+            self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        if self._min_level <= logging.INFO and _sampled.get():
+            self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        if self._min_level <= logging.WARNING:
+            self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, exc_info: bool = False, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=exc_info)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    configure_logging()
+    return StructuredLogger(name)
+
+
+class LogContextMiddleware:
+    """ASGI middleware recording the route and the sampling decision per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        path = scope.get("path", "")
+        route_token = _route.set(path)
+        user_token = _user_id.set(None)
+        rate = sample_rate(path)
+        sampled_token = _sampled.set(rate >= 1.0 or random.random() < rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _sampled.reset(sampled_token)
+            _user_id.reset(user_token)
+            _route.reset(route_token)
+
+
+__all__ = [
+    "LogContextMiddleware",
+    "StructuredLogger",
+    "bind_user",
+    "configure_logging",
+    "excerpt",
+    "get_logger",
+    "sample_rate",
+    "set_debug_users",
+    "shutdown_logging",
+]
@@ -0,0 +1,108 @@
+"""Fast parser for the Swift/ObjC datetime layout used by Health Auto Export.
+
+HAE timestamps look like '2025-06-25 00:00:00 +0200' (strptime layout
+'%Y-%m-%d %H:%M:%S %z'). `datetime.strptime` is one of the slowest stdlib
+calls, so the fixed-width layout is sliced instead: the date/time part goes
+through the C-implemented `datetime.fromisoformat` and the offset maps to a
+cached `timezone` object. Anything else falls back to the original
+strptime / ISO 8601 parsing, so results and error messages are unchanged.
+
+Usage:
+
+    from app.libs.swift_datetime import parse_swift_datetime, parse_swift_datetimes
+
+    parse_swift_datetime("2025-06-25 00:00:00 +0200")
+    parse_swift_datetimes(["2025-06-25 00:00:00 +0200", ...])  # whole column
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, List
+
+SWIFT_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+# '+0200' -> timezone(timedelta(hours=2)); HAE exports use a handful of offsets
+_timezones: dict[str, timezone] = {}
+
+
+def _offset_timezone(offset: str) -> timezone | None:
+    """Cached timezone for a '+HHMM' / '-HHMM' offset, None if malformed"""
+    tz = _timezones.get(offset)
+    if tz is not None:
+        return tz
+
+    if len(offset) != 5 or offset[0] not in "+-" or not (offset[1:].isascii() and offset[1:].isdigit()):
+        return None
+    hours, minutes = int(offset[1:3]), int(offset[3:5])
+    if minutes >= 60:
+        return None
+
+    delta = timedelta(hours=hours, minutes=minutes)
+    try:
+        tz = timezone(-delta if offset[0] == "-" else delta)
+    except ValueError:
+        # Out of range (24 hours or more); the slow path reports it like strptime
+        return None
+    _timezones[offset] = tz
+    return tz
+
+
+def _parse_slow(value: str) -> datetime:
+    """Original parsing: Swift/ObjC layout with an ISO 8601 fallback"""
+    try:
+        return datetime.strptime(value, SWIFT_DATETIME_FORMAT)
+    except ValueError:
+        # Fallback to ISO format
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def parse_swift_datetime(value: str) -> datetime:
+    """Parse Swift/ObjC datetime format: '2025-06-25 00:00:00 +0200'"""
+    if (
+        len(value) == 25
+        and value[4] == "-" and value[7] == "-" and value[10] == " "
+        and value[13] == ":" and value[16] == ":" and value[19] == " "
+    ):
+        tz = _offset_timezone(value[20:])
+        if tz is not None:
+            try:
+                return datetime.fromisoformat(value[:19]).replace(tzinfo=tz)
+            except ValueError:
+                pass
+
+    return _parse_slow(value)
+
+
+def parse_swift_datetimes(values: List[str]) -> List[datetime]:
+    """Parse a whole column of timestamps at once"""
+    fromisoformat = datetime.fromisoformat
+    timezones = _timezones
+    parsed = []
+    append = parsed.append
+
+    for value in values:
+        # Inlined fast path; the layout check is repeated by parse_swift_datetime on a miss
+        tz = timezones.get(value[20:]) if len(value) == 25 and value[10] == " " and value[19] == " " else None
+        if tz is not None and value[4] == "-" and value[7] == "-" and value[13] == ":" and value[16] == ":":
+            try:
+                append(fromisoformat(value[:19]).replace(tzinfo=tz))
+                continue
+            except ValueError:
+                pass
+        append(parse_swift_datetime(value))
+
+    return parsed
+
+
+def coerce_swift_datetime(value: Any) -> Any:
+    """Model validator: parse strings, pass datetimes and other types through"""
+    if isinstance(value, str):
+        return parse_swift_datetime(value)
+    return value
+
+
+__all__ = [
+    "SWIFT_DATETIME_FORMAT",
+    "coerce_swift_datetime",
+    "parse_swift_datetime",
+    "parse_swift_datetimes",
+]
@@ -0,0 +1,251 @@
+"""Resumable chunked upload sessions.
+
+An upload is one large document split by the client into numbered chunks.
+Sessions and chunk bodies live in the database, so a client can resume after
+a disconnect against any worker: it asks which chunks were received and sends
+the missing ones. Chunks are read back one at a time when the upload is
+ingested and deleted once it completed.
+
+Session status: "open" (accepting chunks) -> "processing" -> "completed" or
+"failed". Failed uploads accept replacement chunks and, like processing ones
+whose worker stopped sending progress, can be claimed again.
+
+Chunk bodies are stored in the database, so every session is bounded by a
+number of chunks and a total of stored bytes; `put_chunk` raises
+UploadLimitExceeded for a chunk beyond either.
+
+Usage:
+
+    from app.libs.uploads import UploadStore
+
+    store = UploadStore(ttl_seconds=7 * 86400, stale_seconds=300, max_chunks=1024, max_bytes=1 << 30)
+    session = await store.create(pool, user_id, total_chunks=12)
+    await store.put_chunk(pool, user_id, session.upload_id, 0, body)
+    if await store.claim(pool, user_id, session.upload_id):
+        async for chunk in store.chunks(pool, session.upload_id):
+            ...
+        await store.finish(pool, session.upload_id, "completed", result={...})
+"""
+
+import hashlib
+import json
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import asyncpg
+
+OPEN = "open"
+PROCESSING = "processing"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class UploadLimitExceeded(Exception):
+    pass
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    user_id: str
+    status: str
+    total_chunks: Optional[int]
+    content_encoding: Optional[str]
+    backfill: bool
+    points_written: int
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    received_chunks: List[int] = field(default_factory=list)
+    bytes_received: int = 0
+
+    @property
+    def missing_chunks(self) -> List[int]:
+        """Chunk numbers not received yet (only known once total_chunks is set)"""
+        if self.total_chunks is None:
+            return []
+        received = set(self.received_chunks)
+        return [i for i in range(self.total_chunks) if i not in received]
+
+
+class UploadStore:
+    def __init__(self, ttl_seconds: float, stale_seconds: float, max_chunks: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+
+    async def create(
+        self,
+        pool: asyncpg.Pool,
+        user_id: str,
+        total_chunks: Optional[int] = None,
+        content_encoding: Optional[str] = None,
+        backfill: bool = True,
+    ) -> UploadSession:
+        upload_id = str(uuid.uuid4())
+        await pool.execute(
+            """
+            INSERT INTO ingest_uploads (upload_id, user_id, total_chunks, content_encoding, backfill)
+            VALUES ($1, $2, $3, $4, $5)
+            """,
+            upload_id, user_id, total_chunks, content_encoding, backfill
+        )
+        return await self.get(pool, user_id, upload_id)
+
+    async def get(self, pool: asyncpg.Pool, user_id: str, upload_id: str) -> Optional[UploadSession]:
+        """Session with its received chunk numbers, None if unknown"""
+        row = await pool.fetchrow(
+            """
+            SELECT u.*,
+                   coalesce(c.received, '{}') AS received_chunks,
+                   coalesce(c.bytes, 0) AS bytes_received
+            FROM ingest_uploads u
+            LEFT JOIN LATERAL (
+                SELECT array_agg(chunk_index ORDER BY chunk_index) AS received,
+                       sum(octet_length(body)) AS bytes
+                FROM ingest_upload_chunks
+                WHERE upload_id = u.upload_id
+            ) c ON true
+            WHERE u.upload_id = $1 AND u.user_id = $2
+            """,
+            upload_id, user_id
+        )
+        if row is None:
+            return None
+
+        values = dict(row)
+        values["upload_id"] = str(values["upload_id"])
+        values["received_chunks"] = list(values["received_chunks"])
+        values["bytes_received"] = int(values["bytes_received"])
+        values["result"] = json.loads(values["result"]) if values["result"] is not None else None
+        return UploadSession(**values)
+
+    async def put_chunk(self, pool: asyncpg.Pool, user_id: str, upload_id: str, index: int, body: bytes) -> Optional[str]:
+        """Store (or replace) one chunk of an open or failed session; returns its SHA-256, None otherwise.
+
+        Raises UploadLimitExceeded if `index` is not below max_chunks or the
+        session would store more than max_bytes.
+        """
+        if not 0 <= index < self.max_chunks:
+            raise UploadLimitExceeded(f"Uploads are limited to {self.max_chunks} chunks (0..{self.max_chunks - 1})")
+
+        digest = hashlib.sha256(body).hexdigest()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Locking the session serializes its chunk writes, so concurrent
+                # PUTs cannot together go past the byte limit
+                session = await conn.fetchval(
+                    """
+                    SELECT upload_id FROM ingest_uploads
+                    WHERE upload_id = $1 AND user_id = $2 AND status IN ('open', 'failed')
+                    FOR UPDATE
+                    """,
+                    upload_id, user_id
+                )
+                if session is None:
+                    return None
+
+                # octet_length of a TOASTed bytea reads its size, not its body
+                stored = await conn.fetchval(
+                    """
+                    SELECT coalesce(sum(octet_length(body)), 0) FROM ingest_upload_chunks
+                    WHERE upload_id = $1 AND chunk_index <> $2
+                    """,
+                    upload_id, index
+                )
+                if stored + len(body) > self.max_bytes:
+                    raise UploadLimitExceeded(f"Uploads are limited to {self.max_bytes} stored bytes")
+
+                await conn.execute(
+                    """
+                    INSERT INTO ingest_upload_chunks (upload_id, chunk_index, body, sha256)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (upload_id, chunk_index) DO UPDATE
+                    SET body = EXCLUDED.body, sha256 = EXCLUDED.sha256, received_at = now()
+                    """,
+                    upload_id, index, body, digest
+                )
+                await conn.execute("UPDATE ingest_uploads SET updated_at = now() WHERE upload_id = $1", upload_id)
+        return digest
+
+    async def claim(self, pool: asyncpg.Pool, user_id: str, upload_id: str, total_chunks: Optional[int] = None) -> bool:
+        """Move a session to processing; False if it is completed or being processed elsewhere"""
+        status = await pool.execute(
+            """
+            UPDATE ingest_uploads
+            SET status = 'processing', error = NULL, points_written = 0, updated_at = now(),
+                total_chunks = coalesce($3, total_chunks)
+            WHERE upload_id = $1 AND user_id = $2
+            AND (status IN ('open', 'failed')
+                 OR (status = 'processing' AND updated_at < now() - make_interval(secs => $4)))
+            """,
+            upload_id, user_id, total_chunks, self.stale_seconds
+        )
+        return not status.endswith(" 0")
+
+    async def chunks(self, pool: asyncpg.Pool, upload_id: str) -> AsyncIterator[bytes]:
+        """Chunk bodies in order, fetched one at a time"""
+        indexes = await pool.fetch(
+            "SELECT chunk_index FROM ingest_upload_chunks WHERE upload_id = $1 ORDER BY chunk_index",
+            upload_id
+        )
+        for row in indexes:
+            yield await pool.fetchval(
+                "SELECT body FROM ingest_upload_chunks WHERE upload_id = $1 AND chunk_index = $2",
+                upload_id, row["chunk_index"]
+            )
+
+    async def progress(self, pool: asyncpg.Pool, upload_id: str, points_written: int) -> None:
+        """Record progress; doubles as the heartbeat of the processing worker"""
+        await pool.execute(
+            "UPDATE ingest_uploads SET points_written = $2, updated_at = now() WHERE upload_id = $1",
+            upload_id, points_written
+        )
+
+    async def finish(
+        self,
+        pool: asyncpg.Pool,
+        upload_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Record the outcome; chunks of completed uploads are deleted"""
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    UPDATE ingest_uploads
+                    SET status = $2, result = $3::jsonb, error = $4, updated_at = now()
+                    WHERE upload_id = $1
+                    """,
+                    upload_id, status, json.dumps(result) if result is not None else None, error
+                )
+                if status == COMPLETED:
+                    await conn.execute("DELETE FROM ingest_upload_chunks WHERE upload_id = $1", upload_id)
+
+    async def purge(self, pool: asyncpg.Pool) -> int:
+        """Delete sessions (and their chunks) untouched for longer than the TTL"""
+        status = await pool.execute(
+            """
+            DELETE FROM ingest_uploads
+            WHERE updated_at <= now() - make_interval(secs => $1) AND status <> 'processing'
+            """,
+            self.ttl_seconds
+        )
+        return int(status.rsplit(" ", 1)[-1])
+
+
+__all__ = [
+    "COMPLETED",
+    "FAILED",
+    "OPEN",
+    "PROCESSING",
+    "UploadLimitExceeded",
+    "UploadSession",
+    "UploadStore",
+]
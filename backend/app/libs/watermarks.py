@@ -0,0 +1,77 @@
+"""Per-user, per-metric ingest high watermarks.
+
+A watermark is the latest timestamp known to be stored for a (user_id, metric)
+pair. Watermarks only ever move forward, so a cache that lags behind the
+`ingest_watermarks` table (e.g. another worker advanced it) is merely less
+effective at filtering, never wrong.
+
+Usage:
+
+    from app.libs.watermarks import WatermarkStore
+
+    store = WatermarkStore(max_users=10000)
+    watermarks = await store.get(pool, user_id)       # {metric_name: datetime}
+    await store.advance(conn, user_id, {"heart_rate_variability": latest})
+    store.remember(user_id, {"heart_rate_variability": latest})  # after commit
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict
+
+import asyncpg
+
+
+class WatermarkStore:
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._cache: OrderedDict[str, Dict[str, datetime]] = OrderedDict()
+
+    async def get(self, pool: asyncpg.Pool, user_id: str, refresh: bool = False) -> Dict[str, datetime]:
+        """Watermarks of one user, loaded from the table on first use"""
+        if not refresh and user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            return self._cache[user_id]
+
+        rows = await pool.fetch(
+            "SELECT metric_name, watermark FROM ingest_watermarks WHERE user_id = $1",
+            user_id
+        )
+        self._cache[user_id] = {}
+        self.remember(user_id, {row["metric_name"]: row["watermark"] for row in rows})
+        return self._cache[user_id]
+
+    def remember(self, user_id: str, watermarks: Dict[str, datetime]) -> None:
+        """Move cached watermarks forward once the writes behind them are committed"""
+        cached = self._cache.setdefault(user_id, {})
+        for metric_name, watermark in watermarks.items():
+            if metric_name not in cached or watermark > cached[metric_name]:
+                cached[metric_name] = watermark
+
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_users:
+            self._cache.popitem(last=False)
+
+    async def advance(self, conn: asyncpg.Connection, user_id: str, watermarks: Dict[str, datetime]) -> None:
+        """Move stored watermarks forward (never backward) in the caller's transaction"""
+        if not watermarks:
+            return
+
+        await conn.execute(
+            """
+            INSERT INTO ingest_watermarks (user_id, metric_name, watermark)
+            SELECT $1, w.metric_name, w.watermark
+            FROM unnest($2::text[], $3::timestamptz[]) AS w(metric_name, watermark)
+            ON CONFLICT (user_id, metric_name) DO UPDATE
+            SET watermark = GREATEST(ingest_watermarks.watermark, EXCLUDED.watermark),
+                updated_at = now()
+            """,
+            user_id,
+            list(watermarks.keys()),
+            list(watermarks.values())
+        )
+
+
+__all__ = [
+    "WatermarkStore",
+]
@@ -0,0 +1,231 @@
+"""Coalesces concurrent health_metrics inserts into shared bulk statements.
+
+When many clients sync at the same moment, each delivery's small insert
+contends on the same indexes. Deliveries instead hand their points to one
+WriteBatcher, which flushes every `max_delay_seconds` (or as soon as
+`max_rows` are pending) as a single multi-user INSERT in its own
+transaction. Each submitter awaits a future that resolves to the number of
+its own rows that were inserted (duplicates skipped), exactly as if the
+submissions had been written one after another in arrival order.
+
+While a flush runs, new submissions accumulate for the next one, so batches
+grow with load. If a batch statement fails, its submissions are written one
+by one so only the offending submission sees the error.
+
+Batches are written on a dedicated connection, never one from the request
+pool: submitters hold pooled connections while they wait, so under load the
+pool would have none left for the flush. Batched rows therefore commit
+independently of the submitter's own transaction.
+
+If the flush loop dies, the batcher stops (`running` turns False) and every
+submission still waiting fails instead of waiting forever.
+
+Usage:
+
+    from app.libs.write_batcher import WriteBatcher
+
+    batcher = WriteBatcher(max_delay_seconds=0.005, max_rows=20000)
+    batcher.start(lambda: asyncpg.connect(database_url))
+    inserted = await batcher.submit(user_id, "heart_rate", "count/min", timestamps, values)
+    await batcher.stop()        # flushes pending submissions
+"""
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from app.libs.metric_catalog import metric_catalog
+from app.libs.rollups import rollup_upsert
+
+# Every row is credited to the first submission (in arrival order) carrying
+# its key, so counts match what sequential inserts would have reported; the
+# inserted rows are added to the rollups in the same statement
+COALESCED_INSERT = f"""
+    WITH input AS (
+        SELECT s.user_id, s.metric_name, s.metric_id, p.submission, p.timestamp, p.value
+        FROM unnest($4::bigint[], $5::timestamptz[], $6::double precision[]) AS p(submission, timestamp, value)
+        JOIN unnest($1::text[], $2::text[], $3::int[]) WITH ORDINALITY
+            AS s(user_id, metric_name, metric_id, submission) USING (submission)
+    ), inserted AS (
+        INSERT INTO health_metrics (user_id, metric_id, timestamp, value)
+        SELECT user_id, metric_id, timestamp, value
+        FROM input
+        ORDER BY submission
+        ON CONFLICT (user_id, metric_id, timestamp) DO NOTHING
+        RETURNING user_id, metric_id, timestamp, value
+    ), inserted_points AS (
+        SELECT i.user_id, names.metric_name, i.timestamp, i.value
+        FROM inserted i
+        JOIN (SELECT DISTINCT metric_id, metric_name FROM input) names USING (metric_id)
+    ), rolled_up AS ({rollup_upsert("inserted_points")})
+    SELECT first.submission, count(*) AS inserted
+    FROM inserted
+    JOIN (
+        SELECT user_id, metric_id, timestamp, min(submission) AS submission
+        FROM input
+        GROUP BY user_id, metric_id, timestamp
+    ) first USING (user_id, metric_id, timestamp)
+    GROUP BY first.submission
+"""
+
+
+@dataclass(slots=True)
+class _Submission:
+    user_id: str
+    metric_name: str
+    metric_id: int
+    timestamps: List[datetime]
+    values: List[float]
+    future: asyncio.Future
+
+
+class WriteBatcher:
+    def __init__(self, max_delay_seconds: float, max_rows: int):
+        self.max_delay_seconds = max_delay_seconds
+        self.max_rows = max_rows
+        self._connect: Optional[Callable[[], Awaitable[asyncpg.Connection]]] = None
+        self._conn: Optional[asyncpg.Connection] = None
+        self._pending: List[_Submission] = []
+        self._pending_rows = 0
+        self._has_pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flushing: List[_Submission] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, connect: Callable[[], Awaitable[asyncpg.Connection]]) -> None:
+        """Start flushing; `connect` opens the dedicated connection (again after it broke)"""
+        if self._task is None:
+            self._connect = connect
+            self._task = asyncio.create_task(self._run())
+            self._task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        """Fail the submissions a dead flush loop left behind"""
+        error = asyncio.CancelledError() if task.cancelled() else task.exception()
+        if error is None:
+            return
+        if task is self._task:
+            self._task = None
+        stranded, self._flushing = self._flushing + self._pending, []
+        self._pending, self._pending_rows = [], 0
+        self._has_pending.clear()
+        self._full.clear()
+        for submission in stranded:
+            if not submission.future.done():
+                submission.future.set_exception(RuntimeError(f"WriteBatcher stopped: {error!r}"))
+
+    async def stop(self) -> None:
+        """Stop accepting submissions and return once everything submitted is written"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        self._has_pending.set()
+        self._full.set()
+        await task
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def submit(
+        self,
+        user_id: str,
+        metric_name: str,
+        metric_unit: str,
+        timestamps: List[datetime],
+        values: List[float],
+    ) -> int:
+        """Queue one metric's points; returns how many of them were inserted"""
+        if not timestamps:
+            return 0
+        metric_id = await metric_catalog.id(metric_name, metric_unit)
+        if not self.running:
+            raise RuntimeError("WriteBatcher is not running")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Submission(user_id, metric_name, metric_id, timestamps, values, future))
+        self._pending_rows += len(timestamps)
+        self._has_pending.set()
+        if self._pending_rows >= self.max_rows:
+            self._full.set()
+        return await future
+
+    def _take(self) -> List[_Submission]:
+        """Oldest pending submissions, up to max_rows (at least one)"""
+        taken, rows = 0, 0
+        while taken < len(self._pending) and (taken == 0 or rows + len(self._pending[taken].timestamps) <= self.max_rows):
+            rows += len(self._pending[taken].timestamps)
+            taken += 1
+        batch, self._pending = self._pending[:taken], self._pending[taken:]
+        self._pending_rows -= rows
+        if not self._pending:
+            self._has_pending.clear()
+        if self._pending_rows < self.max_rows:
+            self._full.clear()
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            if self._task is not None:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take()
+            if batch:
+                self._flushing = batch
+                await self._flush(batch)
+                self._flushing = []
+            if self._task is None and not self._pending:
+                return
+
+    async def _flush(self, batch: List[_Submission]) -> None:
+        try:
+            counts = await self._insert(batch)
+        except Exception:
+            # Isolate the failing submission(s) instead of failing the whole batch
+            for submission in batch:
+                try:
+                    counts = await self._insert([submission])
+                except Exception as e:
+                    if not submission.future.done():
+                        submission.future.set_exception(e)
+                else:
+                    if not submission.future.done():
+                        submission.future.set_result(counts.get(1, 0))
+            return
+
+        for number, submission in enumerate(batch, start=1):
+            if not submission.future.done():
+                submission.future.set_result(counts.get(number, 0))
+
+    async def _insert(self, batch: List[_Submission]) -> Dict[int, int]:
+        """Write a batch in one statement; returns inserted rows per 1-based submission number"""
+        numbers, timestamps, values = [], [], []
+        for number, submission in enumerate(batch, start=1):
+            numbers.extend([number] * len(submission.timestamps))
+            timestamps.extend(submission.timestamps)
+            values.extend(submission.values)
+
+        if self._conn is None or self._conn.is_closed():
+            self._conn = await self._connect()
+        rows = await self._conn.fetch(
+            COALESCED_INSERT,
+            [s.user_id for s in batch],
+            [s.metric_name for s in batch],
+            [s.metric_id for s in batch],
+            numbers,
+            timestamps,
+            values
+        )
+        return {row["submission"]: row["inserted"] for row in rows}
+
+
+__all__ = ["WriteBatcher"]
@@ -0,0 +1,56 @@
+"""Benchmark: Pydantic model validation vs the columnar decoder for HAE payloads.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_hae_decoder [points]
+"""
+
+import json
+import sys
+import timeit
+
+from app.apis.ingest import ColumnarPayload, decode_columnar, HealthAutoExportPayload
+from benchmarks.bench_swift_datetime import make_timestamps
+
+
+def make_body(points: int) -> bytes:
+    timestamps = make_timestamps(points)
+    half = points // 2
+    return json.dumps({"data": {
+        "metrics": [
+            {"name": "heart_rate_variability", "units": "ms",
+             "data": [{"date": v, "qty": 40 + i % 30} for i, v in enumerate(timestamps[:half])]},
+            {"name": "step_count", "units": "count",
+             "data": [{"date": v, "qty": float(i % 500)} for i, v in enumerate(timestamps[half:])]},
+            {"name": "sleep_analysis", "units": "hr", "data": [{
+                "date": "2025-06-25 00:00:00 +0200", "asleep": 7, "awake": 0.5, "core": 4,
+                "deep": 1.5, "rem": 1.5, "sleepStart": "2025-06-24 23:00:00 +0200",
+                "sleepEnd": "2025-06-25 07:00:00 +0200", "source": "Watch", "totalSleep": 7,
+            }]},
+        ],
+        "workouts": [{"start": "2025-06-25 06:00:00 +0200", "end": "2025-06-25 07:00:00 +0200",
+                      "activeEnergyBurned": {"qty": 500, "units": "kcal"}}],
+    }}).encode()
+
+
+def main() -> None:
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    body = make_body(points)
+
+    def model_path() -> ColumnarPayload:
+        return ColumnarPayload.from_model(HealthAutoExportPayload(**json.loads(body)))
+
+    def columnar_path() -> ColumnarPayload:
+        return decode_columnar(json.loads(body))
+
+    assert model_path() == columnar_path()
+
+    print(f"Decoding {points} points ({len(body) / 1e6:.1f} MB body)")
+    baseline = min(timeit.repeat(model_path, number=1, repeat=5))
+    columnar = min(timeit.repeat(columnar_path, number=1, repeat=5))
+    print(f"{'pydantic models':<20} {baseline * 1000:9.1f} ms")
+    print(f"{'columnar decoder':<20} {columnar * 1000:9.1f} ms  {baseline / columnar:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
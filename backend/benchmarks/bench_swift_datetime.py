@@ -0,0 +1,58 @@
+"""Microbenchmark: Swift/ObjC datetime parsing on a 100k-point payload.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_swift_datetime [points]
+"""
+
+import sys
+import timeit
+from datetime import datetime
+
+from app.libs.swift_datetime import SWIFT_DATETIME_FORMAT, parse_swift_datetime, parse_swift_datetimes
+
+
+def make_timestamps(points: int) -> list[str]:
+    offsets = ["+0200", "+0100", "-0500"]
+    return [
+        f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i * 7) % 60:02d} {offsets[i % 3]}"
+        for i in range(points)
+    ]
+
+
+def bench(label: str, fn, baseline: float | None = None) -> float:
+    seconds = min(timeit.repeat(fn, number=1, repeat=5))
+    speedup = f"  {baseline / seconds:5.1f}x" if baseline else ""
+    print(f"{label:<38} {seconds * 1000:9.1f} ms{speedup}")
+    return seconds
+
+
+def main() -> None:
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    timestamps = make_timestamps(points)
+
+    expected = [datetime.strptime(v, SWIFT_DATETIME_FORMAT) for v in timestamps]
+    assert [parse_swift_datetime(v) for v in timestamps] == expected
+    assert parse_swift_datetimes(timestamps) == expected
+
+    print(f"Parsing {points} timestamps")
+    baseline = bench("datetime.strptime per point", lambda: [datetime.strptime(v, SWIFT_DATETIME_FORMAT) for v in timestamps])
+    bench("parse_swift_datetime per point", lambda: [parse_swift_datetime(v) for v in timestamps], baseline)
+    bench("parse_swift_datetimes (batch)", lambda: parse_swift_datetimes(timestamps), baseline)
+
+    try:
+        from app.apis.ingest import HealthAutoExportPayload
+    except ImportError as e:
+        print(f"Skipping payload validation benchmark: {e}")
+        return
+
+    body = {"data": {"metrics": [{
+        "name": "heart_rate_variability",
+        "units": "ms",
+        "data": [{"date": v, "qty": 42.0} for v in timestamps],
+    }]}}
+    bench("HealthAutoExportPayload validation", lambda: HealthAutoExportPayload(**body))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Bulk import of archived Health Auto Export files (and Apple Health export.xml).
+
+Files are parsed and validated in a process pool with the ingest decoder and
+written by a bounded number of writer connections with the ingest insert
+logic (`write_payload`), so archives land exactly like webhook deliveries.
+Completed files are recorded in a checkpoint; running the same command again
+skips them unless they changed. A file with a metric that failed to write
+(logged by the ingest code, which goes on with the other metrics) counts as
+failed and stays out of the checkpoint, so the next run retries it. Points are written as a backfill: stored
+watermarks do not filter anything. Months without a health_metrics
+partition are split out of the default partition at the end.
+
+Run from the backend directory:
+
+    python -m cli.import_hae exports/ --checkpoint import.ckpt
+    python -m cli.import_hae export.xml --user u1 --workers 8 --writers 4
+
+Without --user, the user id of a file is the name of its parent directory
+(exports/<user_id>/*.json). Accepted files: *.json, *.json.gz and *.xml.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from xml.etree.ElementTree import iterparse
+
+# Per-metric ingest logs would drown the progress output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import asyncpg
+
+from app.apis.ingest import ColumnarPayload, IngestCounts, MetricColumns, SleepMetric, decode_columnar, write_payload
+from app.apis.ingest import workout_calorie_points
+from app.libs.metric_catalog import metric_catalog
+from app.libs.migrations import prepare_schema
+from app.libs.partitions import split_default_partition
+from app.libs.swift_datetime import parse_swift_datetimes
+
+# export.xml records are split into payloads of at most this many points, so
+# one transaction never covers a whole multi-year export
+XML_PAYLOAD_POINTS = 100_000
+
+# HealthKit quantity types whose HAE metric name is not the snake_cased identifier
+HEALTHKIT_METRIC_NAMES = {
+    "HeartRateVariabilitySDNN": "heart_rate_variability",
+    "ActiveEnergyBurned": "active_energy",
+    "BasalEnergyBurned": "basal_energy_burned",
+    "DistanceWalkingRunning": "walking_running_distance",
+    "OxygenSaturation": "blood_oxygen_saturation",
+    "AppleExerciseTime": "apple_exercise_time",
+    "AppleStandTime": "apple_stand_time",
+    "VO2Max": "vo2_max",
+    "BodyMass": "weight_body_mass",
+    "WalkingHeartRateAverage": "walking_heart_rate_average",
+}
+HEALTHKIT_QUANTITY_PREFIX = "HKQuantityTypeIdentifier"
+
+
+def healthkit_metric_name(record_type: str) -> str:
+    identifier = record_type.removeprefix(HEALTHKIT_QUANTITY_PREFIX)
+    if identifier in HEALTHKIT_METRIC_NAMES:
+        return HEALTHKIT_METRIC_NAMES[identifier]
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", identifier).lower()
+
+
+# Parsing (runs in worker processes)
+
+def parse_export_xml(path: Path) -> List[ColumnarPayload]:
+    """Quantity records of an Apple Health export.xml as columnar payloads"""
+    columns: Dict[tuple[str, str], tuple[List[str], List[float]]] = {}
+    for _, element in iterparse(path, events=("end",)):
+        if element.tag == "Record" and element.get("type", "").startswith(HEALTHKIT_QUANTITY_PREFIX):
+            try:
+                value = float(element.get("value"))
+            except (TypeError, ValueError):
+                value = None
+            if value is not None and element.get("startDate"):
+                key = (healthkit_metric_name(element.get("type")), element.get("unit") or "")
+                dates, values = columns.setdefault(key, ([], []))
+                dates.append(element.get("startDate"))
+                values.append(value)
+        # Records are flat; clearing keeps memory bounded on multi-GB exports
+        element.clear()
+
+    payloads, current, size = [], [], 0
+    for (name, unit), (dates, values) in columns.items():
+        parsed = parse_swift_datetimes(dates)
+        for start in range(0, len(parsed), XML_PAYLOAD_POINTS):
+            part = MetricColumns(name, unit, parsed[start:start + XML_PAYLOAD_POINTS], values[start:start + XML_PAYLOAD_POINTS])
+            if size and size + len(part.dates) > XML_PAYLOAD_POINTS:
+                payloads.append(ColumnarPayload(current, []))
+                current, size = [], 0
+            current.append(part)
+            size += len(part.dates)
+    if current:
+        payloads.append(ColumnarPayload(current, []))
+    return payloads
+
+
+def parse_file(path: str) -> List[ColumnarPayload]:
+    """Parse and validate one file; raises ValueError on invalid content"""
+    source = Path(path)
+    try:
+        if source.suffix == ".xml":
+            return parse_export_xml(source)
+
+        opener = gzip.open if source.suffix == ".gz" else open
+        with opener(source, "rb") as f:
+            return [decode_columnar(json.load(f))]
+    except Exception as e:
+        # Pydantic and parser errors do not survive the trip back from the
+        # worker process (unpicklable), which would break the whole pool
+        raise ValueError(f"{type(e).__name__}: {e}") from None
+
+
+def payload_points(payload: ColumnarPayload) -> int:
+    return sum(
+        len(metric.data if isinstance(metric, SleepMetric) else metric.dates)
+        for metric in payload.metrics
+    ) + len(payload.workouts)
+
+
+def unwritten_metrics(payload: ColumnarPayload, counts: IngestCounts) -> List[str]:
+    """Names of the metrics of `payload` that write_payload did not write.
+
+    write_payload logs a metric that fails and goes on; its points are then
+    missing from `counts`, which tallies every point written or found stored.
+    """
+    expected: Dict[str, int] = {}
+    for metric in payload.metrics:
+        points = len(metric.data if isinstance(metric, SleepMetric) else metric.dates)
+        expected[metric.name] = expected.get(metric.name, 0) + points
+    workout_points = len(workout_calorie_points(payload.workouts)[0])
+    if workout_points:
+        expected["workout"] = expected.get("workout", 0) + workout_points
+    return sorted(
+        name for name, points in expected.items()
+        if name not in counts.per_metric
+        or counts.per_metric[name].inserted + counts.per_metric[name].duplicate < points
+    )
+
+
+# Checkpoint
+
+@dataclass(frozen=True)
+class SourceFile:
+    path: Path
+    user_id: str
+    size: int
+    mtime: float
+
+    @property
+    def key(self) -> str:
+        return str(self.path.resolve())
+
+
+@dataclass
+class Checkpoint:
+    path: Optional[Path]
+    done: Dict[str, Dict] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Optional[Path]) -> "Checkpoint":
+        if path is None or not path.exists():
+            return cls(path)
+        return cls(path, json.loads(path.read_text()).get("done", {}))
+
+    def is_done(self, source: SourceFile) -> bool:
+        entry = self.done.get(source.key)
+        return entry is not None and entry["size"] == source.size and entry["mtime"] == source.mtime
+
+    def mark_done(self, source: SourceFile, points: int) -> None:
+        self.done[source.key] = {"user_id": source.user_id, "size": source.size, "mtime": source.mtime, "points": points}
+        if self.path is None:
+            return
+        # Write-then-rename so an interrupted import never leaves a torn checkpoint
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": 1, "done": self.done}))
+        os.replace(tmp, self.path)
+
+
+def discover(paths: List[str], user_id: Optional[str]) -> List[SourceFile]:
+    """Importable files under the given paths, largest first so workers stay busy"""
+    found = []
+    for raw in paths:
+        root = Path(raw)
+        candidates = [root] if root.is_file() else sorted(p for p in root.rglob("*") if p.is_file())
+        for path in candidates:
+            if not (path.suffix in (".json", ".xml") or path.name.endswith(".json.gz")):
+                continue
+            stat = path.stat()
+            found.append(SourceFile(path, user_id or path.parent.name, stat.st_size, stat.st_mtime))
+    return sorted(found, key=lambda s: s.size, reverse=True)
+
+
+# Import
+
+@dataclass
+class ImportStats:
+    files_total: int
+    started: float = field(default_factory=time.monotonic)
+    files_done: int = 0
+    files_failed: int = 0
+    points: int = 0
+    inserted: int = 0
+
+    def rate(self) -> float:
+        return self.points / max(time.monotonic() - self.started, 1e-9)
+
+    def report(self, final: bool = False) -> None:
+        label = "Done" if final else "Progress"
+        print(
+            f"{label}: {self.files_done}/{self.files_total} files ({self.files_failed} failed), "
+            f"{self.points} points ({self.inserted} new) in {time.monotonic() - self.started:.1f}s, "
+            f"{self.rate():,.0f} points/s",
+            flush=True
+        )
+
+
+async def run_import(args: argparse.Namespace) -> ImportStats:
+    checkpoint = Checkpoint.load(Path(args.checkpoint) if args.checkpoint else None)
+    sources = [s for s in discover(args.paths, args.user) if not checkpoint.is_done(s)]
+    stats = ImportStats(files_total=len(sources))
+    print(f"Importing {len(sources)} files with {args.workers} parse workers and {args.writers} writers", flush=True)
+    if not sources:
+        return stats
+
+    dsn = args.dsn or os.environ.get("DATABASE_URL")
+    if not dsn:
+        from app.libs.database import get_database_url
+        dsn = get_database_url()
+    pool = await asyncpg.create_pool(dsn, min_size=args.writers, max_size=args.writers)
+    await prepare_schema(pool)
+    metric_catalog.start(lambda: asyncpg.connect(dsn))
+    await metric_catalog.load(pool)
+
+    loop = asyncio.get_running_loop()
+    # Parsed files waiting for a writer; bounded so fast parsers cannot run ahead
+    parsed: asyncio.Queue = asyncio.Queue(maxsize=args.writers * 2)
+
+    async def parse(executor: ProcessPoolExecutor, source: SourceFile, slots: asyncio.Semaphore) -> None:
+        async with slots:
+            try:
+                payloads = await loop.run_in_executor(executor, parse_file, str(source.path))
+            except Exception as e:
+                stats.files_failed += 1
+                print(f"Failed to parse {source.path}: {e}", file=sys.stderr, flush=True)
+                return
+            await parsed.put((source, payloads))
+
+    async def write() -> None:
+        while (item := await parsed.get()) is not None:
+            source, payloads = item
+            try:
+                points = 0
+                async with pool.acquire() as conn:
+                    for payload in payloads:
+                        counts = await write_payload(conn, source.user_id, payload)
+                        points += payload_points(payload)
+                        stats.points += payload_points(payload)
+                        stats.inserted += sum(counts.processed.values())
+                        unwritten = unwritten_metrics(payload, counts)
+                        if unwritten:
+                            raise RuntimeError(f"metrics not written (see the log above): {', '.join(unwritten)}")
+                checkpoint.mark_done(source, points)
+                stats.files_done += 1
+            except Exception as e:
+                stats.files_failed += 1
+                print(f"Failed to write {source.path}: {e}", file=sys.stderr, flush=True)
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(args.report_seconds)
+            stats.report()
+
+    reporter = asyncio.create_task(report())
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            writers = [asyncio.create_task(write()) for _ in range(args.writers)]
+            slots = asyncio.Semaphore(args.workers * 2)
+            await asyncio.gather(*(parse(executor, source, slots) for source in sources))
+            for _ in writers:
+                await parsed.put(None)
+            await asyncio.gather(*writers)
+        # History lands in the default partition; give each month its own
+        moved = await split_default_partition(pool)
+        if moved:
+            print(f"Moved {len(moved)} months out of the default partition", flush=True)
+    finally:
+        reporter.cancel()
+        await metric_catalog.stop()
+        await pool.close()
+
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import Health Auto Export files")
+    parser.add_argument("paths", nargs="+", help="Files or directories (<user_id>/*.json) to import")
+    parser.add_argument("--user", help="User id for all files (default: parent directory name)")
+    parser.add_argument("--dsn", help="Postgres DSN (default: DATABASE_URL or the app's database secret)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parse/validate processes")
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent writer connections")
+    parser.add_argument("--checkpoint", default=".hae_import.ckpt", help="Checkpoint file ('' to disable)")
+    parser.add_argument("--report-seconds", type=float, default=5.0, help="Progress report interval")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run_import(args))
+    stats.report(final=True)
+    sys.exit(1 if stats.files_failed else 0)
+
+
+if __name__ == "__main__":
+    main()
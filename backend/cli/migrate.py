@@ -0,0 +1,70 @@
+"""Apply or inspect the versioned schema migrations (backend/migrations).
+
+The app applies pending migrations on startup unless DB_MIGRATE_ON_STARTUP is
+false; this command is for deployments that migrate as a separate step and for
+checking a database by hand.
+
+Run from the backend directory:
+
+    python -m cli.migrate             # apply pending migrations, then check indexes
+    python -m cli.migrate --status    # list migrations and when they were applied
+    python -m cli.migrate --check     # only verify the required indexes
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+# Migration logs would duplicate the command's own output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import asyncpg
+
+from app.libs.migrations import SchemaError, apply_migrations, check_required_indexes, migration_status
+
+
+async def run(dsn: str, args: argparse.Namespace) -> None:
+    pool = await asyncpg.create_pool(dsn, min_size=1, max_size=1)
+    try:
+        if args.status:
+            for status in await migration_status(pool):
+                applied = status.applied_at.isoformat() if status.applied_at else "pending"
+                print(f"{status.version:04d}_{status.name}: {applied}")
+            return
+
+        if not args.check:
+            applied = await apply_migrations(pool)
+            for migration in applied:
+                print(f"Applied {migration.version:04d}_{migration.name}")
+            if not applied:
+                print("No pending migrations")
+        await check_required_indexes(pool)
+        print("Required indexes present")
+    finally:
+        await pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations")
+    parser.add_argument("--dsn", help="Postgres DSN (default: DATABASE_URL or the app's database secret)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--status", action="store_true", help="List migrations and their state")
+    mode.add_argument("--check", action="store_true", help="Only check the required indexes")
+    args = parser.parse_args()
+
+    dsn = args.dsn or os.environ.get("DATABASE_URL")
+    if not dsn:
+        from app.libs.database import get_database_url
+        dsn = get_database_url()
+    if not dsn:
+        sys.exit("No database configured")
+
+    try:
+        asyncio.run(run(dsn, args))
+    except SchemaError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
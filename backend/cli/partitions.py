@@ -0,0 +1,83 @@
+"""Manage the monthly partitions of health_metrics.
+
+Without options, creates the partitions of the coming months (as the app does
+periodically) and moves months left in the default partition, e.g. by a
+historical backfill, into partitions of their own.
+
+Run from the backend directory:
+
+    python -m cli.partitions                          # ensure + split the default partition
+    python -m cli.partitions --list
+    python -m cli.partitions --detach-before 2024-01 --archive-schema archive
+    python -m cli.partitions --detach-before 2024-01 --drop
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone
+
+import asyncpg
+
+from app.libs.partitions import MONTHS_AHEAD, detach_partitions, ensure_partitions, list_partitions, split_default_partition
+
+
+def parse_month(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}") from None
+
+
+async def run(dsn: str, args: argparse.Namespace) -> None:
+    pool = await asyncpg.create_pool(dsn, min_size=1, max_size=1)
+    try:
+        if args.list:
+            for partition in await list_partitions(pool):
+                label = "default" if partition.is_default else f"{partition.start:%Y-%m}"
+                print(f"{partition.name:32} {label:8} ~{partition.rows:>12,} rows {partition.bytes / 2**20:>10,.1f} MiB")
+            return
+
+        if args.detach_before:
+            detached = await detach_partitions(pool, args.detach_before, args.archive_schema, args.drop)
+            action = "Dropped" if args.drop else "Detached"
+            for name in detached:
+                print(f"{action} {name}")
+            if not detached:
+                print(f"No partitions end before {args.detach_before:%Y-%m}")
+            return
+
+        for name in await ensure_partitions(pool, args.months_ahead):
+            print(f"Created {name}")
+        moved = await split_default_partition(pool)
+        if moved:
+            print(f"Moved {len(moved)} months ({moved[0]} .. {moved[-1]}) out of the default partition")
+    finally:
+        await pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage monthly health_metrics partitions")
+    parser.add_argument("--dsn", help="Postgres DSN (default: DATABASE_URL or the app's database secret)")
+    parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD, help="Months after the current one to create")
+    parser.add_argument("--list", action="store_true", help="List partitions with estimated sizes")
+    parser.add_argument("--detach-before", type=parse_month, metavar="YYYY-MM",
+                        help="Detach partitions of months before this one")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--archive-schema", help="Move detached partitions into this schema")
+    target.add_argument("--drop", action="store_true", help="Drop detached partitions")
+    args = parser.parse_args()
+
+    dsn = args.dsn or os.environ.get("DATABASE_URL")
+    if not dsn:
+        from app.libs.database import get_database_url
+        dsn = get_database_url()
+    if not dsn:
+        sys.exit("No database configured")
+
+    asyncio.run(run(dsn, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Rebuild the hourly/daily rollups (metric_rollups) from raw rows.
+
+Needed after raw rows were changed outside the ingest path (migration 0007
+already rolled up data written before rollups existed). Users are rebuilt one at a time, each in its
+own short transaction; ingest keeps running and its rollup writes wait while a
+user is being rebuilt.
+
+Run from the backend directory:
+
+    python -m cli.rebuild_rollups                 # every user
+    python -m cli.rebuild_rollups --user u1 --user u2
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional
+
+import asyncpg
+
+from app.libs.migrations import prepare_schema
+from app.libs.rollups import rebuild_rollups
+
+
+async def run_rebuild(dsn: str, user_ids: Optional[List[str]]) -> int:
+    pool = await asyncpg.create_pool(dsn, min_size=1, max_size=1)
+    try:
+        await prepare_schema(pool)
+        if not user_ids:
+            rows = await pool.fetch(
+                "SELECT user_id FROM health_metrics UNION SELECT user_id FROM sleep_metrics ORDER BY 1"
+            )
+            user_ids = [row["user_id"] for row in rows]
+
+        started = time.monotonic()
+        total = 0
+        async with pool.acquire() as conn:
+            for i, user_id in enumerate(user_ids, start=1):
+                rollup_rows = await rebuild_rollups(conn, user_id)
+                total += rollup_rows
+                print(f"[{i}/{len(user_ids)}] {user_id}: {rollup_rows} rollup rows", flush=True)
+        print(f"Rebuilt {total} rollup rows for {len(user_ids)} users in {time.monotonic() - started:.1f}s")
+        return total
+    finally:
+        await pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild hourly/daily metric rollups from raw rows")
+    parser.add_argument("--user", action="append", dest="users", help="Only this user (repeatable)")
+    parser.add_argument("--dsn", help="Postgres DSN (default: DATABASE_URL or the app's database secret)")
+    args = parser.parse_args()
+
+    dsn = args.dsn or os.environ.get("DATABASE_URL")
+    if not dsn:
+        from app.libs.database import get_database_url
+        dsn = get_database_url()
+    if not dsn:
+        sys.exit("No database configured")
+
+    asyncio.run(run_rebuild(dsn, args.users))
+
+
+if __name__ == "__main__":
+    main()
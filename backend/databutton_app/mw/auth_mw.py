@@ -8,6 +8,10 @@ from jwt import PyJWKClient
 from pydantic import BaseModel
 from starlette.requests import Request
 
+from app.libs.structured_log import get_logger
+
+log = get_logger("auth")
+
 
 class AuthConfig(BaseModel):
     jwks_url: str
@@ -61,9 +65,9 @@ def get_authorized_user(
 
         if user is not None:
             return user
-        print("Request authentication returned no user")
+        log.warning("auth.no_user")
     except Exception as e:
-        print(f"Request authentication failed: {e}")
+        log.warning("auth.failed", error=str(e))
 
     if isinstance(request, WebSocket):
         raise WebSocketException(
@@ -111,7 +115,7 @@ def authorize_websocket(
             break
 
     if not token:
-        print(f"Missing bearer {prefix}.<token> in protocols")
+        log.info("auth.missing_token", protocol_prefix=prefix)
         return None
 
     return authorize_token(token, auth_config)
@@ -123,12 +127,12 @@ def authorize_request(
 ) -> User | None:
     auth_header = request.headers.get(auth_config.header)
     if not auth_header:
-        print(f"Missing header '{auth_config.header}'")
+        log.info("auth.missing_header", header=auth_config.header)
         return None
 
     token = auth_header.startswith("Bearer ") and auth_header[7:]
     if not token:
-        print(f"Missing bearer token in '{auth_config.header}'")
+        log.info("auth.missing_token", header=auth_config.header)
         return None
 
     return authorize_token(token, auth_config)
@@ -146,7 +150,7 @@ def authorize_token(
         try:
             key, alg = get_signing_key(jwks_url, token)
         except Exception as e:
-            print(f"Failed to get signing key {e}")
+            log.warning("auth.signing_key_failed", error=str(e))
             continue
 
         try:
@@ -157,13 +161,13 @@ def authorize_token(
                 audience=audience,
             )
         except jwt.PyJWTError as e:
-            print(f"Failed to decode and validate token {e}")
+            log.warning("auth.token_invalid", error=str(e))
             continue
 
     try:
         user = User.model_validate(payload)
-        print(f"User {user.sub} authenticated")
+        log.debug("auth.authenticated", user_id=user.sub)
         return user
     except Exception as e:
-        print(f"Failed to parse token payload {e}")
+        log.warning("auth.payload_invalid", error=str(e))
         return None
@@ -1,12 +1,16 @@
 import os
 import pathlib
 import json
+from contextlib import asynccontextmanager
 import dotenv
 from fastapi import FastAPI, APIRouter, Depends
 
 dotenv.load_dotenv()
 
 from databutton_app.mw.auth_mw import AuthConfig, get_authorized_user
+from app.libs.database import create_pool, close_pool
+from app.libs.migrations import prepare_schema
+from app.libs.structured_log import LogContextMiddleware, shutdown_logging
 
 
 def get_router_config() -> dict:
@@ -74,9 +78,26 @@ def get_firebase_config() -> dict | None:
     return None
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and drain them on shutdown."""
+    app.state.db_pool = await create_pool()
+    if app.state.db_pool is not None:
+        # Fails startup if migrations fail or a required index is missing
+        await prepare_schema(app.state.db_pool)
+    try:
+        yield
+    finally:
+        await close_pool(app.state.db_pool)
+        app.state.db_pool = None
+        shutdown_logging()
+
+
 def create_app() -> FastAPI:
     """Create the app. This is called by uvicorn with the factory option to construct the app object."""
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+    app.state.db_pool = None
+    app.add_middleware(LogContextMiddleware)
     app.include_router(import_api_routers())
 
     for route in app.routes:
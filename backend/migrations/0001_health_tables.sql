@@ -0,0 +1,29 @@
+-- Raw health data written by the ingest API. IF NOT EXISTS adopts databases
+-- created before migrations existed.
+
+CREATE TABLE IF NOT EXISTS health_metrics (
+    id bigserial PRIMARY KEY,
+    user_id text NOT NULL,
+    metric_name text NOT NULL,
+    metric_unit text,
+    timestamp timestamptz NOT NULL,
+    value double precision NOT NULL,
+    created_at timestamptz DEFAULT now(),
+    UNIQUE (user_id, metric_name, timestamp)
+);
+
+CREATE TABLE IF NOT EXISTS sleep_metrics (
+    id bigserial PRIMARY KEY,
+    user_id text NOT NULL,
+    start_time timestamptz NOT NULL,
+    end_time timestamptz NOT NULL,
+    duration_total_minutes int,
+    duration_in_bed_minutes int,
+    duration_awake_minutes int,
+    duration_light_minutes int,
+    duration_deep_minutes int,
+    duration_rem_minutes int,
+    efficiency double precision,
+    created_at timestamptz DEFAULT now(),
+    UNIQUE (user_id, start_time)
+);
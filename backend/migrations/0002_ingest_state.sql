@@ -0,0 +1,44 @@
+-- Ingest bookkeeping: idempotency keys, per-metric watermarks and resumable
+-- upload sessions (previously created by the ingest router on startup).
+
+CREATE TABLE IF NOT EXISTS ingest_idempotency (
+    user_id text NOT NULL,
+    key text NOT NULL,
+    status_code int NOT NULL,
+    response jsonb NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX IF NOT EXISTS ingest_idempotency_created_at_idx ON ingest_idempotency (created_at);
+
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    user_id text NOT NULL,
+    metric_name text NOT NULL,
+    watermark timestamptz NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, metric_name)
+);
+
+CREATE TABLE IF NOT EXISTS ingest_uploads (
+    upload_id uuid PRIMARY KEY,
+    user_id text NOT NULL,
+    status text NOT NULL DEFAULT 'open',
+    total_chunks int,
+    content_encoding text,
+    backfill boolean NOT NULL DEFAULT true,
+    points_written bigint NOT NULL DEFAULT 0,
+    result jsonb,
+    error text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS ingest_upload_chunks (
+    upload_id uuid NOT NULL REFERENCES ingest_uploads ON DELETE CASCADE,
+    chunk_index int NOT NULL,
+    body bytea NOT NULL,
+    sha256 text NOT NULL,
+    received_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (upload_id, chunk_index)
+);
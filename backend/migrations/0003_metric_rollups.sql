@@ -0,0 +1,15 @@
+-- Hourly/daily rollups maintained by ingest (see app/libs/rollups.py).
+-- Raw data written before this migration is rolled up by 0007.
+
+CREATE TABLE IF NOT EXISTS metric_rollups (
+    user_id text NOT NULL,
+    metric_name text NOT NULL,
+    resolution text NOT NULL,
+    bucket timestamptz NOT NULL,
+    count bigint NOT NULL,
+    sum double precision NOT NULL,
+    min double precision NOT NULL,
+    max double precision NOT NULL,
+    sumsq double precision NOT NULL,
+    PRIMARY KEY (user_id, metric_name, resolution, bucket)
+);
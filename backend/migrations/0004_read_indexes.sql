@@ -0,0 +1,23 @@
+-- migrate: no-transaction
+-- Covering unique indexes so /metrics and /insights reads are index-only
+-- scans; they replace the plain unique constraints (same keys, still the
+-- ON CONFLICT arbiters). BRIN indexes serve cross-user time-range scans
+-- (rollup rebuilds, retention) at a tiny fraction of a btree's size.
+-- Built CONCURRENTLY so writes continue; if a build fails, drop the invalid
+-- index and run the migrations again.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS health_metrics_user_metric_ts_idx
+    ON health_metrics (user_id, metric_name, timestamp) INCLUDE (value);
+
+ALTER TABLE health_metrics DROP CONSTRAINT IF EXISTS health_metrics_user_id_metric_name_timestamp_key;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS sleep_metrics_user_start_idx
+    ON sleep_metrics (user_id, start_time) INCLUDE (duration_total_minutes, efficiency);
+
+ALTER TABLE sleep_metrics DROP CONSTRAINT IF EXISTS sleep_metrics_user_id_start_time_key;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS health_metrics_timestamp_brin
+    ON health_metrics USING brin (timestamp);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sleep_metrics_start_time_brin
+    ON sleep_metrics USING brin (start_time);
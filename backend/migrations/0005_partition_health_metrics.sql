@@ -0,0 +1,79 @@
+-- Range-partition health_metrics by UTC month (see app/libs/partitions.py).
+--
+-- The existing table becomes the DEFAULT partition, so conversion does not
+-- rewrite any data; rows of months without a partition keep landing there
+-- and `health_metrics_ensure_partition` moves them into a monthly partition
+-- when it creates one. The unique index includes the partition key, so
+-- ON CONFLICT works per partition exactly as before. The serial id is kept
+-- as a plain column: a partitioned primary key would have to include timestamp.
+
+ALTER TABLE health_metrics RENAME TO health_metrics_default;
+ALTER TABLE health_metrics_default DROP CONSTRAINT IF EXISTS health_metrics_pkey;
+ALTER INDEX health_metrics_user_metric_ts_idx RENAME TO health_metrics_default_user_metric_ts_idx;
+ALTER INDEX health_metrics_timestamp_brin RENAME TO health_metrics_default_timestamp_brin;
+
+CREATE TABLE health_metrics (
+    id bigint NOT NULL DEFAULT nextval('health_metrics_id_seq'),
+    user_id text NOT NULL,
+    metric_name text NOT NULL,
+    metric_unit text,
+    timestamp timestamptz NOT NULL,
+    value double precision NOT NULL,
+    created_at timestamptz DEFAULT now()
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE health_metrics_id_seq OWNED BY health_metrics.id;
+ALTER TABLE health_metrics_default ALTER COLUMN id SET DEFAULT nextval('health_metrics_id_seq');
+
+CREATE UNIQUE INDEX health_metrics_user_metric_ts_idx
+    ON health_metrics (user_id, metric_name, timestamp) INCLUDE (value);
+CREATE INDEX health_metrics_timestamp_brin
+    ON health_metrics USING brin (timestamp);
+
+-- Adopts the default partition's equivalent indexes instead of building new ones
+ALTER TABLE health_metrics ATTACH PARTITION health_metrics_default DEFAULT;
+
+-- Partition health_metrics_YYYY_MM for the UTC month containing `month`,
+-- moving that month's rows out of the default partition. Returns its name.
+CREATE OR REPLACE FUNCTION health_metrics_ensure_partition(month timestamptz) RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+    lower_bound timestamptz := date_trunc('month', month, 'UTC');
+    upper_bound timestamptz := ((lower_bound AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC';
+    partition_name text := 'health_metrics_' || to_char(lower_bound AT TIME ZONE 'UTC', 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    -- Serializes creators and keeps rows of this month from landing in the
+    -- default partition while they are moved
+    LOCK TABLE health_metrics_default IN ACCESS EXCLUSIVE MODE;
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE health_metrics INCLUDING DEFAULTS)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (
+            DELETE FROM health_metrics_default WHERE timestamp >= %1$L AND timestamp < %2$L
+            RETURNING id, user_id, metric_name, metric_unit, timestamp, value, created_at
+        )
+        INSERT INTO %3$I (id, user_id, metric_name, metric_unit, timestamp, value, created_at)
+        SELECT * FROM moved',
+        lower_bound, upper_bound, partition_name
+    );
+    -- Builds the partition's copies of the parent's indexes
+    EXECUTE format(
+        'ALTER TABLE health_metrics ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, lower_bound, upper_bound
+    );
+    RETURN partition_name;
+END;
+$$;
+
+-- The current month and the next three; the app keeps months ahead created
+SELECT health_metrics_ensure_partition(
+    ((date_trunc('month', now(), 'UTC') AT TIME ZONE 'UTC') + make_interval(months => ahead)) AT TIME ZONE 'UTC'
+)
+FROM generate_series(0, 3) AS ahead;
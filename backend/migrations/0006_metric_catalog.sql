@@ -0,0 +1,74 @@
+-- Dictionary-encode health_metrics.metric_name/metric_unit (see
+-- app/libs/metric_catalog.py). Rows keep only the integer id of their
+-- (name, unit) pair, which shrinks both the heap and the unique index.
+--
+-- Rewrites health_metrics once, holding an exclusive lock for the duration.
+
+CREATE TABLE IF NOT EXISTS metric_catalog (
+    id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name text NOT NULL,
+    unit text NOT NULL DEFAULT '',
+    created_at timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (name, unit)
+);
+
+INSERT INTO metric_catalog (name, unit)
+SELECT DISTINCT metric_name, coalesce(metric_unit, '')
+FROM health_metrics
+ORDER BY 1, 2
+ON CONFLICT (name, unit) DO NOTHING;
+
+CREATE FUNCTION pg_temp.metric_catalog_id(metric_name text, metric_unit text) RETURNS integer
+LANGUAGE sql STABLE AS $$
+    SELECT id FROM metric_catalog WHERE name = metric_name AND unit = coalesce(metric_unit, '')
+$$;
+
+-- A single rewrite computes the ids and reclaims the space of the dropped
+-- columns (the type change is what forces the rewrite). Dropping
+-- metric_name also drops the unique index built on it.
+ALTER TABLE health_metrics ADD COLUMN metric_id smallint;
+ALTER TABLE health_metrics
+    ALTER COLUMN metric_id TYPE integer USING pg_temp.metric_catalog_id(metric_name, metric_unit),
+    ALTER COLUMN metric_id SET NOT NULL,
+    DROP COLUMN metric_name,
+    DROP COLUMN metric_unit;
+
+CREATE UNIQUE INDEX health_metrics_user_metric_ts_idx
+    ON health_metrics (user_id, metric_id, timestamp) INCLUDE (value);
+
+CREATE OR REPLACE FUNCTION health_metrics_ensure_partition(month timestamptz) RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+    lower_bound timestamptz := date_trunc('month', month, 'UTC');
+    upper_bound timestamptz := ((lower_bound AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC';
+    partition_name text := 'health_metrics_' || to_char(lower_bound AT TIME ZONE 'UTC', 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    -- Serializes creators and keeps rows of this month from landing in the
+    -- default partition while they are moved
+    LOCK TABLE health_metrics_default IN ACCESS EXCLUSIVE MODE;
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE health_metrics INCLUDING DEFAULTS)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (
+            DELETE FROM health_metrics_default WHERE timestamp >= %1$L AND timestamp < %2$L
+            RETURNING id, user_id, metric_id, timestamp, value, created_at
+        )
+        INSERT INTO %3$I (id, user_id, metric_id, timestamp, value, created_at)
+        SELECT * FROM moved',
+        lower_bound, upper_bound, partition_name
+    );
+    -- Builds the partition's copies of the parent's indexes
+    EXECUTE format(
+        'ALTER TABLE health_metrics ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, lower_bound, upper_bound
+    );
+    RETURN partition_name;
+END;
+$$;
@@ -0,0 +1,30 @@
+-- Build metric_rollups from the raw rows (see app/libs/rollups.py).
+--
+-- 0003 created the table empty, so on databases with data written before
+-- rollups existed, reads served from them (insights, /metrics counts and
+-- aggregates) were short until cli.rebuild_rollups was run by hand. This
+-- recomputes every rollup, which also corrects rows such a partial state
+-- left behind. The table lock makes concurrent ingest wait for its rollup
+-- writes instead of adding to rows that are being replaced.
+
+LOCK TABLE metric_rollups IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM metric_rollups;
+
+INSERT INTO metric_rollups (user_id, metric_name, resolution, bucket, count, sum, min, max, sumsq)
+SELECT p.user_id, p.metric_name, res.resolution, date_trunc(res.resolution, p.timestamp, 'UTC'),
+       count(*), sum(p.value), min(p.value), max(p.value), sum(p.value * p.value)
+FROM (
+    SELECT h.user_id, c.name AS metric_name, h.timestamp, h.value
+    FROM health_metrics h
+    JOIN metric_catalog c ON c.id = h.metric_id
+    UNION ALL
+    SELECT user_id, 'sleep_hours', start_time, duration_total_minutes / 60.0::double precision
+    FROM sleep_metrics
+    UNION ALL
+    SELECT user_id, 'sleep_efficiency', start_time, efficiency
+    FROM sleep_metrics
+) p
+CROSS JOIN (VALUES ('hour'), ('day')) AS res(resolution)
+WHERE p.value IS NOT NULL
+GROUP BY 1, 2, 3, 4;
@@ -0,0 +1,6 @@
+-- Partitions are created by app/libs/partitions.py in several short
+-- transactions now. The function it replaces held an ACCESS EXCLUSIVE lock on
+-- health_metrics_default while it moved a month's rows and while ATTACH
+-- scanned the default partition, blocking every read and write of it.
+
+DROP FUNCTION IF EXISTS health_metrics_ensure_partition(timestamptz);
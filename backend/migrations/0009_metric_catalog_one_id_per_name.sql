@@ -0,0 +1,50 @@
+-- One metric_catalog id per metric name (see app/libs/metric_catalog.py).
+--
+-- 0006 gave each (name, unit) pair its own id, so the unique key
+-- (user_id, metric_id, timestamp) stored a point twice when it was sent
+-- again in another unit. Ids of the same name are merged into the lowest
+-- one, whose unit stays as the name's; of the points that then share user,
+-- metric and timestamp, the one under the lowest id is kept. Rollups of the
+-- merged names are recomputed without the dropped duplicates.
+
+CREATE TEMP TABLE metric_id_merge ON COMMIT DROP AS
+SELECT id AS old_id, new_id, name
+FROM (SELECT id, name, min(id) OVER (PARTITION BY name) AS new_id FROM metric_catalog) ids
+WHERE id <> new_id;
+
+DELETE FROM health_metrics h
+USING metric_id_merge m
+WHERE h.metric_id = m.old_id
+AND EXISTS (
+    SELECT 1
+    FROM health_metrics kept
+    WHERE kept.user_id = h.user_id
+    AND kept.timestamp = h.timestamp
+    AND kept.metric_id < h.metric_id
+    AND (kept.metric_id = m.new_id OR kept.metric_id IN (SELECT old_id FROM metric_id_merge WHERE new_id = m.new_id))
+);
+
+UPDATE health_metrics h
+SET metric_id = m.new_id
+FROM metric_id_merge m
+WHERE h.metric_id = m.old_id;
+
+DELETE FROM metric_catalog c
+USING metric_id_merge m
+WHERE c.id = m.old_id;
+
+ALTER TABLE metric_catalog
+    DROP CONSTRAINT metric_catalog_name_unit_key,
+    ADD CONSTRAINT metric_catalog_name_key UNIQUE (name);
+
+DELETE FROM metric_rollups
+WHERE metric_name IN (SELECT name FROM metric_id_merge);
+
+INSERT INTO metric_rollups (user_id, metric_name, resolution, bucket, count, sum, min, max, sumsq)
+SELECT h.user_id, c.name, res.resolution, date_trunc(res.resolution, h.timestamp, 'UTC'),
+       count(*), sum(h.value), min(h.value), max(h.value), sum(h.value * h.value)
+FROM health_metrics h
+JOIN metric_catalog c ON c.id = h.metric_id
+CROSS JOIN (VALUES ('hour'), ('day')) AS res(resolution)
+WHERE c.name IN (SELECT name FROM metric_id_merge)
+GROUP BY 1, 2, 3, 4;
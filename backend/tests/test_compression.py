@@ -0,0 +1,118 @@
+"""Size-bounded streaming decompression of request bodies (app.libs.compression).
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import gzip
+import random
+import unittest
+
+import zstandard
+
+from app.libs.compression import (
+    OUTPUT_CHUNK_BYTES,
+    DecompressedTooLarge,
+    DecompressionError,
+    UnsupportedEncoding,
+    content_encodings,
+    decompress_stream,
+)
+
+BODY = b"".join(b'{"date": "2025-06-25 %02d:%02d:00 +0200", "qty": %d},' % (i // 60 % 24, i % 60, i) for i in range(20000))
+
+
+def zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(data)
+
+
+async def chunks_of(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+class DecompressStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def decompress(self, data, encodings, max_bytes=1 << 30, max_ratio=None, chunk_size=1000):
+        """Decompressed output and the largest chunk yielded"""
+        out, largest = [], 0
+        async for chunk in decompress_stream(chunks_of(data, chunk_size), encodings, max_bytes, max_ratio):
+            out.append(chunk)
+            largest = max(largest, len(chunk))
+        return b"".join(out), largest
+
+    async def test_round_trip(self):
+        cases = {
+            "gzip": (["gzip"], gzip.compress(BODY)),
+            "x-gzip": (["x-gzip"], gzip.compress(BODY)),
+            "zstd": (["zstd"], zstd(BODY)),
+            "gzip, zstd": (["gzip", "zstd"], zstd(gzip.compress(BODY))),
+            "concatenated gzip members": (["gzip"], gzip.compress(BODY[:5000]) + gzip.compress(BODY[5000:])),
+            "concatenated zstd frames": (["zstd"], zstd(BODY[:5000]) + zstd(BODY[5000:])),
+            "no encoding": ([], BODY),
+        }
+        for name, (encodings, data) in cases.items():
+            for chunk_size in (1, 7, 65536):
+                with self.subTest(case=name, chunk_size=chunk_size):
+                    out, largest = await self.decompress(data, encodings, chunk_size=chunk_size)
+                    self.assertEqual(out, BODY)
+                    self.assertLessEqual(largest, OUTPUT_CHUNK_BYTES * 32)
+
+    async def test_output_above_max_bytes_is_rejected(self):
+        for encodings, data in ((["gzip"], gzip.compress(BODY)), (["zstd"], zstd(BODY))):
+            with self.subTest(encodings=encodings):
+                with self.assertRaisesRegex(DecompressedTooLarge, f"exceeds {len(BODY) - 1} bytes"):
+                    await self.decompress(data, encodings, max_bytes=len(BODY) - 1)
+                out, _ = await self.decompress(data, encodings, max_bytes=len(BODY))
+                self.assertEqual(out, BODY)
+
+    async def test_bombs_are_stopped_early(self):
+        bomb = 64 << 20
+        for encodings, data in ((["gzip"], gzip.compress(bytes(bomb), 9)), (["zstd"], zstd(bytes(bomb)))):
+            with self.subTest(encodings=encodings):
+                produced = 0
+                with self.assertRaisesRegex(DecompressedTooLarge, "ratio exceeds 100"):
+                    async for chunk in decompress_stream(chunks_of(data, 4096), encodings, bomb, max_ratio=100):
+                        produced += len(chunk)
+                self.assertLess(produced, bomb // 10)
+
+    async def test_small_bodies_get_one_chunk_of_slack(self):
+        data = gzip.compress(bytes(OUTPUT_CHUNK_BYTES))
+        out, _ = await self.decompress(data, ["gzip"], max_ratio=1)
+        self.assertEqual(len(out), OUTPUT_CHUNK_BYTES)
+
+    async def test_corrupt_and_truncated_bodies_are_rejected(self):
+        gzipped, zstded = gzip.compress(BODY), zstd(BODY)
+        corrupt = bytearray(gzipped)
+        corrupt[20:40] = bytes(random.Random(1).randrange(256) for _ in range(20))
+        cases = {
+            "invalid gzip": (["gzip"], b"not gzip at all"),
+            "corrupt gzip": (["gzip"], bytes(corrupt)),
+            "truncated gzip": (["gzip"], gzipped[:len(gzipped) // 2]),
+            "invalid zstd": (["zstd"], b"not zstd at all"),
+            "truncated zstd": (["zstd"], zstded[:len(zstded) // 2]),
+            "wrong order": (["zstd", "gzip"], zstd(gzipped)),
+        }
+        for name, (encodings, data) in cases.items():
+            with self.subTest(case=name):
+                with self.assertRaises(DecompressionError):
+                    await self.decompress(data, encodings)
+
+
+class ContentEncodingsTest(unittest.TestCase):
+    def test_header_parsing(self):
+        self.assertEqual(content_encodings(None), [])
+        self.assertEqual(content_encodings(""), [])
+        self.assertEqual(content_encodings("identity"), [])
+        self.assertEqual(content_encodings("GZIP"), ["gzip"])
+        self.assertEqual(content_encodings(" gzip , identity, zstd "), ["gzip", "zstd"])
+
+    def test_unsupported_encodings(self):
+        for header in ("br", "deflate", "gzip, br"):
+            with self.subTest(header=header):
+                with self.assertRaisesRegex(UnsupportedEncoding, "Unsupported Content-Encoding"):
+                    content_encodings(header)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Vectorized downsampling (lttb, min_max) against plain loop implementations.
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+from app.libs.downsampling import lttb, min_max
+
+
+def reference_lttb(x, y, max_points):
+    """Largest-Triangle-Three-Buckets one point at a time, with lttb's bucket edges"""
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return list(range(n))
+    x = [float(v - x[0]) for v in x]
+    y = [float(v) for v in y]
+    edges = [int(e) for e in np.linspace(1, n - 1, max_points - 1).astype(np.intp)]
+    selected, a = [0], 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 1 < max_points - 2:
+            following = range(edges[i + 1], edges[i + 2])
+            avg_x = sum(x[j] for j in following) / len(following)
+            avg_y = sum(y[j] for j in following) / len(following)
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        selected.append(a)
+    return selected + [n - 1]
+
+
+def reference_min_max(x, y, buckets):
+    """Index of the first lowest and last highest point of each equal-time bucket"""
+    n = len(x)
+    if n <= 2 * buckets or buckets < 1:
+        return list(range(n))
+    span = float(x[-1] - x[0])
+    members = {}
+    for i in range(n):
+        bucket = min(int(float(x[i] - x[0]) * buckets / span), buckets - 1) if span else 0
+        members.setdefault(bucket, []).append(i)
+    keep = set()
+    for indices in members.values():
+        keep.add(min(indices, key=lambda i: (y[i], i)))
+        keep.add(max(indices, key=lambda i: (y[i], i)))
+    return sorted(keep)
+
+
+def series(rng, n, ties=False):
+    """Irregular timestamps (seconds) with noisy values, or few distinct values with ties"""
+    x = np.cumsum([rng.randint(1, 600) for _ in range(n)]).astype(np.int64)
+    y = np.array([rng.randint(0, 3) if ties else rng.gauss(60, 15) for _ in range(n)], dtype=np.float64)
+    return x, y
+
+
+class LttbTest(unittest.TestCase):
+    def test_matches_reference(self):
+        rng = random.Random(1)
+        for case in range(200):
+            x, y = series(rng, rng.randint(1, 400), ties=case % 4 == 0)
+            max_points = rng.randint(0, 120)
+            with self.subTest(case=case, n=len(x), max_points=max_points):
+                keep = lttb(x, y, max_points)
+                self.assertEqual(keep.tolist(), reference_lttb(x, y, max_points))
+                if 3 <= max_points < len(x):
+                    self.assertEqual(len(keep), max_points)
+                    self.assertTrue(np.all(np.diff(keep) > 0))
+
+    def test_series_that_fit_are_returned_whole(self):
+        x, y = series(random.Random(2), 50)
+        self.assertEqual(lttb(x, y, 50).tolist(), list(range(50)))
+        self.assertEqual(lttb(x, y, 2).tolist(), list(range(50)))
+        self.assertEqual(lttb(x[:0], y[:0], 10).tolist(), [])
+
+
+class MinMaxTest(unittest.TestCase):
+    def test_matches_reference(self):
+        rng = random.Random(3)
+        for case in range(200):
+            x, y = series(rng, rng.randint(1, 400), ties=case % 4 == 0)
+            buckets = rng.randint(0, 100)
+            with self.subTest(case=case, n=len(x), buckets=buckets):
+                keep = min_max(x, y, buckets)
+                self.assertEqual(keep.tolist(), reference_min_max(x, y, buckets))
+                if 1 <= buckets < len(x) / 2:
+                    self.assertLessEqual(len(keep), 2 * buckets)
+
+    def test_every_spike_is_kept(self):
+        x = np.arange(10_000, dtype=np.int64)
+        y = np.zeros(10_000)
+        y[[17, 4_321, 9_998]] = [100.0, -100.0, 50.0]
+        keep = min_max(x, y, 100)
+        self.assertTrue({17, 4_321, 9_998} <= set(keep.tolist()))
+
+    def test_points_at_one_instant(self):
+        x = np.zeros(10, dtype=np.int64)
+        y = np.array([5.0, 1.0, 9.0, 1.0, 9.0, 3.0, 4.0, 2.0, 8.0, 7.0])
+        self.assertEqual(min_max(x, y, 3).tolist(), [1, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
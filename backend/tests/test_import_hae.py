@@ -0,0 +1,50 @@
+"""Failure detection of the bulk importer (cli.import_hae).
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import unittest
+from datetime import datetime, timezone
+
+from app.apis.ingest import ColumnarPayload, IngestCounts, MetricColumns, decode_columnar
+from cli.import_hae import unwritten_metrics
+
+DAY = datetime(2025, 6, 25, tzinfo=timezone.utc)
+
+
+def payload():
+    delivery = decode_columnar({"data": {
+        "metrics": [{"name": "sleep_analysis", "units": "hr", "data": [
+            {"date": "2025-06-25 00:00:00 +0200", "asleep": 7, "awake": 0.5, "core": 4, "deep": 1.5, "rem": 1.5,
+             "sleepStart": "2025-06-25 00:00:00 +0200", "sleepEnd": "2025-06-25 07:30:00 +0200",
+             "source": "watch", "totalSleep": 7},
+        ]}],
+        "workouts": [{"start": "2025-06-25 06:00:00 +0200", "activeEnergyBurned": {"qty": 500, "units": "kcal"}}],
+    }})
+    # The same name twice, as export.xml records in two units are
+    return ColumnarPayload(
+        [MetricColumns("heart_rate", "count/min", [DAY] * 3, [60.0] * 3),
+         MetricColumns("heart_rate", "bpm", [DAY] * 2, [61.0] * 2)] + delivery.metrics,
+        delivery.workouts,
+    )
+
+
+class UnwrittenMetricsTest(unittest.TestCase):
+    def test_everything_written_or_already_stored(self):
+        counts = IngestCounts()
+        counts.add("metrics", "heart_rate", 3, 3)
+        counts.add("metrics", "heart_rate", 2, 0)
+        counts.add("sleep", "sleep_analysis", 1, 1)
+        counts.add("workouts", "workout", 1, 0)
+        self.assertEqual(unwritten_metrics(payload(), counts), [])
+
+    def test_failed_metrics_are_reported(self):
+        counts = IngestCounts()
+        counts.add("metrics", "heart_rate", 3, 3)
+        self.assertEqual(unwritten_metrics(payload(), counts), ["heart_rate", "sleep_analysis", "workout"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""The columnar decoder against the HealthAutoExportPayload models.
+
+decode_columnar must accept exactly what the Pydantic path accepts, decode
+it to the same columns, and fail with the same 422 otherwise. Mutations of a
+valid delivery are fed to both, from a fixed seed.
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import copy
+import logging
+import random
+import unittest
+
+from fastapi import HTTPException
+
+from app.apis.ingest import ColumnarPayload, decode_columnar, validate_payload
+
+CASES = 5000
+
+# Replacement values for mutated nodes
+VALUES = [
+    None, True, False, 0, 1, -3, 1.5, float("nan"), "", "x", "12", "1.5e3", "true",
+    "2025-06-25 10:00:00 +0200", "2025-06-25T10:00:00Z", "2025-06-25 10:00:00", "2025-13-01 00:00:00 +0000",
+    [], [1], ["x"], {}, {"a": 1}, {"date": "2025-06-25 10:00:00 +0200"},
+    {"date": "2025-06-25 10:00:00 +0200", "qty": 1}, "sleep_analysis", "heart_rate_variability",
+]
+
+
+def valid_delivery():
+    return {
+        "request_id": "r1",
+        "data": {
+            "metrics": [
+                {"name": "heart_rate_variability", "units": "ms", "data": [
+                    {"date": "2025-06-25 10:00:00 +0200", "qty": 41.5},
+                    {"date": "2025-06-25 10:01:00 +0200", "qty": 42},
+                ]},
+                {"name": "sleep_analysis", "units": "hr", "data": [
+                    {"date": "2025-06-25 00:00:00 +0200", "asleep": 7, "awake": 0.5, "core": 4, "deep": 1.5,
+                     "rem": 1.5, "sleepStart": "2025-06-25 00:00:00 +0200", "sleepEnd": "2025-06-25 07:30:00 +0200",
+                     "source": "watch", "totalSleep": 7},
+                ]},
+            ],
+            "workouts": [
+                {"start": "2025-06-25 06:00:00 +0200", "end": "2025-06-25 07:00:00 +0200",
+                 "activeEnergyBurned": {"qty": 500, "units": "kcal"}},
+            ],
+        },
+    }
+
+
+def nodes(node, path=()):
+    """Paths of every node below the root"""
+    children = node.items() if isinstance(node, dict) else enumerate(node) if isinstance(node, list) else ()
+    for key, child in children:
+        yield path + (key,)
+        yield from nodes(child, path + (key,))
+
+
+def mutate(rng, payload):
+    """Replace or delete 1-3 random nodes"""
+    for _ in range(rng.randint(1, 3)):
+        paths = list(nodes(payload))
+        if not paths:
+            return payload
+        path = rng.choice(paths)
+        parent = payload
+        for key in path[:-1]:
+            parent = parent[key]
+        if rng.random() < 0.15:
+            del parent[path[-1]]
+        else:
+            parent[path[-1]] = copy.deepcopy(rng.choice(VALUES))
+    return payload
+
+
+def outcome(decode, payload):
+    try:
+        return "ok", decode(copy.deepcopy(payload))
+    except HTTPException as e:
+        return "error", (e.status_code, e.detail)
+
+
+def decode_with_models(payload):
+    return ColumnarPayload.from_model(validate_payload(payload))
+
+
+class ColumnarDecoderTest(unittest.TestCase):
+    def setUp(self):
+        # Every rejected case logs a warning
+        logging.getLogger("app.ingest").disabled = True
+
+    def tearDown(self):
+        logging.getLogger("app.ingest").disabled = False
+
+    def assert_same_outcome(self, payload):
+        columnar, models = outcome(decode_columnar, payload), outcome(decode_with_models, payload)
+        if columnar[0] == "ok" and models[0] == "ok":
+            # NaN != NaN; compare what they decode to, not identity
+            self.assertEqual(repr(columnar[1]), repr(models[1]), payload)
+        else:
+            self.assertEqual(columnar, models, payload)
+
+    def test_valid_delivery(self):
+        kind, decoded = outcome(decode_columnar, valid_delivery())
+        self.assertEqual(kind, "ok")
+        self.assertEqual(len(decoded.metrics), 2)
+        self.assert_same_outcome(valid_delivery())
+
+    def test_non_list_metrics_and_workouts_are_rejected(self):
+        for key in ("metrics", "workouts"):
+            for value in ({}, "", "x", 0, None):
+                payload = valid_delivery()
+                payload["data"][key] = value
+                with self.subTest(key=key, value=value):
+                    self.assertEqual(outcome(decode_columnar, payload)[0], "error")
+                    self.assert_same_outcome(payload)
+
+    def test_mutations_decode_like_the_models(self):
+        rng = random.Random(20250625)
+        for case in range(CASES):
+            payload = mutate(rng, valid_delivery())
+            with self.subTest(case=case):
+                self.assert_same_outcome(payload)
+
+
+if __name__ == "__main__":
+    unittest.main()
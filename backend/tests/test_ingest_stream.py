@@ -0,0 +1,120 @@
+"""Incremental parsing of HAE bodies (stream_payload) against the buffered decoder.
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import json
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+import app.apis.ingest as ingest
+from app.apis.ingest import MetricColumns, StreamedBody, decode_payload, stream_payload
+
+
+def hrv_points(count):
+    return [{"date": f"2025-06-25 {i // 60:02d}:{i % 60:02d}:00 +0200", "qty": 40.0 + i} for i in range(count)]
+
+
+def sleep_points(count):
+    return [
+        {"date": f"2025-06-{day:02d} 00:00:00 +0200", "asleep": 7, "awake": 0.5, "core": 4, "deep": 1.5, "rem": 1.5,
+         "sleepStart": f"2025-06-{day:02d} 00:00:00 +0200", "sleepEnd": f"2025-06-{day:02d} 07:30:00 +0200",
+         "source": "watch", "totalSleep": 7}
+        for day in range(1, count + 1)
+    ]
+
+
+def metric(order, name, units, data):
+    """A metric object with its keys in `order`, a permutation of "name", "units" and "data" (or a subset)"""
+    fields = {"name": name, "units": units, "data": data}
+    return {key: fields[key] for key in order}
+
+
+async def byte_stream(raw, size=7):
+    for start in range(0, len(raw), size):
+        yield raw[start:start + size]
+
+
+def points_of(decoded):
+    """(name, units, points) per metric of decoded output, chunks of one metric merged"""
+    merged = {}
+    for item in decoded:
+        if isinstance(item, MetricColumns):
+            points = list(zip(item.dates, item.qty))
+        else:
+            points = [entry.model_dump() for entry in item.data]
+        merged.setdefault((item.name, item.units), []).extend(points)
+    return merged
+
+
+class StreamPayloadTest(unittest.IsolatedAsyncioTestCase):
+    async def stream(self, payload, chunk_points=3):
+        chunks = []
+
+        async def on_metric(item):
+            chunks.append(item)
+
+        with mock.patch.object(ingest, "HAE_STREAM_CHUNK_POINTS", chunk_points):
+            delivery = await stream_payload(StreamedBody(byte_stream(json.dumps(payload).encode())), {}, on_metric)
+        return chunks, delivery
+
+    async def test_every_key_order_streams_like_the_buffered_decoder(self):
+        orders = [
+            ("name", "units", "data"), ("name", "data", "units"), ("data", "name", "units"),
+            ("data", "units", "name"), ("units", "data", "name"), ("units", "name", "data"),
+        ]
+        for order in orders:
+            payload = {"data": {"metrics": [
+                metric(order, "heart_rate_variability", "ms", hrv_points(11)),
+                metric(order, "sleep_analysis", "hr", sleep_points(4)),
+            ]}}
+            with self.subTest(order=order):
+                chunks, _ = await self.stream(payload)
+                self.assertEqual(points_of(chunks), points_of(decode_payload(payload).metrics))
+                self.assertTrue(all(len(getattr(chunk, "dates", None) or chunk.data) <= 3 for chunk in chunks))
+
+    async def test_points_before_the_header_are_not_held_in_memory(self):
+        payload = {"data": {"metrics": [metric(("data", "name", "units"), "heart_rate_variability", "ms", hrv_points(50))]}}
+        held = []
+        spill = ingest.tempfile.SpooledTemporaryFile
+
+        def recording_spill(*args, **kwargs):
+            held.append(spill(*args, **kwargs))
+            return held[-1]
+
+        with mock.patch.object(ingest.tempfile, "SpooledTemporaryFile", recording_spill):
+            chunks, _ = await self.stream(payload)
+        self.assertEqual(len(held), 1)
+        self.assertEqual(sum(len(chunk.dates) for chunk in chunks), 50)
+
+    async def test_missing_units_is_rejected_as_by_the_buffered_decoder(self):
+        for order in (("name", "data"), ("data", "name")):
+            payload = {"data": {"metrics": [metric(order, "heart_rate_variability", "ms", hrv_points(10))]}}
+            with self.subTest(order=order):
+                with self.assertRaises(HTTPException) as buffered:
+                    decode_payload(payload)
+                with self.assertRaises(HTTPException) as streamed:
+                    await self.stream(payload)
+                self.assertEqual(streamed.exception.status_code, buffered.exception.status_code)
+                self.assertIn("units", streamed.exception.detail)
+
+    async def test_envelope_and_workouts(self):
+        payload = {
+            "request_id": "r1",
+            "data": {
+                "metrics": [metric(("name", "units", "data"), "heart_rate_variability", "ms", hrv_points(2))],
+                "workouts": [{"start": "2025-06-25 06:00:00 +0200", "end": "2025-06-25 07:00:00 +0200"}],
+            },
+        }
+        chunks, delivery = await self.stream(payload)
+        self.assertEqual(delivery.request_id, "r1")
+        self.assertEqual(len(delivery.workouts), 1)
+        self.assertEqual(points_of(chunks), points_of(decode_payload(payload).metrics))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Pagination cursors of the metrics API (encode_cursor / decode_cursor).
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import base64
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from app.apis.metrics import decode_cursor, encode_cursor
+
+TIMESTAMPS = [
+    datetime(2025, 6, 25, tzinfo=timezone.utc),
+    datetime(2025, 6, 25, 10, 0, 0, 123456, tzinfo=timezone.utc),
+    datetime(2025, 6, 25, 10, tzinfo=timezone(timedelta(hours=2))),
+    datetime(1999, 12, 31, 23, 59, 59, tzinfo=timezone(timedelta(hours=-5, minutes=-30))),
+]
+
+
+def token(payload) -> str:
+    raw = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        for metric in ("heart_rate_variability", "workout", "sleep"):
+            for timestamp in TIMESTAMPS:
+                with self.subTest(metric=metric, timestamp=timestamp):
+                    cursor = encode_cursor(metric, timestamp)
+                    self.assertNotRegex(cursor, r"[=+/]")
+                    decoded = decode_cursor(metric, cursor)
+                    self.assertEqual(decoded, timestamp)
+                    self.assertEqual(decoded.utcoffset(), timestamp.utcoffset())
+
+    def test_cursor_of_another_metric_is_rejected(self):
+        cursor = encode_cursor("workout", TIMESTAMPS[0])
+        with self.assertRaisesRegex(ValueError, "Invalid cursor"):
+            decode_cursor("sleep", cursor)
+
+    def test_malformed_cursors_are_rejected(self):
+        cursors = [
+            "",
+            "not a cursor",
+            "%%%",
+            token(b"\xff\xfe"),
+            token(b"not json"),
+            token([]),
+            token({"m": "workout"}),
+            token({"t": "2025-06-25T00:00:00+00:00"}),
+            token({"m": "workout", "t": None}),
+            token({"m": "workout", "t": "yesterday"}),
+            token({"m": "workout", "t": "2025-06-25T00:00:00"}),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaisesRegex(ValueError, "Invalid cursor"):
+                    decode_cursor("workout", cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
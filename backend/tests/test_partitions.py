@@ -0,0 +1,104 @@
+"""Writes racing the creation of their month's partition.
+
+Needs a PostgreSQL database; each test works in a schema of its own that is
+dropped afterwards. Run from the backend directory:
+
+    TEST_DATABASE_URL=postgresql://... python -m unittest discover -s tests -t .
+"""
+
+import asyncio
+import logging
+import os
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import asyncpg
+
+import app.libs.partitions as partitions
+from app.apis.ingest import ColumnarPayload, MetricColumns, write_payload
+from app.libs.metric_catalog import metric_catalog
+from app.libs.migrations import apply_migrations
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL") or os.environ.get("DATABASE_URL")
+
+MONTH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class PausedConnection:
+    """A connection that stops before the first row copy until `resume` is set"""
+
+    def __init__(self, conn: asyncpg.Connection, paused: asyncio.Event, resume: asyncio.Event):
+        self.conn, self.paused, self.resume = conn, paused, resume
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    async def execute(self, query, *args):
+        if query.lstrip().startswith("INSERT INTO") and not self.paused.is_set():
+            self.paused.set()
+            await self.resume.wait()
+        return await self.conn.execute(query, *args)
+
+
+@unittest.skipUnless(DATABASE_URL, "TEST_DATABASE_URL is not set")
+class PartitionCreationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.schema = f"test_partitions_{uuid.uuid4().hex[:12]}"
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await conn.execute(f'CREATE SCHEMA "{self.schema}"')
+        finally:
+            await conn.close()
+        settings = {"search_path": self.schema}
+        self.pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=4, server_settings=settings)
+        await apply_migrations(self.pool)
+        metric_catalog.start(lambda: asyncpg.connect(DATABASE_URL, server_settings=settings))
+        await metric_catalog.load(self.pool)
+        logging.getLogger("app.ingest").disabled = True
+
+    async def asyncTearDown(self):
+        logging.getLogger("app.ingest").disabled = False
+        await metric_catalog.stop()
+        await self.pool.close()
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await conn.execute(f'DROP SCHEMA "{self.schema}" CASCADE')
+        finally:
+            await conn.close()
+
+    async def test_writes_of_the_month_wait_for_its_partition(self):
+        paused, resume = asyncio.Event(), asyncio.Event()
+        create_partition = partitions._create_partition
+
+        async def paused_create_partition(conn, *args):
+            return await create_partition(PausedConnection(conn, paused, resume), *args)
+
+        dates = [MONTH + timedelta(days=day, hours=12) for day in range(20)]
+        payload = ColumnarPayload(
+            metrics=[MetricColumns("heart_rate_variability", "ms", dates, [40.0 + i for i in range(20)])],
+            workouts=[],
+        )
+
+        with mock.patch.object(partitions, "_create_partition", paused_create_partition):
+            creator = asyncio.create_task(partitions.ensure_partition(self.pool, MONTH))
+            await paused.wait()
+            try:
+                async with self.pool.acquire() as conn:
+                    writer = asyncio.create_task(write_payload(conn, "u1", payload))
+                    await asyncio.sleep(0.5)
+                    waited = not writer.done()
+                    resume.set()
+                    counts = await writer
+            finally:
+                resume.set()
+                self.assertEqual(await creator, "health_metrics_2020_01")
+
+        self.assertTrue(waited)
+        self.assertEqual(counts.processed["metrics"], 20)
+        self.assertEqual(await self.pool.fetchval('SELECT count(*) FROM "health_metrics_2020_01"'), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+"""Rollups against the raw rows they summarize.
+
+Needs a PostgreSQL database; each test works in a schema of its own that is
+dropped afterwards. Run from the backend directory:
+
+    TEST_DATABASE_URL=postgresql://... python -m unittest discover -s tests -t .
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import asyncpg
+
+from app.libs.migrations import MIGRATIONS_DIR, apply_migrations
+from app.libs.rollups import SLEEP_EFFICIENCY, SLEEP_HOURS, range_stats, rebuild_rollups
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL") or os.environ.get("DATABASE_URL")
+
+START = datetime(2025, 6, 24, tzinfo=timezone.utc)
+USERS = ["u1", "u2"]
+METRICS = ["heart_rate_variability", "workout"]
+
+# Raw points of each rolled-up metric as (user_id, metric_name, timestamp, value)
+RAW_POINTS = f"""
+    SELECT h.user_id, c.name AS metric_name, h.timestamp, h.value
+    FROM health_metrics h
+    JOIN metric_catalog c ON c.id = h.metric_id
+    UNION ALL
+    SELECT user_id, '{SLEEP_HOURS}', start_time, duration_total_minutes / 60.0::double precision
+    FROM sleep_metrics
+    UNION ALL
+    SELECT user_id, '{SLEEP_EFFICIENCY}', start_time, efficiency
+    FROM sleep_metrics
+"""
+
+
+@unittest.skipUnless(DATABASE_URL, "TEST_DATABASE_URL is not set")
+class RollupsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.schema = f"test_rollups_{uuid.uuid4().hex[:12]}"
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await conn.execute(f'CREATE SCHEMA "{self.schema}"')
+        finally:
+            await conn.close()
+        self.pool = await asyncpg.create_pool(
+            DATABASE_URL, min_size=1, max_size=2, server_settings={"search_path": self.schema}
+        )
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await conn.execute(f'DROP SCHEMA "{self.schema}" CASCADE')
+        finally:
+            await conn.close()
+
+    async def apply_migrations_before(self, version: int) -> None:
+        """Apply the migrations numbered below `version` only"""
+        directory = Path(tempfile.mkdtemp())
+        try:
+            for path in MIGRATIONS_DIR.glob("*.sql"):
+                if int(path.name.split("_", 1)[0]) < version:
+                    shutil.copy(path, directory)
+            await apply_migrations(self.pool, directory)
+        finally:
+            shutil.rmtree(directory)
+
+    async def insert_raw_rows(self, seed: int) -> None:
+        """Irregular points over four days, plus nightly sleep sessions"""
+        rng = random.Random(seed)
+        async with self.pool.acquire() as conn:
+            for name in METRICS:
+                metric_id = await conn.fetchval("INSERT INTO metric_catalog (name) VALUES ($1) RETURNING id", name)
+                for user_id in USERS:
+                    offsets = sorted(rng.sample(range(4 * 86400), 3000))
+                    await conn.executemany(
+                        "INSERT INTO health_metrics (user_id, metric_id, timestamp, value) VALUES ($1, $2, $3, $4)",
+                        [(user_id, metric_id, START + timedelta(seconds=s), rng.uniform(20, 120)) for s in offsets]
+                    )
+            for user_id in USERS:
+                await conn.executemany(
+                    """
+                    INSERT INTO sleep_metrics (user_id, start_time, end_time, duration_total_minutes, efficiency)
+                    VALUES ($1, $2::timestamptz, $2::timestamptz + interval '8 hours', $3, $4)
+                    """,
+                    [
+                        (user_id, START + timedelta(days=day, hours=22, minutes=rng.randint(0, 90)),
+                         rng.randint(300, 520), None if day == 2 else rng.uniform(70, 98))
+                        for day in range(4)
+                    ]
+                )
+
+    async def assert_rollups_match_raw(self) -> None:
+        mismatches = await self.pool.fetch(
+            f"""
+            WITH expected AS (
+                SELECT p.user_id, p.metric_name, res.resolution,
+                       date_trunc(res.resolution, p.timestamp, 'UTC') AS bucket,
+                       count(*) AS count, sum(p.value) AS sum, min(p.value) AS min, max(p.value) AS max
+                FROM ({RAW_POINTS}) p
+                CROSS JOIN (VALUES ('hour'), ('day')) AS res(resolution)
+                WHERE p.value IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+            )
+            SELECT *
+            FROM expected e
+            FULL JOIN metric_rollups r USING (user_id, metric_name, resolution, bucket)
+            WHERE e.count IS DISTINCT FROM r.count
+            OR abs(e.sum - r.sum) > 1e-6 OR e.min IS DISTINCT FROM r.min OR e.max IS DISTINCT FROM r.max
+            """
+        )
+        self.assertEqual([dict(row) for row in mismatches], [])
+
+    async def test_migration_backfills_existing_rows(self):
+        await self.apply_migrations_before(7)
+        await self.insert_raw_rows(seed=1)
+        self.assertEqual(await self.pool.fetchval("SELECT count(*) FROM metric_rollups"), 0)
+
+        await apply_migrations(self.pool)
+
+        self.assertGreater(await self.pool.fetchval("SELECT count(*) FROM metric_rollups"), 0)
+        await self.assert_rollups_match_raw()
+
+    async def test_range_stats_match_raw_rows(self):
+        await apply_migrations(self.pool)
+        await self.insert_raw_rows(seed=2)
+        async with self.pool.acquire() as conn:
+            for user_id in USERS:
+                await rebuild_rollups(conn, user_id)
+        await self.assert_rollups_match_raw()
+
+        rng = random.Random(3)
+        async with self.pool.acquire() as conn:
+            for metric_name in METRICS + [SLEEP_HOURS, SLEEP_EFFICIENCY]:
+                for _ in range(100):
+                    start = START + timedelta(minutes=rng.randint(-60, 5000), seconds=rng.choice([0, 0, 30]))
+                    end = start + timedelta(minutes=rng.randint(0, 3000))
+                    start = None if rng.random() < 0.1 else start
+                    end = None if rng.random() < 0.1 else end
+
+                    stats = await range_stats(conn, "u1", metric_name, start, end)
+                    expected = await conn.fetchrow(
+                        f"""
+                        SELECT count(value) AS count, coalesce(sum(value), 0) AS sum,
+                               min(value) AS min, max(value) AS max
+                        FROM ({RAW_POINTS}) p
+                        WHERE user_id = 'u1' AND metric_name = $1
+                        AND ($2::timestamptz IS NULL OR timestamp >= $2)
+                        AND ($3::timestamptz IS NULL OR timestamp <= $3)
+                        """,
+                        metric_name, start, end
+                    )
+                    with self.subTest(metric=metric_name, start=start, end=end):
+                        self.assertEqual(stats.count, expected["count"])
+                        self.assertAlmostEqual(stats.sum, expected["sum"], places=6)
+                        self.assertEqual(stats.min, expected["min"])
+                        self.assertEqual(stats.max, expected["max"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""The fast Swift/ObjC datetime parser against the strptime / ISO 8601 parsing it replaces.
+
+Run from the backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import random
+import unittest
+from datetime import datetime
+
+from app.libs.swift_datetime import SWIFT_DATETIME_FORMAT, coerce_swift_datetime, parse_swift_datetime, parse_swift_datetimes
+
+CASES = 20000
+
+VALID = [
+    "2025-06-25 00:00:00 +0200",
+    "2025-01-01 23:59:59 -0530",
+    "2024-02-29 12:00:00 +0000",
+    "1999-12-31 23:59:59 +1400",
+    "2025-06-25 00:00:00 -1200",
+]
+
+# Characters substituted into valid timestamps
+ALPHABET = "0123456789-: +Tz.Z٣２x"
+
+
+def reference(value: str) -> datetime:
+    """The parsing before the fast path: strptime, then ISO 8601"""
+    try:
+        return datetime.strptime(value, SWIFT_DATETIME_FORMAT)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def outcome(parse, value):
+    try:
+        parsed = parse(value)
+        return "ok", parsed, parsed.utcoffset()
+    except Exception as e:
+        return "error", type(e), str(e)
+
+
+def mutate(rng: random.Random, value: str) -> str:
+    """Replace, insert or delete 1-2 characters"""
+    for _ in range(rng.randint(1, 2)):
+        position = rng.randrange(len(value) + 1)
+        action = rng.random()
+        if action < 0.6 and position < len(value):
+            value = value[:position] + rng.choice(ALPHABET) + value[position + 1:]
+        elif action < 0.8:
+            value = value[:position] + rng.choice(ALPHABET) + value[position:]
+        else:
+            value = value[:position] + value[position + 1:]
+    return value
+
+
+class SwiftDatetimeTest(unittest.TestCase):
+    def assert_same_outcome(self, value):
+        expected = outcome(reference, value)
+        self.assertEqual(outcome(parse_swift_datetime, value), expected, value)
+        self.assertEqual(outcome(lambda v: parse_swift_datetimes([v])[0], value), expected, value)
+        self.assertEqual(outcome(coerce_swift_datetime, value), expected, value)
+
+    def test_valid_timestamps(self):
+        for value in VALID + ["2025-06-25T00:00:00Z", "2025-06-25T00:00:00.250+02:00", "2025-06-25"]:
+            with self.subTest(value=value):
+                self.assert_same_outcome(value)
+
+    def test_mutations_parse_like_strptime(self):
+        rng = random.Random(20250625)
+        for case in range(CASES):
+            value = mutate(rng, rng.choice(VALID))
+            with self.subTest(case=case, value=value):
+                self.assert_same_outcome(value)
+
+    def test_column_matches_single_values(self):
+        rng = random.Random(7)
+        values = [rng.choice(VALID) for _ in range(200)] + ["2025-06-25 00:00:00 +2359", "2025-06-25T00:00:00Z"]
+        self.assertEqual(parse_swift_datetimes(values), [reference(value) for value in values])
+
+    def test_coerce_passes_other_types_through(self):
+        now = datetime(2025, 6, 25)
+        for value in (now, None, 0, 1.5):
+            self.assertIs(coerce_swift_datetime(value), value)
+
+
+if __name__ == "__main__":
+    unittest.main()